@@ -0,0 +1,76 @@
+"""
+Benchmarks for the request size estimator in `goldfinch.constraints`: the time
+taken to import it in a fresh interpreter (which every worker pays at startup),
+compared with importing `scipy.integrate` as the estimator used to, the time
+to score the months of a long request one at a time and all at once, and the
+time of `check_request_size()` for a few to many stations, from the table size
+model and from a size catalogue.
+
+Run with::
+
+    $ make bench
+"""
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from goldfinch import constraints
+from goldfinch.constraints import check_request_size, estimate_request_size, estimate_request_sizes
+from goldfinch.size_catalogue import SizeCatalogue
+from goldfinch.time_split import DurationSplitter
+
+START, END = '19570101', '20251231'
+
+STATION_COUNTS = [1, 100, 10000]
+
+
+def _import(module):
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+
+
+@pytest.mark.parametrize('module', ['goldfinch.constraints', 'scipy.integrate'])
+def test_bench_startup_import(benchmark, module):
+    if module.startswith('scipy'):
+        pytest.importorskip('scipy')
+
+    benchmark.group = 'constraints-import'
+    benchmark.pedantic(_import, args=(module,), rounds=5)
+
+
+@pytest.fixture(scope='module')
+def months():
+    months = DurationSplitter().splitDuration(START, END, 'month')
+    return [start.date for start, _ in months], [end.date for _, end in months]
+
+
+def test_bench_estimate_each_month(benchmark, months):
+    benchmark.group = 'constraints-estimate-months'
+    benchmark(lambda: [estimate_request_size('TD', 100, start, end) for start, end in zip(*months)])
+
+
+def test_bench_estimate_all_months(benchmark, months):
+    benchmark.group = 'constraints-estimate-months'
+    benchmark(estimate_request_sizes, 'TD', 100, *months)
+
+
+@pytest.mark.parametrize('source', ['model', 'catalogue'])
+@pytest.mark.parametrize('n_stations', STATION_COUNTS)
+def test_bench_check_request_size(benchmark, monkeypatch, n_stations, source):
+    station_list = [str(src_id) for src_id in range(1, n_stations + 1)]
+    catalogue = None
+
+    if source == 'catalogue':
+        # Every station reporting 100 kB in each year
+        years = np.arange(1957, 2026)
+        src_ids = np.arange(1, n_stations + 1)
+        catalogue = SizeCatalogue('TD', np.repeat(years, n_stations), np.tile(src_ids, len(years)),
+                                  np.full(len(years) * n_stations, 100000))
+
+    monkeypatch.setattr(constraints, 'get_size_catalogue', lambda table: catalogue)
+    monkeypatch.setenv('MIDAS_TEST_REQUEST_SIZE_LIMIT', str(10 ** 15))
+    inputs = {'obs_table': 'TD', 'start': START + '0000', 'end': END + '2359'}
+
+    benchmark.group = f'check_request_size-{n_stations}'
+    assert benchmark(check_request_size, station_list, inputs) > 0
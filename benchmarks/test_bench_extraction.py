@@ -0,0 +1,132 @@
+"""
+End-to-end benchmarks for `filter_obs_by_time_chunk()`, planning the yearly
+chunks of a request and extracting them with the "mmap" engine from a synthetic
+TD table, at several sizes of archive, with and without offset indexes, for all
+stations and for a few of them, and for a few stations through an empty slice
+cache.
+
+Run with::
+
+    $ make bench
+"""
+import os
+from datetime import date, timedelta
+
+import pytest
+
+from goldfinch import offset_index as offset_index_module
+from goldfinch import util
+from goldfinch.archive import find_year_files
+from goldfinch.engines import ENGINE_ENV_VAR
+from goldfinch.offset_index import OffsetIndex, get_header_path, get_offsets_path
+from goldfinch.slice_cache import SliceCache
+from goldfinch.util import filter_obs_by_time_chunk
+
+HEADER = b"ob_end_time, id_type, id, ob_hour_count, version_num, met_domain_name, src_id, max_air_temp\r\n"
+
+# (number of stations, number of years) of daily observations, from 2010
+SCALES = [(10, 2), (100, 5), pytest.param((200, 10), marks=pytest.mark.slow)]
+
+# Stations selected by the "few stations" requests
+N_SELECTED = 5
+
+
+def _year_file(year, n_stations):
+    "Returns the rows of a year of daily observations of `n_stations` stations, in time order."
+    day = date(year, 1, 1)
+    rows = []
+
+    while day.year == year:
+        stamp = day.strftime('%Y-%m-%d')
+        rows.extend(f"{stamp} 09:00, DCNN, 1, 24, 1, DLY3208, {src_id}, {src_id % 30}.5\r\n"
+                    for src_id in range(1, n_stations + 1))
+        day += timedelta(days=1)
+
+    return ''.join(rows).encode()
+
+
+@pytest.fixture(scope='module', params=SCALES, ids=lambda scale: '{}_stations-{}_years'.format(*scale))
+def archive(request, tmp_path_factory):
+    (n_stations, n_years) = request.param
+    root = tmp_path_factory.mktemp('archive')
+    table_dir = root / 'archive' / 'TD' / 'yearly_files'
+    table_dir.mkdir(parents=True)
+
+    for year in range(2010, 2010 + n_years):
+        (table_dir / f'midas_tempdrnl_{year}01-{year}12.txt').write_bytes(_year_file(year, n_stations))
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('MIDAS_DATA_DIR', str(root / 'archive'))
+        patch.setenv(ENGINE_ENV_VAR, 'mmap')
+        patch.setattr(offset_index_module, 'get_index_dir', lambda: str(root / 'index'))
+        patch.setattr(util, 'get_availability_index', lambda table: None)
+
+        (root / 'index' / 'TD').mkdir(parents=True)
+        with open(get_header_path('TD'), 'wb') as writer:
+            writer.write(HEADER)
+
+        yield root, n_stations, n_years
+
+
+@pytest.fixture(params=[False, True], ids=['unindexed', 'indexed'])
+def indexed_archive(request, archive):
+    (root, n_stations, n_years) = archive
+
+    for paths in find_year_files('TD').values():
+        offsets_path = get_offsets_path('TD', paths[0])
+
+        if request.param:
+            OffsetIndex.build('TD', paths[0]).save(offsets_path)
+        elif os.path.exists(offsets_path):
+            os.remove(offsets_path)
+
+    return archive
+
+
+@pytest.mark.parametrize('selection', ['all', 'few'])
+def test_bench_filter_obs_by_time_chunk(benchmark, indexed_archive, tmp_path, selection):
+    (root, n_stations, n_years) = indexed_archive
+    src_ids = [] if selection == 'all' else [str(src_id) for src_id in range(1, N_SELECTED + 1)]
+    end_year = 2010 + n_years - 1
+
+    benchmark.group = f'filter_obs_by_time_chunk-{selection}-{n_stations}x{n_years}'
+    output_paths = benchmark.pedantic(
+        filter_obs_by_time_chunk, args=('TD', str(tmp_path / 'output')),
+        kwargs=dict(start='201001010000', end=f'{end_year}12312359', src_ids=src_ids, delimiter='comma',
+                    chunk_rule='year', tmp_dir=str(tmp_path), processes=1),
+        rounds=3, iterations=1)
+
+    assert len(output_paths) == n_years
+
+    with open(output_paths[0], 'rb') as reader:
+        rows = reader.read().count(b'\n') - 1
+
+    assert rows == 365 * (n_stations if selection == 'all' else N_SELECTED)
+
+
+def test_bench_slice_cache_cold(benchmark, indexed_archive, tmp_path, monkeypatch):
+    "A few stations through an empty slice cache, grouped with the same extraction without the cache."
+    (root, n_stations, n_years) = indexed_archive
+    src_ids = [str(src_id) for src_id in range(1, N_SELECTED + 1)]
+    end_year = 2010 + n_years - 1
+    cache_dir = str(tmp_path / 'slices')
+
+    monkeypatch.setattr(util, 'get_slice_cache', lambda: SliceCache(cache_dir, 10 ** 10))
+    kwargs = dict(start='201001010000', end=f'{end_year}12312359', src_ids=src_ids, delimiter='comma',
+                  chunk_rule='year', tmp_dir=str(tmp_path), processes=1)
+
+    # The first request creates the cache database and keeps the header of the table
+    filter_obs_by_time_chunk('TD', str(tmp_path / 'first'), **kwargs)
+
+    def empty_slice_cache():
+        cache = SliceCache(cache_dir, 0)
+        cache.evict()
+        cache.close()
+
+    benchmark.group = f'filter_obs_by_time_chunk-few-{n_stations}x{n_years}'
+    output_paths = benchmark.pedantic(
+        filter_obs_by_time_chunk, args=('TD', str(tmp_path / 'output')), kwargs=kwargs,
+        setup=empty_slice_cache, rounds=3, iterations=1)
+
+    with open(output_paths[0], 'rb') as reader:
+        assert reader.read().count(b'\n') - 1 == 365 * N_SELECTED
@@ -0,0 +1,64 @@
+"""
+Benchmarks for bounding box, radius and nearest-neighbour queries of the
+station index, on synthetic stations spread over the UK, compared with a
+full scan of the station arrays.
+
+Run with::
+
+    $ make bench
+"""
+import numpy as np
+import pytest
+
+from goldfinch.station_index import StationIndex
+
+SCALES = [10000, 100000]
+
+# A county-sized box and a box covering most of the UK
+BBOXES = {'small': (-4.0, 50.5, -3.5, 51.0), 'large': (-8.0, 50.0, 2.0, 59.0)}
+
+
+def make_stations(n, seed=0):
+    "Returns a StationIndex of `n` synthetic stations."
+    rand = np.random.default_rng(seed)
+    counties = ['DEVON', 'KENT', 'SURREY', 'POWYS (NORTH)', 'HIGHLAND']
+    start_dates = rand.integers(1900, 2020, n) * 10000 + 101
+
+    return StationIndex(src_ids=np.arange(1, n + 1), lats=rand.uniform(49, 61, n),
+                        lons=rand.uniform(-12, 3, n), counties=rand.choice(counties, n).tolist(),
+                        start_dates=start_dates, end_dates=start_dates + 100000,
+                        data_types=[['DCNN'] if i % 2 else ['RAIN', 'WMO'] for i in range(n)])
+
+
+@pytest.fixture(scope='module', params=SCALES, ids=lambda n: f'{n}_stations')
+def station_index(request):
+    return make_stations(request.param)
+
+
+def _scan_bbox(index, w, s, e, n):
+    mask = (index.lats >= s) & (index.lats <= n) & (index.lons >= w) & (index.lons <= e)
+    return [str(src_id) for src_id in index.src_ids[mask]]
+
+
+@pytest.mark.parametrize('size', BBOXES)
+def test_bench_bbox_grid(benchmark, station_index, size):
+    benchmark.group = f'bbox-{size}-{len(station_index)}'
+    result = benchmark(station_index.select, bbox=BBOXES[size])
+    assert result == _scan_bbox(station_index, *BBOXES[size])
+
+
+@pytest.mark.parametrize('size', BBOXES)
+def test_bench_bbox_scan(benchmark, station_index, size):
+    benchmark.group = f'bbox-{size}-{len(station_index)}'
+    benchmark(_scan_bbox, station_index, *BBOXES[size])
+
+
+def test_bench_radius(benchmark, station_index):
+    benchmark.group = f'radius-{len(station_index)}'
+    benchmark(station_index.within_radius, 51.5, -0.1, 25)
+
+
+def test_bench_nearest(benchmark, station_index):
+    benchmark.group = f'nearest-{len(station_index)}'
+    result = benchmark(station_index.nearest, 51.5, -0.1, 10)
+    assert len(result) == 10
@@ -0,0 +1,62 @@
+"""
+Benchmarks for the three ways the processes select stations, at several numbers
+of stations: `get_station_list()` by county and by bounding box, from a
+synthetic station index and the availability index of a table, and
+`get_job_station_list()` for the stations selected by an earlier job (the
+`input_job_id` input).
+
+Run with::
+
+    $ make bench
+"""
+import numpy as np
+import pytest
+
+from goldfinch import util
+from goldfinch.availability import AvailabilityIndex
+from goldfinch.job_registry import JobRegistry
+from benchmarks.test_bench_station_index import make_stations
+
+SCALES = [1000, 10000, pytest.param(100000, marks=pytest.mark.slow)]
+
+START, END = '200001010000', '200912312359'
+COUNTIES = ['DEVON', 'KENT']
+BBOX = (-5.0, 50.0, 0.0, 53.0)
+
+
+@pytest.fixture(scope='module', params=SCALES, ids=lambda n: f'{n}_stations')
+def station_index(request):
+    return make_stations(request.param)
+
+
+@pytest.fixture(scope='module')
+def availability(station_index):
+    "An availability index of the TD table with every other station reporting in each year."
+    years = np.arange(1990, 2020)
+    src_ids = station_index.src_ids[::2]
+    return AvailabilityIndex('TD', np.repeat(years, len(src_ids)), np.tile(src_ids, len(years)))
+
+
+@pytest.mark.parametrize('selection', ['county', 'bbox'])
+def test_bench_get_station_list(benchmark, station_index, availability, monkeypatch, tmp_path, selection):
+    monkeypatch.setattr(util, 'get_station_index', lambda: station_index)
+    monkeypatch.setattr(util, 'get_availability_index', lambda table: availability)
+    kwargs = dict(counties=COUNTIES, bbox=None) if selection == 'county' else dict(counties=[], bbox=BBOX)
+
+    benchmark.group = f'get_station_list-{selection}-{len(station_index)}'
+    result = benchmark(util.get_station_list, start=START, end=END, output_file=str(tmp_path / 'stations.txt'),
+                       obs_table='TD', **kwargs)
+    assert set(result).issubset(str(src_id) for src_id in availability.src_ids.tolist())
+
+
+def test_bench_get_job_station_list(benchmark, station_index, monkeypatch, tmp_path):
+    registry_path = str(tmp_path / 'jobs.sqlite')
+    registry = JobRegistry(registry_path)
+    registry.register('job-1', 'GetWeatherStations', str(tmp_path), 'weather_stations.txt',
+                      station_index.src_ids.tolist())
+    registry.close()
+    monkeypatch.setattr(util, 'get_job_registry', lambda: JobRegistry(registry_path))
+
+    benchmark.group = f'get_station_list-job_id-{len(station_index)}'
+    result = benchmark(util.get_job_station_list, 'job-1')
+    assert len(result) == len(station_index)
@@ -0,0 +1,51 @@
+"""
+Micro-benchmarks for `DurationSplitter.splitDuration()` for each chunk unit
+over short and long requests, compared with the original day-by-day walk over
+the longest date range the service accepts. The "auto" unit is timed with the
+table size model for a few and many stations.
+
+Run with::
+
+    $ make bench
+"""
+import pytest
+
+from goldfinch.constraints import estimate_request_sizes
+from goldfinch.time_split import DurationSplitter
+from tests.test_time_split import CALENDAR_CHUNK_UNITS, legacy_split_duration
+
+START, END = '18500101', '20251231'
+
+SPANS = {
+    '1_year': ('20170101', '20171231'),
+    '25_years': ('20010101', '20251231'),
+    'full': (START, END),
+}
+
+TARGET_SIZE = 200 * 1024 ** 2
+
+
+@pytest.mark.parametrize('span', SPANS)
+@pytest.mark.parametrize('chunk_unit', CALENDAR_CHUNK_UNITS)
+def test_bench_split_duration(benchmark, chunk_unit, span):
+    benchmark.group = f'split_duration-{chunk_unit}-{span}'
+    benchmark(DurationSplitter().splitDuration, *SPANS[span], chunk_unit)
+
+
+@pytest.mark.parametrize('chunk_unit', CALENDAR_CHUNK_UNITS)
+def test_bench_split_duration_legacy(benchmark, chunk_unit):
+    benchmark.group = f'split_duration-{chunk_unit}-full'
+    benchmark.pedantic(legacy_split_duration, args=(START, END, chunk_unit), rounds=3)
+
+
+@pytest.mark.parametrize('n_stations', [10, 1000])
+@pytest.mark.parametrize('span', SPANS)
+def test_bench_split_duration_auto(benchmark, span, n_stations):
+    splitter = DurationSplitter(
+        sizes_estimator=lambda starts, ends: estimate_request_sizes(
+            'TD', n_stations, [s.date for s in starts], [e.date for e in ends]),
+        target_size=TARGET_SIZE)
+
+    benchmark.group = f'split_duration-auto-{span}'
+    chunks = benchmark(splitter.splitDuration, *SPANS[span], 'auto')
+    assert chunks[0][0].date == SPANS[span][0] and chunks[-1][1].date == SPANS[span][1]
@@ -4,4 +4,13 @@
 
 from .__version__ import __author__, __email__, __version__  # noqa: F401
 
-from .wsgi import application  # noqa: F401
+
+def __getattr__(name):
+    # The WSGI application is only created when it is first used, so that the
+    # modules of the package (e.g. in an async job subprocess) can be imported
+    # without loading the configuration and constructing every process.
+    if name == 'application':
+        from .wsgi import application
+        return application
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,209 @@
+"""
+archive.py
+==========
+
+Helpers for locating and reading the MIDAS data in the archive. The locations
+are taken from the same environment variables as the `midas_extract` package.
+
+Each table directory holds yearly files (e.g. `TD/yearly_files/midas_tempdrnl_201701-201712.txt`)
+of comma-separated rows, one observation per row.
+"""
+
+import contextvars
+import glob
+import os
+import re
+from contextlib import contextmanager
+
+import numpy as np
+from pywps import configuration
+
+
+DEFAULT_MIDAS_DATA_DIR = '/badc/ukmo-midas/data'
+DEFAULT_MIDAS_METADATA_DIR = '/badc/ukmo-midas/metadata'
+
+
+def get_data_dir():
+    "Returns the directory holding the MIDAS data, one sub-directory per table."
+    return os.environ.get('MIDAS_DATA_DIR', DEFAULT_MIDAS_DATA_DIR)
+
+
+def get_metadata_dir():
+    "Returns the directory holding the MIDAS metadata (station and capability tables)."
+    return os.environ.get('MIDAS_METADATA_DIR', DEFAULT_MIDAS_METADATA_DIR)
+
+
+# Zero-based positions of the (observation time, src_id) fields in the rows of
+# each table, following the MIDAS table definitions. A header line at the top of
+# a data file takes precedence.
+TABLE_LAYOUTS = {
+    'TD': (0, 6),
+    'WD': (0, 5),
+    'RH': (0, 6),
+    'RD': (2, 7),
+    'WM': (0, 6),
+    'WH': (0, 5),
+    'RO': (2, 6),
+    'ST': (2, 5),
+}
+
+# Names of the observation time column, in order of preference
+TIME_COLUMN_NAMES = ('ob_end_time', 'ob_time', 'ob_date')
+
+YEAR_FILE_PATTERN = re.compile(r'(\d{4})\d{2}-\d{6}\.txt$')
+
+
+def get_index_dir():
+    """
+    Returns the directory of the archive indexes built by `goldfinch index build`,
+    as set by `indexdir` in the `[server]` section of the configuration, or None.
+    """
+    return configuration.get_config_value('server', 'indexdir') or None
+
+
+def find_year_files(table):
+    """
+    Returns a dictionary of year: sorted list of data file paths for `table`.
+    """
+    year_files = {}
+
+    for path in sorted(glob.glob(os.path.join(get_data_dir(), table, '**', '*.txt'), recursive=True)):
+        match = YEAR_FILE_PATTERN.search(os.path.basename(path))
+
+        if match:
+            year_files.setdefault(int(match.group(1)), []).append(path)
+
+    return year_files
+
+
+def get_layout(table, path=None):
+    """
+    Returns (time index, src_id index, number of header lines) for the rows of
+    `table`, from the header line of the data file at `path` if it has one.
+    Raises KeyError for tables of unknown layout.
+    """
+    if path:
+        with open(path, 'rb') as reader:
+            names = [name.strip().lower().decode('ascii', 'ignore') for name in reader.readline().split(b',')]
+
+        if 'src_id' in names:
+            time_index = next((names.index(name) for name in TIME_COLUMN_NAMES if name in names), 0)
+            return time_index, names.index('src_id'), 1
+
+    time_index, src_id_index = TABLE_LAYOUTS[table]
+    return time_index, src_id_index, 0
+
+
+def get_header_layout(header):
+    """
+    Returns (time index, src_id index) from the header line (bytes) of an output
+    file, or None if it does not name a src_id column.
+    """
+    names = [name.strip().lower().decode('ascii', 'ignore') for name in header.split(b',')]
+
+    if 'src_id' not in names:
+        return None
+
+    time_index = next((names.index(name) for name in TIME_COLUMN_NAMES if name in names), 0)
+    return time_index, names.index('src_id')
+
+
+def parse_time(field):
+    """
+    Returns a time field of a row (bytes or str) as a string YYYYMMDDHHMM. Dates
+    without a time of day are taken as midnight.
+    """
+    if isinstance(field, bytes):
+        field = field.decode('ascii', 'ignore')
+
+    return re.sub(r'\D', '', field)[:12].ljust(12, '0')
+
+
+def to_days(dates):
+    """
+    Returns an array of the days (numpy datetime64) of `dates`, given as strings
+    starting YYYYMMDD or YYYY-MM-DD, or as date or datetime instances.
+    """
+    days = []
+
+    for date in dates:
+        digits = str(date).replace('-', '')[:8]
+        days.append('%s-%s-%s' % (digits[:4], digits[4:6], digits[6:8]))
+
+    return np.array(days, dtype='datetime64[D]')
+
+
+def parse_src_ids(src_ids):
+    """
+    Returns the integer values of `src_ids` (str or int, possibly padded with
+    spaces or zeros), leaving out the IDs that are not numbers, which match no
+    row of the archive.
+    """
+    values = []
+
+    for src_id in src_ids:
+        try:
+            values.append(int(src_id))
+        except (TypeError, ValueError):
+            pass
+
+    return values
+
+
+# Modification times of the tables found within `archive_mtime_scope()`
+_archive_mtimes = contextvars.ContextVar('archive_mtimes', default=None)
+
+
+@contextmanager
+def archive_mtime_scope():
+    """
+    Context manager within which `get_archive_mtime()` walks the data directory
+    of each table only once, e.g. for the whole of a job, where the availability
+    index, the size catalogue and the result and slice caches all check it.
+    """
+    token = _archive_mtimes.set({})
+
+    try:
+        yield
+    finally:
+        _archive_mtimes.reset(token)
+
+
+def get_archive_mtime(table):
+    """
+    Returns the latest modification time of the data directory of `table` or any
+    file or directory below it, so that it changes whenever a file is added,
+    replaced or modified. Returns 0 if the directory does not exist.
+
+    Within `archive_mtime_scope()`, the time found by the first call for the
+    table is returned.
+    """
+    scope = _archive_mtimes.get()
+
+    if scope is not None:
+        if table not in scope:
+            scope[table] = _find_archive_mtime(table)
+
+        return scope[table]
+
+    return _find_archive_mtime(table)
+
+
+def _find_archive_mtime(table):
+    table_dir = os.path.join(get_data_dir(), table)
+
+    if not os.path.isdir(table_dir):
+        return 0
+
+    latest = os.stat(table_dir).st_mtime
+    dirs = [table_dir]
+
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                latest = max(latest, entry.stat().st_mtime)
+
+                if entry.is_dir():
+                    dirs.append(entry.path)
+
+    return latest
@@ -0,0 +1,114 @@
+"""
+availability.py
+===============
+
+Holds class AvailabilityIndex, an index of the years in which each station has
+observations in a MIDAS table, so that stations and time chunks with no data
+can be left out of an extraction without scanning the archive.
+
+The indexes are built by `goldfinch index build` and saved, one file per table,
+in the directory set by `indexdir` in the `[server]` section of the configuration.
+"""
+
+import os
+
+import numpy as np
+
+from goldfinch.archive import get_index_dir, parse_src_ids
+from goldfinch.year_index import YearStationIndex, load_year_index
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+AVAILABILITY_FILE_NAME = '{}.availability.npz'
+
+
+def get_availability_path(table, index_dir=None):
+    "Returns the path of the availability index file for `table`."
+    return os.path.join(index_dir or get_index_dir(), AVAILABILITY_FILE_NAME.format(table))
+
+
+class AvailabilityIndex(YearStationIndex):
+    """
+    Index of the (year, src_id) pairs with at least one observation in `table`
+    (see `goldfinch.year_index.YearStationIndex`).
+    """
+
+    DESCRIPTION = 'availability index'
+
+    @classmethod
+    def from_year_sizes(cls, table, year_sizes, archive_mtime=0):
+        "Returns the index for a dictionary of year: {src_id: number of bytes}."
+        return cls.from_year_stations(table, year_sizes, archive_mtime=archive_mtime)
+
+    @classmethod
+    def from_year_stations(cls, table, year_src_ids, archive_mtime=0):
+        "Returns the index for a dictionary of year: src_ids with data in that year."
+        years, src_ids = [], []
+
+        for year, year_ids in sorted(year_src_ids.items()):
+            year_ids = set(int(src_id) for src_id in year_ids)
+            LOGGER.info('Found {} stations in {} for {}'.format(len(year_ids), table, year))
+
+            years.extend([year] * len(year_ids))
+            src_ids.extend(year_ids)
+
+        return cls(table, years, src_ids, archive_mtime=archive_mtime)
+
+    def stations(self, start_year, end_year):
+        "Returns a sorted array of the src_ids with data in any year from `start_year` to `end_year`."
+        return np.unique(self.src_ids[self._year_range(start_year, end_year)])
+
+    def filter_stations(self, src_ids, start_year, end_year):
+        """
+        Returns the members of `src_ids` (in their original order) with data in
+        any year from `start_year` to `end_year`. IDs that are not integers are
+        kept, so that they are reported by the extraction as before.
+        """
+        available = set(self.stations(start_year, end_year).tolist())
+        kept = []
+
+        for src_id in src_ids:
+            try:
+                if int(src_id) not in available:
+                    continue
+            except ValueError:
+                pass
+
+            kept.append(src_id)
+
+        return kept
+
+    def years_with_data(self, src_ids, start_year, end_year):
+        """
+        Returns a sorted list of the years from `start_year` to `end_year` in which
+        any of `src_ids` has data. If `src_ids` is empty (all stations), returns
+        the years in which any station has data.
+        """
+        year_range = self._year_range(start_year, end_year)
+        years = self.years[year_range]
+
+        if src_ids:
+            wanted = parse_src_ids(src_ids)
+
+            # Cannot rule out any year for an ID the index does not know
+            if len(wanted) < len(src_ids):
+                return list(range(start_year, end_year + 1))
+
+            years = years[np.isin(self.src_ids[year_range], wanted)]
+
+        return np.unique(years).tolist()
+
+
+def get_availability_index(table):
+    """
+    Returns the AvailabilityIndex of `table`, loaded once per process from the
+    index directory (and again whenever the file changes). Returns None if no
+    index directory is configured, there is no index for the table, or the
+    archive has changed since the index was built.
+    """
+    if not get_index_dir():
+        return None
+
+    return load_year_index(AvailabilityIndex, table, get_availability_path(table))
@@ -0,0 +1,180 @@
+"""
+cache.py
+========
+
+Holds class ResultCache, an on-disk cache of the output files of extraction
+jobs, keyed on the normalised request parameters and the resolved station list.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from pywps import configuration
+
+from goldfinch.archive import get_archive_mtime
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Keys of the validated inputs that change the content of the output files
+CACHE_KEY_INPUTS = ('obs_table', 'start', 'end', 'delimiter', 'chunk_rule',
+                    'output_format', 'compression', 'combine_chunks')
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def get_result_cache():
+    """
+    Returns a ResultCache for the directory set by `resultcachedir` in the
+    `[server]` section of the configuration, limited to `resultcachesize`
+    (e.g. "10gb"). Returns None if no cache directory is set.
+    """
+    cache_dir = configuration.get_config_value('server', 'resultcachedir')
+
+    if not cache_dir:
+        return None
+
+    max_size = configuration.get_config_value('server', 'resultcachesize') or '10gb'
+    return ResultCache(cache_dir, int(configuration.get_size_mb(max_size) * 1024 ** 2))
+
+
+def _link_or_copy(src, dst):
+    "Hard-links `src` to `dst`, or copies it if they are on different file systems."
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of extraction output files.
+
+    Each entry is a directory named by the key of the request, holding the
+    output files and a manifest of their names and total size. The entries
+    are evicted least recently used first once the total size of the cache
+    exceeds `max_size` bytes. The key includes the modification time of the
+    archive, so entries are not found again once the archive has changed.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, inputs, station_list, **extra):
+        """
+        Returns the key for the validated `inputs` and `station_list`. Any `extra`
+        (JSON-serialisable) settings that change the output are included.
+        """
+        params = {key: inputs.get(key) for key in CACHE_KEY_INPUTS}
+        params['station_ids'] = sorted(str(station) for station in station_list)
+        params['archive_mtime'] = get_archive_mtime(inputs['obs_table'])
+        params.update(extra)
+
+        encoded = json.dumps(params, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key, workdir):
+        """
+        Returns the list of output files for `key`, linked or copied into
+        `workdir`, or None if there is no entry for it.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        output_paths = []
+
+        try:
+            with open(os.path.join(entry_dir, MANIFEST_FILE_NAME)) as reader:
+                manifest = json.load(reader)
+
+            # Mark the entry as recently used
+            os.utime(entry_dir)
+
+            for file_name in manifest['files']:
+                output_path = os.path.join(workdir, file_name)
+                _link_or_copy(os.path.join(entry_dir, file_name), output_path)
+                output_paths.append(output_path)
+
+        except (OSError, ValueError, KeyError):
+            # Remove the files linked so far: the job extracts the data
+            # instead, and must not write through links into the cache
+            for output_path in output_paths:
+                try:
+                    os.remove(output_path)
+                except OSError:
+                    pass
+
+            return None
+
+        LOGGER.info('Found {} output file(s) in result cache: {}'.format(len(output_paths), key))
+        return output_paths
+
+    def put(self, key, output_paths):
+        "Stores the output files for `key`, then evicts old entries if needed."
+        entry_dir = os.path.join(self.cache_dir, key)
+
+        if os.path.isdir(entry_dir):
+            return
+
+        # Build the entry under a temporary name so that it appears in one step
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+
+        try:
+            for output_path in output_paths:
+                _link_or_copy(output_path, os.path.join(tmp_dir, os.path.basename(output_path)))
+
+            manifest = {'files': [os.path.basename(output_path) for output_path in output_paths],
+                        'size': sum(os.path.getsize(output_path) for output_path in output_paths)}
+
+            with open(os.path.join(tmp_dir, MANIFEST_FILE_NAME), 'w') as writer:
+                json.dump(manifest, writer)
+
+            os.rename(tmp_dir, entry_dir)
+
+        except OSError:
+            # Another job stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def size(self):
+        "Returns the total size (in bytes) of the entries in the cache."
+        return sum(size for (_, size, _) in self._entries())
+
+    def evict(self):
+        "Removes the least recently used entries until the cache fits in `max_size`."
+        entries = sorted(self._entries())
+        total = sum(size for (_, size, _) in entries)
+
+        for (_, size, entry_dir) in entries:
+            if total <= self.max_size:
+                break
+
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def _entries(self):
+        "Returns a list of (last used time, size, path) for each entry."
+        entries = []
+
+        with os.scandir(self.cache_dir) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.startswith('.') or not dir_entry.is_dir():
+                    continue
+
+                try:
+                    with open(os.path.join(dir_entry.path, MANIFEST_FILE_NAME)) as reader:
+                        size = json.load(reader)['size']
+
+                    entries.append((dir_entry.stat().st_mtime, size, dir_entry.path))
+                except (OSError, ValueError, KeyError):
+                    continue
+
+        return entries
@@ -0,0 +1,182 @@
+"""
+capabilities_cache.py
+=====================
+
+Holds class CapabilitiesCache, WSGI middleware keeping the GetCapabilities and
+DescribeProcess documents of a pywps Service in memory, so that they are
+rendered once rather than on every request (clients poll them, and the
+documents include the long allowed-values lists of the processes).
+
+Each document is sent with a strong ETag, and a request whose If-None-Match
+matches it gets a 304 (Not Modified) response with no body. The cached
+documents are dropped when the pywps configuration changes or when the default
+of the `DateRange` inputs (see `goldfinch.util.get_valid_date_range`) moves to
+a new month, in which case the processes are constructed again first, with the
+new default. Both are checked on the requests for the cached documents only,
+so Execute requests get the default of the last of those requests.
+Requests answered from the cache are not recorded in the pywps request log.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+from pywps import configuration
+from werkzeug.http import parse_etags, quote_etag
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+CACHED_OPERATIONS = ('getcapabilities', 'describeprocess')
+
+# Maximum number of documents kept (one per distinct request)
+MAX_ENTRIES = 128
+
+
+def _config_fingerprint():
+    "Returns a hashable snapshot of the pywps configuration."
+    config = configuration.CONFIG
+
+    if config is None:
+        return None
+
+    return tuple((section, tuple(config.items(section, raw=True))) for section in config.sections())
+
+
+def _cache_key(environ):
+    """
+    Returns the key of the cached document answering the request in `environ`,
+    or None if it is not a GET request for one of `CACHED_OPERATIONS`.
+    """
+    if environ.get('REQUEST_METHOD', 'GET') != 'GET':
+        return None
+
+    params = []
+
+    for (name, value) in parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True):
+        name = name.lower()
+        params.append((name, value.lower() if name in ('service', 'request') else value))
+
+    if dict(params).get('request') not in CACHED_OPERATIONS:
+        return None
+
+    return (environ.get('PATH_INFO', ''), environ.get('HTTP_ACCEPT', ''), tuple(sorted(params)))
+
+
+def _date_range():
+    "Returns the current default of the `DateRange` inputs."
+    from goldfinch.util import get_valid_date_range
+    return get_valid_date_range()
+
+
+def rebuild_processes(processes):
+    """
+    Returns an OrderedDict of identifier: process of new instances of the
+    classes of `processes`, which take the current `DateRange` default.
+    """
+    return OrderedDict((process.identifier, type(process)()) for process in processes)
+
+
+class CapabilitiesCache:
+    "WSGI middleware caching the GetCapabilities and DescribeProcess responses of `service`."
+
+    def __init__(self, service, max_entries=MAX_ENTRIES):
+        self.service = service
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # The processes of the service were constructed with the current default
+        self._version = (_config_fingerprint(), _date_range())
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Behave as the pywps Service otherwise (e.g. `processes`)
+        if name == 'service':
+            raise AttributeError(name)
+
+        return getattr(self.service, name)
+
+    def _check_version(self):
+        """
+        Drops the cached documents if the configuration or the default date range
+        has changed, constructing the processes again for a new date range.
+        Returns the current version.
+        """
+        version = (_config_fingerprint(), _date_range())
+
+        if version == self._version:
+            return version
+
+        with self._lock:
+            if version != self._version:
+                LOGGER.info('Configuration or date range changed: clearing the cached capabilities')
+
+                if version[1] != self._version[1]:
+                    self.service.processes = rebuild_processes(self.service.processes.values())
+
+                self._entries.clear()
+                self._version = version
+
+        return version
+
+    def _render(self, environ):
+        "Returns the (status, headers, body) of the response of the service to `environ`."
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        app_iter = self.service(environ, start_response)
+
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        return response['status'], response['headers'], body
+
+    def __call__(self, environ, start_response):
+        key = _cache_key(environ)
+
+        if key is None:
+            return self.service(environ, start_response)
+
+        version = self._check_version()
+
+        with self._lock:
+            entry = self._entries.get(key) if self._version == version else None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            (status, headers, body) = self._render(environ)
+
+            if not status.startswith('200'):
+                start_response(status, headers)
+                return [body]
+
+            headers = [(name, value) for (name, value) in headers
+                       if name.lower() not in ('content-length', 'etag', 'cache-control')]
+            entry = (status, headers, body, hashlib.sha1(body).hexdigest())
+
+            with self._lock:
+                # Not kept if the cache was cleared while it was rendered
+                if self._version == version:
+                    self._entries[key] = entry
+
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+        (status, headers, body, etag) = entry
+        cache_headers = [('ETag', quote_etag(etag)), ('Cache-Control', 'no-cache')]
+
+        if parse_etags(environ.get('HTTP_IF_NONE_MATCH')).contains_weak(etag):
+            start_response('304 Not Modified', cache_headers)
+            return []
+
+        start_response(status, headers + cache_headers + [('Content-Length', str(len(body)))])
+        return [body]
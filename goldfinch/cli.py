@@ -15,6 +15,7 @@ from . import wsgi
 from urllib.parse import urlparse
 
 PID_FILE = os.path.abspath(os.path.join(os.path.curdir, "pywps.pid"))
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'default.cfg')
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -79,19 +80,16 @@ def _run(application, bind_host=None, daemon=False):
     host, port = get_host()
     bind_host = bind_host or host
     # need to serve the wps outputs
-    static_files = {
-        '/outputs': configuration.get_config_value('server', 'outputpath')
-    }
+    from .server import serve_outputs
     run_simple(
         hostname=bind_host,
         port=port,
-        application=application,
+        application=serve_outputs(application),
         use_debugger=False,
         use_reloader=False,
         threaded=True,
         # processes=2,
-        use_evalex=not daemon,
-        static_files=static_files)
+        use_evalex=not daemon)
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
@@ -99,8 +97,9 @@ def _run(application, bind_host=None, daemon=False):
 def cli():
     """Command line to start/stop a PyWPS service.
 
-    Do not use this service in a production environment.
-    It's intended to be running in a test environment only!
+    Do not use the development server (the default) in a production environment.
+    It's intended to be running in a test environment only! Use
+    "goldfinch start --workers N" to run a gunicorn server in production.
     For more documentation, visit http://pywps.org/doc
     """
     pass
@@ -127,15 +126,36 @@ def stop():
 @click.option('--port', metavar='PORT', default='5000', help='port in PyWPS configuration.')
 @click.option('--maxsingleinputsize', default='200mb', help='maxsingleinputsize in PyWPS configuration.')
 @click.option('--maxprocesses', metavar='INT', default='10', help='maxprocesses in PyWPS configuration.')
-@click.option('--parallelprocesses', metavar='INT', default='2', help='parallelprocesses in PyWPS configuration.')
+@click.option('--parallelprocesses', metavar='INT', default='8', help='parallelprocesses in PyWPS configuration.')
+@click.option('--chunkprocesses', metavar='INT', default='1',
+              help='number of processes used to extract time chunks of a single job concurrently.')
 @click.option('--log-level', metavar='LEVEL', default='INFO', help='log level in PyWPS configuration.')
 @click.option('--log-file', metavar='PATH', default='pywps.log', help='log file in PyWPS configuration.')
 @click.option('--database', default='sqlite:///pywps-logs.sqlite', help='database in PyWPS configuration')
+@click.option('--workers', '-w', metavar='INT', type=int, default=0, show_default=True,
+              help='number of gunicorn worker processes (0 runs the development server instead).')
+@click.option('--worker-class', metavar='CLASS', default='sync', show_default=True,
+              help='gunicorn worker class, e.g. sync, gthread or gevent.')
+@click.option('--threads', metavar='INT', type=int, default=1, show_default=True,
+              help='number of threads of each gthread worker.')
+@click.option('--timeout', metavar='SECONDS', type=int, default=300, show_default=True,
+              help='restart a worker silent for longer than this.')
+@click.option('--graceful-timeout', metavar='SECONDS', type=int, default=30, show_default=True,
+              help='time given to workers to finish their requests when restarted or stopped.')
+@click.option('--max-requests', metavar='INT', type=int, default=1000, show_default=True,
+              help='restart each worker after this many requests (0 for never).')
+@click.option('--max-requests-jitter', metavar='INT', type=int, default=50, show_default=True,
+              help='add up to this many requests to --max-requests, so workers do not all restart at once.')
 def start(config, bind_host, daemon, hostname, port,
-          maxsingleinputsize, maxprocesses, parallelprocesses,
-          log_level, log_file, database):
+          maxsingleinputsize, maxprocesses, parallelprocesses, chunkprocesses,
+          log_level, log_file, database, workers, worker_class, threads, timeout,
+          graceful_timeout, max_requests, max_requests_jitter):
     """Start PyWPS service.
     This service is by default available at http://localhost:5000/wps
+
+    With --workers, the service runs in a pre-forking gunicorn server, for
+    production use, with the application loaded once before the workers are
+    forked. Otherwise it runs in the werkzeug development server.
     """
     if os.path.exists(PID_FILE):
         click.echo('PID file exists: "{}". Service still running?'.format(PID_FILE))
@@ -147,6 +167,7 @@ def start(config, bind_host, daemon, hostname, port,
         wps_maxsingleinputsize=maxsingleinputsize,
         wps_maxprocesses=maxprocesses,
         wps_parallelprocesses=parallelprocesses,
+        wps_chunkprocesses=chunkprocesses,
         wps_log_level=log_level,
         wps_log_file=log_file,
         wps_database=database,
@@ -154,6 +175,20 @@ def start(config, bind_host, daemon, hostname, port,
     if config:
         cfgfiles.append(config)
     app = wsgi.create_app(cfgfiles)
+
+    if workers > 0:
+        from .server import run_gunicorn
+        host, port = get_host()
+
+        try:
+            run_gunicorn(app, '{}:{}'.format(bind_host or host, port), workers, worker_class=worker_class,
+                         threads=threads, timeout=timeout, graceful_timeout=graceful_timeout,
+                         max_requests=max_requests, max_requests_jitter=max_requests_jitter,
+                         pidfile=PID_FILE, daemon=daemon)
+        except RuntimeError as exc:
+            raise click.ClickException(str(exc))
+        return
+
     # let's start the service ...
     # See:
     # * https://github.com/geopython/pywps-flask/blob/master/demo.py
@@ -178,3 +213,211 @@ def start(config, bind_host, daemon, hostname, port,
     else:
         # no daemon
         _run(app, bind_host=bind_host)
+
+
+@cli.group()
+def index():
+    """Build indexes of the MIDAS archive."""
+    pass
+
+
+@index.command()
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+@click.option('--index-dir', metavar='PATH',
+              help='directory to write the indexes to '
+                   '(default: indexdir in configuration).')
+@click.option('--table', '-t', 'tables', metavar='TABLE', multiple=True,
+              help='MIDAS table to index (may be repeated, default: all tables found in the archive).')
+@click.option('--offsets/--no-offsets', default=True, show_default=True,
+              help='also index the byte ranges of each station in each data file.')
+def build(config, index_dir, tables, offsets):
+    """Build the indexes of each MIDAS table.
+
+    The availability index records the years in which each station has data, and
+    the size catalogue the number of bytes of each station in each year, used to
+    estimate the size of requests. The offset indexes record where the rows of
+    each station are in each data file, so that requests for a few stations can
+    read those rows directly.
+    """
+    import tempfile
+    from .archive import TABLE_LAYOUTS, find_year_files, get_archive_mtime, get_data_dir, get_index_dir, get_layout
+    from .availability import AvailabilityIndex, get_availability_path
+    from .engines import MIDASSubsetterEngine
+    from .offset_index import OffsetIndex, capture_table_header, get_header_path, get_offsets_path
+    from .size_catalogue import SizeCatalogue, get_size_catalogue_path
+    from .year_index import scan_year_sizes
+
+    cfgfiles = [DEFAULT_CONFIG_FILE]
+    if config:
+        cfgfiles.append(config)
+    configuration.load_configuration(cfgfiles)
+
+    index_dir = index_dir or get_index_dir()
+    if not index_dir:
+        raise click.UsageError('No index directory: set indexdir in the [server] section or use --index-dir.')
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    if not tables:
+        tables = []
+
+        for table in sorted(os.listdir(get_data_dir())):
+            year_files = find_year_files(table)
+
+            if table not in TABLE_LAYOUTS and year_files:
+                # Tables of unknown layout can be indexed if their files have a header line
+                try:
+                    get_layout(table, year_files[min(year_files)][0])
+                except KeyError:
+                    click.echo('{}: layout unknown and no header line in the data files, skipping it'.format(table))
+                    continue
+
+            if table in TABLE_LAYOUTS or year_files:
+                tables.append(table)
+
+    for table in tables:
+        year_files = find_year_files(table)
+
+        # The availability index and the size catalogue are built from one scan
+        archive_mtime = get_archive_mtime(table)
+
+        if not offsets:
+            year_sizes = scan_year_sizes(table)
+        else:
+            os.makedirs(os.path.join(index_dir, table), exist_ok=True)
+            year_sizes = {}
+
+            for year, paths in sorted(year_files.items()):
+                year_sizes[year] = {}
+
+                for path in paths:
+                    offset_index = OffsetIndex.build(table, path)
+                    offset_index.save(get_offsets_path(table, path, index_dir))
+
+                    for src_id, size in offset_index.station_sizes().items():
+                        year_sizes[year][src_id] = year_sizes[year].get(src_id, 0) + size
+
+        availability = AvailabilityIndex.from_year_sizes(table, year_sizes, archive_mtime=archive_mtime)
+        sizes = SizeCatalogue.from_year_sizes(table, year_sizes, archive_mtime=archive_mtime)
+
+        path = get_availability_path(table, index_dir)
+        availability.save(path)
+        click.echo('{}: {} station-years from {} years written to {}'.format(
+            table, len(availability.src_ids), len(set(availability.years.tolist())), path))
+
+        path = get_size_catalogue_path(table, index_dir)
+        sizes.save(path)
+        click.echo('{}: size catalogue of {} bytes written to {}'.format(table, int(sizes.sizes.sum()), path))
+
+        # Record the header written by the MIDAS subsetter, which the other engines copy
+        header_path = get_header_path(table, index_dir)
+        if os.path.exists(header_path):
+            os.remove(header_path)
+
+        if year_files:
+            (fd, tmp_path) = tempfile.mkstemp(suffix='.csv')
+            os.close(fd)
+            first_path = year_files[min(year_files)][0]
+
+            def scan(output_path, start, end, src_ids):
+                MIDASSubsetterEngine().extract(table, output_path, start, end, src_ids=src_ids,
+                                               delimiter='comma', tmp_dir=tempfile.gettempdir())
+
+            if capture_table_header(table, first_path, scan, tmp_path, index_dir) is None:
+                click.echo('{}: no header written by the subsetter, only the subsetter will be used'.format(table))
+
+
+@cli.command()
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+def queue(config):
+    """Show the jobs extracting and waiting in each size class, their wait times (in seconds)
+    and the estimated bytes in flight."""
+    from .scheduler import WAIT_HISTORY, get_scheduler
+
+    cfgfiles = [DEFAULT_CONFIG_FILE]
+    if config:
+        cfgfiles.append(config)
+    configuration.load_configuration(cfgfiles)
+
+    scheduler = get_scheduler()
+    if scheduler is None:
+        raise click.UsageError('No scheduler: set sizeclasses, maxbytesinflight or minfreedisk '
+                               'in the [server] section.')
+
+    try:
+        stats = scheduler.stats()
+    finally:
+        scheduler.close()
+
+    click.echo('{:<12} {:>10} {:>6} {:>8} {:>8} {:>10} {:>8} {:>10} {:>10}'.format(
+        'class', 'max size', 'slots', 'running', 'waiting', 'oldest', 'started', 'mean wait', 'max wait'))
+
+    for row in stats:
+        max_size = '*' if row['max_size'] is None else '{:.0f}mb'.format(row['max_size'] / 1024 ** 2)
+        slots = '*' if row['slots'] is None else row['slots']
+        click.echo('{:<12} {:>10} {:>6} {:>8} {:>8} {:>10.1f} {:>8} {:>10.1f} {:>10.1f}'.format(
+            row['size_class'], max_size, slots, row['running'], row['waiting'], row['current_wait'],
+            row['started'], row['mean_wait'], row['max_wait']))
+
+    click.echo('(waits of the jobs started in the last {:.0f} minutes)'.format(WAIT_HISTORY / 60))
+
+    in_flight = sum(row['running_bytes'] for row in stats)
+    limit = scheduler.max_bytes_in_flight
+    click.echo('Estimated bytes in flight: {:.1f} MB{}'.format(
+        in_flight / 1024 ** 2, '' if limit is None else ' (limit {:.1f} MB)'.format(limit / 1024 ** 2)))
+
+
+@cli.group()
+def bench():
+    """Measure the performance of goldfinch."""
+    pass
+
+
+@bench.command()
+@click.option('--module', '-m', 'modules', metavar='MODULE', multiple=True,
+              help='module to import (may be repeated, default: the goldfinch entry points).')
+@click.option('--repeat', '-r', metavar='INT', type=int, default=3, show_default=True,
+              help='number of runs of each measurement, of which the fastest is reported.')
+@click.option('--top', metavar='INT', type=int, default=10, show_default=True,
+              help='number of the slowest imports of each module to list.')
+@click.option('--app/--no-app', default=True, show_default=True,
+              help='also measure the time to create the WSGI application.')
+@click.option('--budget', metavar='MS', type=float,
+              help='fail if importing any of the modules takes longer than this many milliseconds.')
+@click.option('--json', 'as_json', is_flag=True, help='print the measurements as JSON.')
+def startup(modules, repeat, top, app, budget, as_json):
+    """Report the time to import each module in a fresh interpreter, and the
+    modules it imports that take longest (from "python -X importtime").
+    """
+    from .startup import measure_startup, slowest_imports
+
+    try:
+        (results, app_time) = measure_startup(modules=modules or None, repeat=repeat, create_app=app)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+
+    if as_json:
+        import json
+        click.echo(json.dumps({
+            'modules': [{'module': result['module'], 'import_time': result['import_time'],
+                         'wall_time': result['wall_time'],
+                         'slowest_imports': [{'module': name, 'self': self_time, 'cumulative': cumulative}
+                                             for (name, self_time, cumulative) in
+                                             slowest_imports(result['imports'], top, exclude=result['module'])]}
+                        for result in results],
+            'create_app': app_time}, indent=2))
+    else:
+        for result in results:
+            click.echo('{}: import {:.1f} ms (interpreter {:.1f} ms)'.format(
+                result['module'], result['import_time'] * 1000, result['wall_time'] * 1000))
+            click.echo('  {:>15} {:>10}  {}'.format('cumulative (ms)', 'self (ms)', 'imported module'))
+
+            for (name, self_time, cumulative) in slowest_imports(result['imports'], top, exclude=result['module']):
+                click.echo('  {:>15.1f} {:>10.1f}  {}'.format(cumulative * 1000, self_time * 1000, name))
+
+        if app_time is not None:
+            click.echo('create_app: {:.1f} ms'.format(app_time * 1000))
+
+    over = [result['module'] for result in results if budget is not None and result['import_time'] * 1000 > budget]
+    if over:
+        raise click.ClickException('Import time over the budget of {:.1f} ms: {}'.format(budget, ', '.join(over)))
@@ -1,32 +1,52 @@
 """ This module is attempting to estimate the size of a data request.
-Using the sizes of the yearly files for each table, I have created some linear model
+
+When the size catalogue of a table (see `goldfinch.size_catalogue`) has been
+built, the estimate is the number of bytes of the selected stations in the
+requested years, in proportion to the days requested.
+
+Otherwise, using the sizes of the yearly files for each table, I have created some linear model
 which take a date from 1957 onwards (normalised to 0 or more) and return an estimated size
 of the data for that year. To estimate over a date range, we can integrate the model.
 
 In most cases tables have data before 1957 however, it is usually of insignificant size.
 Cutting the data here also makes the linear model more accurate. """
 
-from datetime import timedelta
-import dateutil.parser as dp
-import glob
 import os
-import scipy.integrate as integrate
 
+import numpy as np
+
+from goldfinch.archive import to_days
+from goldfinch.size_catalogue import get_size_catalogue
+
+# Slope and intercept of the linear model of the size (in bytes) of a year of
+# data in each table, against the number of years since 1957
 TABLE_MODELS = {
-    'TD': lambda x: 330695*x + 17338156,
-    'WD': lambda x: 31789*x + 37823234,
-    'RH': lambda x: 3512674*x,
-    'WM': lambda x: 4961883*x + 21431612,
-    'RO': lambda x: 1754260*x,
-    'RD': lambda x: 756422*x + 101165112,
-    'WH': lambda x: 18281684*x,
-    'ST': lambda x: 2303563*x
+    'TD': (330695, 17338156),
+    'WD': (31789, 37823234),
+    'RH': (3512674, 0),
+    'WM': (4961883, 21431612),
+    'RO': (1754260, 0),
+    'RD': (756422, 101165112),
+    'WH': (18281684, 0),
+    'ST': (2303563, 0)
 }
 
+# The models were created on data from 1957 - 2020
+MODEL_START_YEAR = 1957
+MODEL_END_YEAR = 2020
+
+
+def get_request_size_limit():
+    "Returns the largest estimated size (in bytes) of a request that is allowed."
+    return int(os.environ.get('MIDAS_TEST_REQUEST_SIZE_LIMIT', '500000000')) #5*10^8, 500mb
+
 
 def check_request_size(station_list, inputs):
-    SIZE_LIMIT = int(os.environ.get('MIDAS_TEST_REQUEST_SIZE_LIMIT', '500000000')) #5*10^8, 500mb
-    TOTAL_STATION_ESTIMATE = int(os.environ.get('MIDAS_TEST_TOTAL_STATIONS', '10000'))
+    """
+    Raises an exception if no stations were selected or the estimated size of
+    the request is over the limit. Returns the estimated size (in bytes).
+    """
+    SIZE_LIMIT = get_request_size_limit()
 
     table = inputs['obs_table']
     n_stations = len(station_list)
@@ -35,48 +55,88 @@ def check_request_size(station_list, inputs):
         raise Exception('No stations were found for your given input. Please increase '
                         'your search area or date range.')
 
-    if dp.isoparse(inputs['end']) < dp.isoparse('1957') or table == 'RS':
-        return
+    size_estimate = estimate_request_size(table, n_stations, inputs['start'], inputs['end'],
+                                          src_ids=station_list)
 
-    file_size_model = TABLE_MODELS[table]
-    start_converted = _convert_date(dp.isoparse(inputs['start']))
-    end_converted = _convert_date(dp.isoparse(inputs['end']))
+    if size_estimate > SIZE_LIMIT:
+        raise Exception('The estimated amount of data you have selected is too large. '
+                        'Please select less stations or a smaller time range.')
 
-    adjusted_2020 = 2020 - 1957
-    if start_converted < 0:
-        # If the date range begins before 1957, ignore the data before 1957.
-        # In many cases, the Y intercept of the model is 0 therefore, integrating in the
-        # negative X will add a negative value to result
-        start_converted = 0
+    return size_estimate
 
-    if end_converted > adjusted_2020:
-        # These models were created on data from 1957 - 2020.
-        # In the interest of future proofing, files beyond 2020 will be modeled to 
-        # have the same size as 2020 was
 
-        linear_size_estimate = integrate.quad(file_size_model, start_converted, adjusted_2020)[0]
-        static_y = file_size_model(adjusted_2020)
-        remainder = end_converted - adjusted_2020
+def estimate_request_size(table, n_stations, start, end, src_ids=None):
+    """
+    Returns the estimated size (in bytes) of the data for `n_stations` stations
+    in `table` between the `start` and `end` date/times.
 
-        static_size_estimate = static_y * remainder # Equivalent to integrating y = <static_y>
-        size_estimate = linear_size_estimate + static_size_estimate
+    If the list of `src_ids` is given (empty for all stations) and the table
+    has a size catalogue, the sizes of those stations are looked up in it.
 
-    else:
+    Otherwise, returns 0 if the table has no size model or the range ends before 1957.
+    """
+    return float(estimate_request_sizes(table, n_stations, [start], [end], src_ids=src_ids)[0])
 
-        size_estimate = integrate.quad(file_size_model, start_converted, end_converted)[0]
 
-    ratio = (n_stations / TOTAL_STATION_ESTIMATE)
-    if ratio > 1:
-        ratio = 1
+def estimate_request_sizes(table, n_stations, starts, ends, src_ids=None):
+    """
+    Returns an array of the estimated sizes (in bytes) of the data for `n_stations`
+    stations in `table` between each pair of `starts` and `ends` date/times, so
+    that many candidate requests (such as the months of a time chunk plan) can be
+    scored at once. `n_stations` may also be a sequence, one per request.
 
-    if ratio * size_estimate > SIZE_LIMIT:
-        raise Exception('The estimated amount of data you have selected is too large. '
-                        'Please select less stations or a smaller time range.')
+    If the list of `src_ids` is given (empty for all stations) and the table
+    has a size catalogue, the sizes of those stations are looked up in it.
+
+    The size model of the table is integrated in closed form: the integral of
+    y = a*x + b from x0 to x1 is a/2 * (x1^2 - x0^2) + b * (x1 - x0).
+    """
+    TOTAL_STATION_ESTIMATE = int(os.environ.get('MIDAS_TEST_TOTAL_STATIONS', '10000'))
+
+    if src_ids is not None:
+        catalogue = get_size_catalogue(table)
+
+        if catalogue is not None:
+            return catalogue.estimate(src_ids, starts, ends)
+
+    if table not in TABLE_MODELS:
+        return np.zeros(len(starts))
+
+    (slope, intercept) = TABLE_MODELS[table]
+    end_days = to_days(ends)
+    start_converted = _convert_dates(to_days(starts))
+    end_converted = _convert_dates(end_days)
+
+    # If the date range begins before 1957, ignore the data before 1957.
+    # In many cases, the Y intercept of the model is 0 therefore, integrating in the
+    # negative X will add a negative value to result
+    start_converted = np.maximum(start_converted, 0)
+
+    # In the interest of future proofing, files beyond 2020 are modeled to have
+    # the same size as 2020 was
+    adjusted_2020 = MODEL_END_YEAR - MODEL_START_YEAR
+    linear_start = np.minimum(start_converted, adjusted_2020)
+    linear_end = np.minimum(end_converted, adjusted_2020)
+
+    linear_size_estimate = (slope / 2 * (linear_end ** 2 - linear_start ** 2)
+                            + intercept * (linear_end - linear_start))
+
+    static_y = slope * adjusted_2020 + intercept
+    remainder = np.where(end_converted > adjusted_2020,
+                         end_converted - np.maximum(start_converted, adjusted_2020), 0)
+    static_size_estimate = static_y * remainder # Equivalent to integrating y = <static_y>
+
+    ratio = np.minimum(np.asarray(n_stations, dtype=float) / TOTAL_STATION_ESTIMATE, 1)
+    size_estimate = ratio * (linear_size_estimate + static_size_estimate)
+
+    # Ranges ending before 1957 have no data
+    return np.where(end_days < np.datetime64('%d-01-01' % MODEL_START_YEAR), 0, size_estimate)
 
 
-def _convert_date(date):
-    base = date.year - 1957
-    day_remainder_delta = date - dp.isoparse(str(date.year))
+def _convert_dates(days):
+    "Returns the number of years since 1957 of each of `days`, counting 360 days to the year."
+    years = days.astype('datetime64[Y]')
 
-    fractional = day_remainder_delta.days / 360
+    base = years.astype(int) + 1970 - MODEL_START_YEAR
+    fractional = (days - years.astype('datetime64[D]')).astype(int) / 360
     return base + fractional
@@ -0,0 +1,287 @@
+"""
+engines.py
+==========
+
+Subsetting engines: the classes that read the rows of a MIDAS table matching a
+request from the archive and write them to an output file.
+
+ * "midas" (MIDASSubsetterEngine) calls the `midas_extract` subsetter. It supports
+   every request and is the default.
+ * "mmap" (MmapEngine) memory-maps each yearly file and finds the time and src_id
+   fields of all the rows of a block at once with NumPy, then writes the matching
+   rows straight from the mapped file. It supports comma-delimited requests for
+   all columns with no conditions or region, once the output header of the table
+   has been recorded by `goldfinch index build`. Other requests are passed to the
+   "midas" engine. If the file has an offset index and its rows are in time
+   order, only the byte range of the time window is parsed.
+
+The engine is chosen by the `GOLDFINCH_ENGINE` environment variable or, if that
+is not set, by `engine` in the `[server]` section of the configuration.
+"""
+
+import mmap
+import os
+
+import numpy as np
+from pywps import configuration
+
+from goldfinch.archive import find_year_files, get_layout, parse_src_ids
+from goldfinch.offset_index import get_offset_index, get_table_header
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+ENGINE_ENV_VAR = 'GOLDFINCH_ENGINE'
+DEFAULT_ENGINE = 'midas'
+
+# Size of each block of a data file parsed at once by the "mmap" engine
+MMAP_BLOCK_SIZE = 32 * 1024 ** 2
+
+NEWLINE = ord('\n')
+COMMA = ord(',')
+SPACE = ord(' ')
+ZERO = ord('0')
+
+# Positions of the digits of "YYYY-MM-DD HH:MM" and their place values in YYYYMMDDHHMM
+TIME_DIGIT_POSITIONS = np.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15])
+TIME_DIGIT_VALUES = 10 ** np.arange(11, -1, -1, dtype=np.int64)
+
+# Maximum number of characters (digits and spaces) read for a src_id
+SRC_ID_WIDTH = 12
+
+
+class SubsettingEngine:
+    "Base class of the subsetting engines."
+
+    name = None
+
+    def can_extract(self, table, columns="all", conditions=None, region=None, delimiter="default"):
+        "Returns True if the engine supports a request with these arguments."
+        return True
+
+    def extract(self, table, output_path, start, end, columns="all", conditions=None, src_ids=None,
+                region=None, delimiter="default", tmp_dir=None, verbose=False):
+        """
+        Writes the rows of `table` between the `start` and `end` times (YYYYMMDDHHMM)
+        that match the other arguments (see `goldfinch.util.filter_observations()`)
+        to `output_path`.
+        """
+        raise NotImplementedError()
+
+
+class MIDASSubsetterEngine(SubsettingEngine):
+    "Engine calling the MIDAS subsetter of the `midas_extract` package."
+
+    name = 'midas'
+
+    def extract(self, table, output_path, start, end, columns="all", conditions=None, src_ids=None,
+                region=None, delimiter="default", tmp_dir=None, verbose=False):
+        from midas_extract.subsetter import MIDASSubsetter
+
+        return MIDASSubsetter(table, output_path, startTime=start, endTime=end, columns=columns,
+                              conditions=conditions, src_ids=src_ids, region=region, delimiter=delimiter,
+                              tmp_dir=tmp_dir, verbose=verbose)
+
+
+def _field_bounds(arr, line_starts, first_commas, commas, index):
+    "Returns the (start, end) offsets in `arr` of field `index` of each line."
+    starts = line_starts if index == 0 else commas[first_commas + index - 1] + 1
+    return starts, commas[first_commas + index]
+
+
+def _parse_src_ids(arr, starts, ends):
+    "Returns the integer value of each field of digits (and spaces) between `starts` and `ends`."
+    values = np.zeros(len(starts), dtype=np.int64)
+
+    # One column of characters at a time, from the left
+    for width in range(SRC_ID_WIDTH, 0, -1):
+        positions = ends - width
+        digits = arr[np.clip(positions, 0, None)].astype(np.int64) - ZERO
+        is_digit = (positions >= starts) & (digits >= 0) & (digits <= 9)
+        values = np.where(is_digit, values * 10 + digits, values)
+
+    return values
+
+
+def _parse_times(arr, starts, ends):
+    """
+    Returns each time field ("YYYY-MM-DD HH:MM") between `starts` and `ends` as
+    an integer YYYYMMDDHHMM, taking dates with no time of day as midnight, or -1
+    if the field does not start with a date.
+    """
+    # Skip up to two leading spaces
+    for _ in range(2):
+        starts = starts + ((arr[np.minimum(starts, len(arr) - 1)] == SPACE) & (starts < ends))
+
+    positions = starts[:, None] + TIME_DIGIT_POSITIONS
+    in_field = positions < ends[:, None]
+    digits = arr[np.minimum(positions, len(arr) - 1)].astype(np.int64) - ZERO
+    is_digit = in_field & (digits >= 0) & (digits <= 9)
+
+    times = np.where(is_digit, digits, 0) @ TIME_DIGIT_VALUES
+    return np.where(is_digit[:, :8].all(axis=1), times, -1)
+
+
+def find_matching_lines(arr, time_index, src_id_index, start, end, src_ids=None, fields=False):
+    """
+    Returns the (start, end) offsets of the lines of `arr` (a uint8 array of whole
+    lines) whose time is between `start` and `end` (integers YYYYMMDDHHMM) and,
+    if `src_ids` (an array of integers) is given, whose src_id is one of them.
+    Lines with too few fields are ignored. If `fields` is True, the times and
+    src_ids (integers) of the lines are returned too.
+    """
+    line_ends = np.flatnonzero(arr == NEWLINE) + 1
+
+    if len(arr) and arr[-1] != NEWLINE:
+        line_ends = np.append(line_ends, len(arr))
+
+    line_starts = np.concatenate(([0], line_ends[:-1]))
+
+    # Index in `commas` of the first comma of each line, and number of commas in it
+    commas = np.flatnonzero(arr == COMMA)
+    first_commas = np.searchsorted(commas, line_starts)
+    n_commas = np.searchsorted(commas, line_ends) - first_commas
+
+    lines = np.flatnonzero(n_commas > max(time_index, src_id_index))
+    line_starts, line_ends, first_commas = line_starts[lines], line_ends[lines], first_commas[lines]
+
+    line_src_ids = None
+
+    if src_ids is not None or fields:
+        line_src_ids = _parse_src_ids(arr, *_field_bounds(arr, line_starts, first_commas, commas, src_id_index))
+
+    # The times are only parsed for the lines of the stations
+    if src_ids is not None:
+        lines = np.flatnonzero(np.isin(line_src_ids, src_ids))
+        line_starts, line_ends, first_commas = line_starts[lines], line_ends[lines], first_commas[lines]
+        line_src_ids = line_src_ids[lines]
+
+    times = _parse_times(arr, *_field_bounds(arr, line_starts, first_commas, commas, time_index))
+    mask = (times >= start) & (times <= end)
+
+    if fields:
+        return line_starts[mask], line_ends[mask], times[mask], line_src_ids[mask]
+
+    return line_starts[mask], line_ends[mask]
+
+
+def _merge_ranges(starts, ends):
+    "Returns lists of starts and ends of the ranges, with adjacent ranges merged."
+    if len(starts) == 0:
+        return [], []
+
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    return (starts[np.concatenate(([0], breaks))].tolist(),
+            ends[np.concatenate((breaks - 1, [len(ends) - 1]))].tolist())
+
+
+class MmapEngine(SubsettingEngine):
+    "Engine parsing memory-mapped data files with NumPy."
+
+    name = 'mmap'
+
+    def __init__(self, block_size=MMAP_BLOCK_SIZE):
+        self.block_size = block_size
+
+    def can_extract(self, table, columns="all", conditions=None, region=None, delimiter="default"):
+        return (delimiter == "comma" and columns == "all" and not conditions and not region
+                and get_table_header(table) is not None)
+
+    def extract(self, table, output_path, start, end, columns="all", conditions=None, src_ids=None,
+                region=None, delimiter="default", tmp_dir=None, verbose=False):
+        """
+        Writes the header line and the matching rows to `output_path`. Rows are
+        written as they are in the data files, in file order.
+        """
+        if not self.can_extract(table, columns=columns, conditions=conditions, region=region,
+                                delimiter=delimiter):
+            raise ValueError('The mmap engine cannot extract this request')
+
+        if src_ids:
+            src_ids = np.array(parse_src_ids(src_ids), dtype=np.int64)
+        else:
+            src_ids = None
+
+        year_files = find_year_files(table)
+
+        with open(output_path, 'wb') as writer:
+            writer.write(get_table_header(table))
+
+            for year in range(int(start[:4]), int(end[:4]) + 1):
+                for path in year_files.get(year, []):
+                    self._extract_file(table, path, writer, int(start), int(end), src_ids)
+
+    def _extract_file(self, table, path, writer, start, end, src_ids):
+        "Writes the matching rows of the data file at `path` to `writer`."
+        (time_index, src_id_index, header_lines) = get_layout(table, path)
+
+        if os.path.getsize(path) == 0:
+            return
+
+        index = get_offset_index(table, path)
+        window = index.time_window(start, end) if index else None
+
+        with open(path, 'rb') as reader, mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = 0
+            stop = len(mapped)
+
+            for _ in range(header_lines):
+                position = mapped.find(b'\n', position) + 1 or len(mapped)
+
+            if window:
+                position = max(position, window[0])
+                stop = min(stop, window[1])
+
+            view = memoryview(mapped)
+
+            try:
+                while position < stop:
+                    block_end = self._block_end(mapped, position, stop)
+                    arr = np.frombuffer(mapped, dtype=np.uint8, count=block_end - position, offset=position)
+
+                    (starts, ends) = _merge_ranges(*find_matching_lines(arr, time_index, src_id_index,
+                                                                        start, end, src_ids))
+                    del arr
+
+                    for (row_start, row_end) in zip(starts, ends):
+                        writer.write(view[position + row_start:position + row_end])
+
+                    position = block_end
+            finally:
+                view.release()
+
+    def _block_end(self, mapped, position, stop):
+        """
+        Returns the end of the block starting at `position`, after the last whole
+        line in it (`stop` is at the end of a line).
+        """
+        if position + self.block_size >= stop:
+            return stop
+
+        block_end = mapped.rfind(b'\n', position, position + self.block_size) + 1
+
+        if block_end == 0:
+            # A line longer than the block: extend the block to its end
+            block_end = mapped.find(b'\n', position + self.block_size, stop) + 1 or stop
+
+        return block_end
+
+
+ENGINES = {engine.name: engine for engine in (MIDASSubsetterEngine, MmapEngine)}
+
+
+def get_engine(name=None):
+    """
+    Returns an instance of the subsetting engine `name`, or else of the engine set
+    by the `GOLDFINCH_ENGINE` environment variable or `engine` in the `[server]`
+    section of the configuration (default "midas").
+    """
+    name = (name or os.environ.get(ENGINE_ENV_VAR)
+            or configuration.get_config_value('server', 'engine') or DEFAULT_ENGINE)
+
+    if name not in ENGINES:
+        raise ValueError('Unknown subsetting engine: {} (expected one of: {})'.format(
+            name, ', '.join(sorted(ENGINES))))
+
+    return ENGINES[name]()
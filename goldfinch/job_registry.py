@@ -0,0 +1,92 @@
+"""
+job_registry.py
+===============
+
+Holds class JobRegistry, a record of the finished jobs that selected a list of
+stations, so that later requests can reuse that list by giving the job ID
+(the `input_job_id` input of the extraction processes).
+
+The registry is a SQLite database (in WAL mode, so it can be shared by the
+worker processes) keyed on the job ID. The station list is stored with the job
+because pywps removes the working directory of a job when it ends.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+JOB_REGISTRY_FILE_NAME = 'goldfinch-jobs.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    process TEXT NOT NULL,
+    workdir TEXT NOT NULL,
+    stations_file TEXT NOT NULL,
+    station_ids TEXT NOT NULL,
+    finished REAL NOT NULL
+);
+"""
+
+
+def get_job_registry():
+    """
+    Returns the JobRegistry in the file set by `jobregistry` in the `[server]`
+    section of the configuration, or else in the pywps working directory.
+    """
+    path = configuration.get_config_value('server', 'jobregistry')
+
+    if not path:
+        workdir = configuration.get_config_value('server', 'workdir') or tempfile.gettempdir()
+        path = os.path.join(workdir, JOB_REGISTRY_FILE_NAME)
+
+    return JobRegistry(path)
+
+
+class JobRegistry:
+    "Registry of finished jobs: job ID -> process, working directory and stations."
+
+    def __init__(self, path):
+        self.path = path
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def register(self, job_id, process, workdir, stations_file, station_ids):
+        "Records a finished job and the list of stations it selected."
+        self._conn.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)',
+                           (str(job_id), process, workdir, stations_file,
+                            '\n'.join(str(station_id) for station_id in station_ids), time.time()))
+        self._conn.commit()
+
+    def lookup(self, job_id):
+        """
+        Returns a dictionary of the process, working directory, stations file,
+        station IDs (a list of strings) and finish time of a job, or None if the
+        job is not registered.
+        """
+        row = self._conn.execute('SELECT process, workdir, stations_file, station_ids, finished '
+                                 'FROM jobs WHERE job_id = ?', (str(job_id).strip(),)).fetchone()
+
+        if row is None:
+            return None
+
+        (process, workdir, stations_file, station_ids, finished) = row
+
+        return {'job_id': str(job_id).strip(), 'process': process, 'workdir': workdir,
+                'stations_file': stations_file, 'station_ids': station_ids.split('\n') if station_ids else [],
+                'finished': finished}
@@ -0,0 +1,382 @@
+"""
+offset_index.py
+===============
+
+Holds class OffsetIndex, a sidecar index of each MIDAS yearly data file that
+maps each (src_id, month) to the byte ranges of its rows, so that requests for
+a few stations read only those rows instead of scanning the whole file.
+
+The index also records whether the rows of the file are in time order and, if
+so, the time of a row every `TIME_SAMPLE_INTERVAL` bytes, so that the byte range
+of a time window can be found by binary search instead of reading the year.
+
+The indexes are built by `goldfinch index build` and saved in the directory set
+by `indexdir` in the `[server]` section of the configuration, as
+`<indexdir>/<TABLE>/<data file name>.offsets.npz`, together with the header line
+written by the MIDAS subsetter for each table (`<indexdir>/<TABLE>.header`).
+"""
+
+import os
+
+import numpy as np
+
+from goldfinch.archive import find_year_files, get_index_dir, get_layout, parse_src_ids, parse_time
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+OFFSETS_FILE_SUFFIX = '.offsets.npz'
+HEADER_FILE_NAME = '{}.header'
+
+# Number of bytes between the rows whose times are kept in the sparse time index
+TIME_SAMPLE_INTERVAL = 64 * 1024
+
+# Size of each block read from a byte range of a data file
+READ_BLOCK_SIZE = 16 * 1024 ** 2
+
+
+def get_offsets_path(table, data_path, index_dir=None):
+    "Returns the path of the offset index of the data file at `data_path`."
+    return os.path.join(index_dir or get_index_dir(), table, os.path.basename(data_path) + OFFSETS_FILE_SUFFIX)
+
+
+def get_header_path(table, index_dir=None):
+    "Returns the path of the file holding the output header line of `table`."
+    return os.path.join(index_dir or get_index_dir(), HEADER_FILE_NAME.format(table))
+
+
+class OffsetIndex:
+    """
+    Index of the runs of consecutive rows with the same (src_id, month) in a data
+    file, held as NumPy arrays in file order. The size and modification time of
+    the data file are kept so that out-of-date indexes can be detected.
+
+    `time_sorted` is True if the times of the rows never decrease through the
+    file, in which case `sample_offsets` and `sample_times` (YYYYMMDDHHMM integers)
+    give the offset and time of the first row and of a row every `TIME_SAMPLE_INTERVAL`
+    bytes after it.
+    """
+
+    def __init__(self, src_ids, months, starts, lengths, file_size=0, file_mtime=0,
+                 time_sorted=False, sample_offsets=(), sample_times=()):
+        self.src_ids = np.asarray(src_ids, dtype=np.int32)
+        self.months = np.asarray(months, dtype=np.int8)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.time_sorted = bool(time_sorted)
+        self.sample_offsets = np.asarray(sample_offsets, dtype=np.int64)
+        self.sample_times = np.asarray(sample_times, dtype=np.int64)
+
+    @classmethod
+    def build(cls, table, path):
+        "Builds the index of the data file of `table` at `path` by reading it once."
+        (time_index, src_id_index, header_lines) = get_layout(table, path)
+        max_split = max(time_index, src_id_index) + 1
+        stat = os.stat(path)
+
+        src_ids, months, starts, lengths = [], [], [], []
+        sample_offsets, sample_times = [], []
+        run_key = None
+        run_end = -1
+        offset = 0
+        last_time = ''
+        time_sorted = True
+
+        with open(path, 'rb') as reader:
+            for _ in range(header_lines):
+                offset += len(reader.readline())
+
+            for line in reader:
+                fields = line.split(b',', max_split)
+
+                try:
+                    row_time = parse_time(fields[time_index])
+                    key = (int(fields[src_id_index]), int(row_time[4:6]))
+                except (IndexError, ValueError):
+                    offset += len(line)
+                    continue
+
+                if row_time < last_time:
+                    time_sorted = False
+                last_time = row_time
+
+                if time_sorted and (not sample_offsets or offset >= sample_offsets[-1] + TIME_SAMPLE_INTERVAL):
+                    sample_offsets.append(offset)
+                    sample_times.append(int(row_time))
+
+                if key == run_key and offset == run_end:
+                    lengths[-1] += len(line)
+                else:
+                    src_ids.append(key[0])
+                    months.append(key[1])
+                    starts.append(offset)
+                    lengths.append(len(line))
+                    run_key = key
+
+                offset += len(line)
+                run_end = offset
+
+        if not time_sorted:
+            sample_offsets, sample_times = [], []
+
+        return cls(src_ids, months, starts, lengths, file_size=stat.st_size, file_mtime=stat.st_mtime,
+                   time_sorted=time_sorted, sample_offsets=sample_offsets, sample_times=sample_times)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['src_ids'], data['months'], data['starts'], data['lengths'],
+                       file_size=int(data['file_size']), file_mtime=float(data['file_mtime']),
+                       time_sorted=bool(data['time_sorted']), sample_offsets=data['sample_offsets'],
+                       sample_times=data['sample_times'])
+
+    def save(self, path):
+        "Writes the index to `path`, replacing any existing file in one step."
+        tmp_path = '%s.tmp.npz' % path
+
+        np.savez(tmp_path, src_ids=self.src_ids, months=self.months, starts=self.starts,
+                 lengths=self.lengths, file_size=self.file_size, file_mtime=self.file_mtime,
+                 time_sorted=self.time_sorted, sample_offsets=self.sample_offsets,
+                 sample_times=self.sample_times)
+        os.replace(tmp_path, path)
+
+    def is_current(self, path):
+        "Returns True if the data file at `path` has not changed since the index was built."
+        stat = os.stat(path)
+        return stat.st_size == self.file_size and stat.st_mtime == self.file_mtime
+
+    def ranges(self, src_ids, months=None):
+        """
+        Returns a list of (start, end) byte ranges, in file order, of the rows of
+        `src_ids` (in `months` if given). Adjacent ranges are merged. IDs that
+        are not numbers have no rows.
+        """
+        mask = np.isin(self.src_ids, parse_src_ids(src_ids))
+
+        if months is not None:
+            mask &= np.isin(self.months, list(months))
+
+        starts = self.starts[mask]
+        ends = starts + self.lengths[mask]
+
+        if len(starts) == 0:
+            return []
+
+        # Start a new range wherever a run does not follow on from the previous one
+        breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+        range_starts = starts[np.concatenate(([0], breaks))]
+        range_ends = ends[np.concatenate((breaks - 1, [len(ends) - 1]))]
+
+        return list(zip(range_starts.tolist(), range_ends.tolist()))
+
+    def window_ranges(self, src_ids, year, start, end):
+        """
+        Returns the byte ranges (see `ranges`) of the rows of `src_ids` in the
+        months of `year` between the `start` and `end` times (YYYYMMDDHHMM), cut
+        down to the byte range of the window if the rows are in time order.
+        """
+        return _clip_ranges(self.ranges(src_ids, _window_months(year, start, end)), self.time_window(start, end))
+
+    def stations(self):
+        "Returns a sorted array of the src_ids in the file."
+        return np.unique(self.src_ids)
+
+    def station_sizes(self):
+        "Returns a dictionary of src_id: number of bytes of its rows in the file."
+        (src_ids, inverse) = np.unique(self.src_ids, return_inverse=True)
+        sizes = np.bincount(inverse, weights=self.lengths, minlength=len(src_ids)).astype(np.int64)
+
+        return dict(zip(src_ids.tolist(), sizes.tolist()))
+
+    def time_window(self, start, end):
+        """
+        Returns the (start, end) byte range holding all the rows between the `start`
+        and `end` times (YYYYMMDDHHMM), found by binary search of the sparse time
+        index, or None if the rows are not in time order. The range may also hold
+        rows just outside the window.
+        """
+        if not self.time_sorted:
+            return None
+
+        if len(self.sample_offsets) == 0:
+            return (0, 0)
+
+        # From the last sample before the window to the first sample after it
+        first = np.searchsorted(self.sample_times, int(start), side='left') - 1
+        last = np.searchsorted(self.sample_times, int(end), side='right')
+
+        range_start = int(self.sample_offsets[max(first, 0)])
+        range_end = int(self.sample_offsets[last]) if last < len(self.sample_offsets) else self.file_size
+
+        return (range_start, range_end)
+
+
+def get_offset_index(table, path):
+    """
+    Returns the OffsetIndex of the data file of `table` at `path`, or None if no
+    index directory is configured, there is no index or it is out of date.
+    """
+    if not get_index_dir():
+        return None
+
+    try:
+        index = OffsetIndex.load(get_offsets_path(table, path))
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if not index.is_current(path):
+        LOGGER.warning('Offset index for {} is out of date, ignoring it'.format(path))
+        return None
+
+    return index
+
+
+def get_table_header(table):
+    "Returns the output header line (bytes) of `table` saved in the index directory, or None."
+    if not get_index_dir():
+        return None
+
+    try:
+        with open(get_header_path(table), 'rb') as reader:
+            return reader.read() or None
+    except OSError:
+        return None
+
+
+def capture_table_header(table, path, scan, tmp_path, index_dir=None):
+    """
+    Saves the header line written for `table` by the MIDAS subsetter. A request
+    for the day and station of the first row of the data file at `path` is made
+    by calling `scan(output_path, start, end, src_ids)`, with `tmp_path` as the
+    output path (the file is removed in all cases). Returns the header line, or
+    None if the file has no rows or the request wrote nothing.
+    """
+    try:
+        (time_index, src_id_index, header_lines) = get_layout(table, path)
+
+        with open(path, 'rb') as reader:
+            for _ in range(header_lines):
+                reader.readline()
+
+            fields = reader.readline().split(b',')
+
+        if len(fields) <= max(time_index, src_id_index):
+            return None
+
+        day = parse_time(fields[time_index])[:8]
+        scan(tmp_path, day + '0000', day + '2359', [fields[src_id_index].strip().decode('ascii', 'ignore')])
+
+        with open(tmp_path, 'rb') as reader:
+            header = reader.readline()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if not header:
+        return None
+
+    with open(get_header_path(table, index_dir), 'wb') as writer:
+        writer.write(header)
+
+    return header
+
+
+def _window_months(year, start, end):
+    "Returns the months of `year` between the `start` and `end` times (YYYYMMDDHHMM)."
+    first = int(start[4:6]) if year == int(start[:4]) else 1
+    last = int(end[4:6]) if year == int(end[:4]) else 12
+    return range(first, last + 1)
+
+
+def _clip_ranges(ranges, window):
+    "Returns the parts of the byte `ranges` inside the `window` range (or all of them if it is None)."
+    if window is None:
+        return ranges
+
+    return [(max(start, window[0]), min(end, window[1])) for (start, end) in ranges
+            if start < window[1] and end > window[0]]
+
+
+def _read_rows(reader, range_start, range_end):
+    "Yields the rows in a byte range of a data file, reading it in blocks."
+    reader.seek(range_start)
+    remaining = range_end - range_start
+    partial = b''
+
+    while remaining > 0:
+        block = reader.read(min(READ_BLOCK_SIZE, remaining))
+
+        if not block:
+            break
+
+        remaining -= len(block)
+        rows = (partial + block).splitlines(True)
+        partial = rows.pop() if remaining > 0 and not rows[-1].endswith(b'\n') else b''
+
+        yield from rows
+
+    if partial:
+        yield partial
+
+
+def read_indexed(table, output_path, start, end, src_ids=None):
+    """
+    Writes the header line and the rows of `table` for `src_ids` between the
+    `start` and `end` times (YYYYMMDDHHMM) to `output_path`, reading only the
+    byte ranges of those stations in the months of the window, cut down to the
+    byte range of the window itself in files whose rows are in time order.
+    Rows are written as they are in the data files, in file order.
+
+    If `src_ids` is empty (all stations), only the byte range of the window is
+    read from each file, so all the files in the window must be in time order.
+
+    Returns False, without writing anything, if the header of the table is not
+    known or any of the data files in the time window has no current index (or
+    is not in time order when it needs to be).
+    """
+    header = get_table_header(table)
+
+    if header is None:
+        return False
+
+    year_files = find_year_files(table)
+    plan = []
+
+    for year in range(int(start[:4]), int(end[:4]) + 1):
+        for path in year_files.get(year, []):
+            index = get_offset_index(table, path)
+
+            if index is None:
+                return False
+
+            window = index.time_window(start, end)
+
+            if src_ids:
+                ranges = index.window_ranges(src_ids, year, start, end)
+            elif window is not None:
+                ranges = [window] if window[1] > window[0] else []
+            else:
+                return False
+
+            (time_index, _, _) = get_layout(table, path)
+            plan.append((path, time_index, ranges))
+
+    with open(output_path, 'wb') as writer:
+        writer.write(header)
+
+        for (path, time_index, ranges) in plan:
+            with open(path, 'rb') as reader:
+                for (range_start, range_end) in ranges:
+                    for row in _read_rows(reader, range_start, range_end):
+                        fields = row.split(b',', time_index + 1)
+
+                        if len(fields) > time_index and start <= parse_time(fields[time_index]) <= end:
+                            writer.write(row)
+
+    LOGGER.info('Read {} bytes in {} ranges from {} indexed file(s) for {}'.format(
+        sum(range_end - range_start for (_, _, ranges) in plan for (range_start, range_end) in ranges),
+        sum(len(ranges) for (_, _, ranges) in plan), len(plan), output_path))
+    return True
@@ -0,0 +1,340 @@
+"""
+output_formats.py
+=================
+
+Converts the delimited text files written by the MIDAS subsetter into the other
+output formats offered by the extraction processes, and compresses them.
+
+Parquet output needs the optional `pyarrow` package and zstd compression of
+text output needs the optional `zstandard` package.
+"""
+
+import gzip
+import io
+import os
+import shutil
+
+from pywps import FORMATS
+from pywps.inout.formats import Format
+from pywps.app.exceptions import ProcessError
+
+
+PARQUET = Format('application/vnd.apache.parquet', extension='.parquet', encoding='base64')
+
+# Output format name -> (file extension, pywps Format). The extension of "text"
+# depends on the delimiter so it is set by the caller.
+OUTPUT_FORMATS = {
+    'text': (None, FORMATS.TEXT),
+    'parquet': ('parquet', PARQUET),
+}
+
+GZIP = Format('application/gzip', extension='.gz', encoding='base64')
+ZSTD = Format('application/zstd', extension='.zst', encoding='base64')
+
+# Compression name -> (file extension, pywps Format, default level). Parquet files
+# are compressed internally instead, so keep their own extension and Format.
+COMPRESSIONS = {
+    'none': (None, None, None),
+    'gzip': ('gz', GZIP, 6),
+    'zstd': ('zst', ZSTD, 3),
+}
+
+# Size of each block of text read (and so each row group written) when converting
+PARQUET_BLOCK_SIZE = 16 * 1024 ** 2
+
+# Size of each block read when compressing
+COMPRESSION_BLOCK_SIZE = 1024 ** 2
+
+
+def get_file_extension(output_format, compression, delimiter):
+    "Returns the output file extension for the format, compression and delimiter."
+    ext = OUTPUT_FORMATS[output_format][0]
+
+    if ext:
+        return ext
+
+    ext = "csv" if delimiter == "comma" else "txt"
+
+    if compression != 'none':
+        ext = "%s.%s" % (ext, COMPRESSIONS[compression][0])
+
+    return ext
+
+
+def get_data_format(output_format, compression):
+    "Returns the pywps Format of the output files for the format and compression."
+    if output_format == 'text' and compression != 'none':
+        return COMPRESSIONS[compression][1]
+
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def compress_file(input_path, output_path, compression, level=None):
+    """
+    Compresses `input_path` to `output_path` with `compression` ("gzip" or "zstd")
+    at `level` (or the default level for the compression), streaming it in blocks,
+    and returns `output_path`.
+    """
+    if level is None:
+        level = COMPRESSIONS[compression][2]
+
+    with open(input_path, 'rb') as reader:
+        if compression == 'gzip':
+            with gzip.open(output_path, 'wb', compresslevel=level) as writer:
+                shutil.copyfileobj(reader, writer, COMPRESSION_BLOCK_SIZE)
+
+        elif compression == 'zstd':
+            zstandard = _import_zstandard()
+            compressor = zstandard.ZstdCompressor(level=level)
+
+            with open(output_path, 'wb') as fout, compressor.stream_writer(fout) as writer:
+                shutil.copyfileobj(reader, writer, COMPRESSION_BLOCK_SIZE)
+
+        else:
+            raise ValueError("Unknown compression: %s" % compression)
+
+    return output_path
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ProcessError('zstd compression is not available: the zstandard package is not installed.')
+
+    return zstandard
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        raise ProcessError('Parquet output is not available: the pyarrow package is not installed.')
+
+    return pyarrow
+
+
+def _read_column_names(text_path, delimiter):
+    "Returns the column names from the header line of the text file."
+    with open(text_path) as reader:
+        header = reader.readline()
+
+    return [name.strip() for name in header.rstrip('\r\n').split(delimiter)]
+
+
+def _read_text_batches(pa, text_path, names, delimiter):
+    """
+    Yields a list of string arrays for each block of the text file, with
+    surrounding whitespace removed and empty values set to null.
+    """
+    batches = pa.csv.open_csv(
+        text_path,
+        read_options=pa.csv.ReadOptions(column_names=names, skip_rows=1,
+                                        block_size=PARQUET_BLOCK_SIZE),
+        parse_options=pa.csv.ParseOptions(delimiter=delimiter),
+        convert_options=pa.csv.ConvertOptions(column_types={name: pa.string() for name in names}))
+
+    null = pa.scalar(None, pa.string())
+
+    for batch in batches:
+        columns = []
+
+        for column in batch.columns:
+            column = pa.compute.utf8_trim_whitespace(column)
+            columns.append(pa.compute.if_else(pa.compute.equal(column, ''), null, column))
+
+        yield columns
+
+
+def _infer_types(pa, text_path, names, delimiter):
+    """
+    Returns the narrowest type (int64, float64, timestamp or string) that holds
+    every value of each column in the text file.
+    """
+    candidates = [pa.int64(), pa.float64(), pa.timestamp('s'), pa.string()]
+    levels = [0] * len(names)
+    seen = [False] * len(names)
+
+    for columns in _read_text_batches(pa, text_path, names, delimiter):
+        for i, column in enumerate(columns):
+            if column.null_count == len(column):
+                continue
+
+            seen[i] = True
+
+            while levels[i] < len(candidates) - 1:
+                try:
+                    pa.compute.cast(column, candidates[levels[i]])
+                    break
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    levels[i] += 1
+
+    return pa.schema([(name, candidates[level] if has_values else pa.string())
+                      for name, level, has_values in zip(names, levels, seen)])
+
+
+def text_to_parquet(text_path, parquet_path, delimiter=',', compression='none', level=None):
+    """
+    Converts a delimited text file with a header line to a Parquet file with typed
+    columns, one row group per block of text, and returns `parquet_path`.
+
+    The Parquet file is compressed internally with `compression` ("gzip" or "zstd")
+    at `level`; if `compression` is "none", the pyarrow default (snappy) is used.
+
+    The text is read twice: once to work out the column types and once to write
+    the data, so memory use is bounded by the block size, not the file size.
+    """
+    pa = _import_pyarrow()
+
+    if os.path.getsize(text_path) == 0:
+        pa.parquet.write_table(pa.table({}), parquet_path)
+        return parquet_path
+
+    names = _read_column_names(text_path, delimiter)
+    schema = _infer_types(pa, text_path, names, delimiter)
+
+    if compression == 'none':
+        codec = {}
+    else:
+        codec = dict(compression=compression, compression_level=level)
+
+    with pa.parquet.ParquetWriter(parquet_path, schema, **codec) as writer:
+        for columns in _read_text_batches(pa, text_path, names, delimiter):
+            arrays = [pa.compute.cast(column, field.type) for column, field in zip(columns, schema)]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+    return parquet_path
+
+
+def _open_text(path, mode, compression, level=None):
+    "Opens the (compressed) text file at `path` in binary `mode` ('rb' or 'wb')."
+    if compression == 'gzip':
+        return gzip.open(path, mode, **({'compresslevel': level} if level is not None else {}))
+
+    if compression == 'zstd':
+        zstandard = _import_zstandard()
+
+        if mode == 'wb':
+            level = COMPRESSIONS['zstd'][2] if level is None else level
+            return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=level))
+
+        # The decompression reader has no readline
+        return io.BufferedReader(zstandard.open(path, mode), COMPRESSION_BLOCK_SIZE)
+
+    return open(path, mode)
+
+
+def _concatenate_text(input_paths, output_path, compression, level):
+    with _open_text(output_path, 'wb', compression, level) as writer:
+        header_written = False
+        last = b'\n'
+
+        for input_path in input_paths:
+            with _open_text(input_path, 'rb', compression) as reader:
+                header = reader.readline()
+
+                if not header:
+                    continue
+
+                if not header_written:
+                    writer.write(header)
+                    header_written = True
+                    last = header[-1:]
+
+                first_block = True
+
+                for block in iter(lambda: reader.read(COMPRESSION_BLOCK_SIZE), b''):
+                    # Each file starts on a new line
+                    if first_block and last != b'\n':
+                        writer.write(b'\n')
+
+                    first_block = False
+                    writer.write(block)
+                    last = block[-1:]
+
+
+def _has_values(metadata, column):
+    "Returns False if the statistics of the Parquet file show that `column` only holds nulls."
+    null_count = 0
+
+    for row_group in range(metadata.num_row_groups):
+        statistics = metadata.row_group(row_group).column(column).statistics
+
+        if statistics is None or not statistics.has_null_count:
+            return True
+
+        null_count += statistics.null_count
+
+    return null_count < metadata.num_rows
+
+
+def _common_schema(pa, files):
+    """
+    Returns the schema holding the columns of all `files`, a list of
+    ParquetFile: the column types are inferred separately for each file (see
+    `_infer_types`), so integer columns are widened to float64 if needed and
+    columns of other differing types are read as strings. Columns with no
+    values in a file (read as strings) do not count.
+    """
+    names = files[0].schema_arrow.names
+    fields = []
+
+    for (column, name) in enumerate(names):
+        types = set(parquet_file.schema_arrow.field(name).type for parquet_file in files
+                    if _has_values(parquet_file.metadata, column))
+
+        if len(types) == 1:
+            fields.append((name, types.pop()))
+        elif types == {pa.int64(), pa.float64()}:
+            fields.append((name, pa.float64()))
+        else:
+            fields.append((name, pa.string()))
+
+    return pa.schema(fields)
+
+
+def _concatenate_parquet(input_paths, output_path, compression, level):
+    pa = _import_pyarrow()
+
+    # Leave out the files written for chunks with no rows at all
+    files = [pa.parquet.ParquetFile(input_path) for input_path in input_paths]
+    files = [parquet_file for parquet_file in files if parquet_file.schema_arrow.names]
+
+    if not files:
+        pa.parquet.write_table(pa.table({}), output_path)
+        return
+
+    schema = _common_schema(pa, files)
+    names = schema.names
+
+    if compression == 'none':
+        codec = {}
+    else:
+        codec = dict(compression=compression, compression_level=level)
+
+    with pa.parquet.ParquetWriter(output_path, schema, **codec) as writer:
+        for parquet_file in files:
+            for batch in parquet_file.iter_batches(columns=names):
+                arrays = [pa.compute.cast(batch.column(name), field.type) for (name, field) in zip(names, schema)]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+
+def concatenate_files(input_paths, output_path, output_format='text', compression='none', level=None):
+    """
+    Writes the rows of each of `input_paths` (e.g. the time chunks of an
+    extraction, all in `output_format` with `compression`), in order, to the
+    single file `output_path` in the same format, and returns `output_path`.
+    Text files keep the header line of the first file only. Missing files are
+    left out.
+    """
+    input_paths = [input_path for input_path in input_paths if os.path.exists(input_path)]
+
+    if output_format == 'parquet':
+        _concatenate_parquet(input_paths, output_path, compression, level)
+    else:
+        _concatenate_text(input_paths, output_path, compression, level)
+
+    return output_path
@@ -0,0 +1,268 @@
+"""
+output_server.py
+================
+
+Holds class OutputServer, the WSGI application serving the WPS output files
+(the pywps `outputpath`) under /outputs, in the development server and in the
+gunicorn workers (see `goldfinch.server.serve_outputs`).
+
+ * The file is handed to the `wsgi.file_wrapper` of the WSGI server where there
+   is one, so that gunicorn sends it with sendfile(2) rather than copying it
+   through Python, or else is read in blocks.
+ * A single byte range (`Range`, checked against `If-Range`) is served as a 206
+   response, so that interrupted downloads can be resumed.
+ * The ETag of an output file is the SHA-1 of its contents, recorded with the
+   file (as an extended attribute, kept when pywps copies or links it to the
+   outputs) when the extraction finished writing it (see `record_etag`). Other
+   files get a weak ETag made from their inode, size and modification time.
+ * If the client accepts gzip and there is an up-to-date `.gz` sibling of the
+   file, that is served instead, with `Content-Encoding: gzip`.
+ * If `outputaccelredirect` is set in the `[server]` section, the response only
+   names the file in an `X-Accel-Redirect` header, under that prefix, and the
+   front-end server (e.g. nginx) sends it, so no worker is held by the download.
+"""
+
+import calendar
+import hashlib
+import mimetypes
+import os
+from urllib.parse import quote
+
+from pywps import configuration
+from werkzeug.http import (http_date, parse_accept_header, parse_date, parse_etags,
+                           parse_range_header, quote_etag, unquote_etag)
+from werkzeug.security import safe_join
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Extended attribute holding "<sha1> <size> <mtime_ns>" of an output file
+ETAG_XATTR = 'user.goldfinch.etag'
+
+# Size of each block read when hashing or sending a file
+BLOCK_SIZE = 1024 ** 2
+
+
+def file_digest(path):
+    "Returns the SHA-1 (hex) of the contents of the file at `path`."
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as reader:
+        for block in iter(lambda: reader.read(BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def record_etag(path, digest=None):
+    """
+    Records `digest`, the SHA-1 (hex) of the contents of the file at `path`
+    (computed if None), with the file, as the ETag it is served with. Nothing
+    is recorded if the file system does not support extended attributes.
+    """
+    if digest is None:
+        digest = file_digest(path)
+
+    stat = os.stat(path)
+
+    try:
+        os.setxattr(path, ETAG_XATTR, '{} {} {}'.format(digest, stat.st_size, stat.st_mtime_ns).encode())
+    except (AttributeError, OSError) as exc:
+        LOGGER.debug('Could not record the ETag of {}: {}'.format(path, exc))
+
+
+def get_etag(path, stat):
+    """
+    Returns (etag, weak) for the file at `path` with `os.stat` result `stat`:
+    its recorded SHA-1 if that is still valid for the file's size and
+    modification time, or else a weak ETag made from its inode, size and
+    modification time.
+    """
+    try:
+        (digest, size, mtime_ns) = os.getxattr(path, ETAG_XATTR).decode().split()
+
+        if int(size) == stat.st_size and int(mtime_ns) == stat.st_mtime_ns:
+            return digest, False
+    except (AttributeError, OSError, ValueError):
+        pass
+
+    return '{:x}-{:x}-{:x}'.format(stat.st_ino, stat.st_size, stat.st_mtime_ns), True
+
+
+def _content_type(path):
+    (mimetype, encoding) = mimetypes.guess_type(path)
+
+    if encoding == 'gzip':
+        return 'application/gzip'
+
+    if encoding or not mimetype:
+        return 'application/octet-stream'
+
+    return mimetype
+
+
+def _timestamp(value):
+    "Returns the POSIX time of the HTTP date `value`, or None if it is not a date."
+    date = parse_date(value)
+    return calendar.timegm(date.utctimetuple()) if date else None
+
+
+class _FileRange:
+    "Iterable of the next `length` bytes of the open file `reader`, in blocks."
+
+    def __init__(self, reader, length):
+        self.reader = reader
+        self.length = length
+
+    def __iter__(self):
+        remaining = self.length
+
+        while remaining > 0:
+            block = self.reader.read(min(BLOCK_SIZE, remaining))
+
+            if not block:
+                break
+
+            remaining -= len(block)
+            yield block
+
+    def close(self):
+        self.reader.close()
+
+
+class OutputServer:
+    """
+    WSGI application serving the files under `root`, by their path relative to
+    it. If `accel_redirect` is given, the files are sent by the front-end server
+    from that location prefix instead.
+    """
+
+    def __init__(self, root, accel_redirect=None):
+        self.root = root
+        self.accel_redirect = accel_redirect
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+
+        if method not in ('GET', 'HEAD'):
+            return self._error(start_response, '405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+
+        relative_path = environ.get('PATH_INFO', '').lstrip('/')
+        path = safe_join(self.root, relative_path) if relative_path else None
+
+        if path is None or not os.path.isfile(path):
+            return self._error(start_response, '404 Not Found')
+
+        headers = [('Content-Type', _content_type(path))]
+
+        if self.accel_redirect:
+            headers.append(('X-Accel-Redirect', self.accel_redirect.rstrip('/') + '/' + quote(relative_path)))
+            start_response('200 OK', headers)
+            return []
+
+        gzip_path = path + '.gz'
+
+        if not path.endswith('.gz') and os.path.isfile(gzip_path):
+            headers.append(('Vary', 'Accept-Encoding'))
+
+            if parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING')).quality('gzip') > 0 and \
+                    os.path.getmtime(gzip_path) >= os.path.getmtime(path):
+                path = gzip_path
+                headers.append(('Content-Encoding', 'gzip'))
+
+        reader = open(path, 'rb')
+
+        try:
+            return self._send(environ, start_response, path, reader, headers)
+        except BaseException:
+            reader.close()
+            raise
+
+    def _send(self, environ, start_response, path, reader, headers):
+        stat = os.fstat(reader.fileno())
+        (etag, weak) = get_etag(path, stat)
+        length = stat.st_size
+
+        headers += [('ETag', quote_etag(etag, weak)), ('Last-Modified', http_date(stat.st_mtime)),
+                    ('Accept-Ranges', 'bytes')]
+
+        if self._not_modified(environ, etag, stat):
+            reader.close()
+            start_response('304 Not Modified', [header for header in headers if header[0] != 'Content-Type'])
+            return []
+
+        (start, stop) = (0, length)
+        status = '200 OK'
+        byte_range = parse_range_header(environ.get('HTTP_RANGE'))
+
+        if byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 and \
+                self._if_range(environ, etag, weak, stat):
+            (start, stop) = byte_range.ranges[0]
+
+            if stop is None:
+                stop = length
+                start = max(length + start, 0) if start < 0 else start
+
+            stop = min(stop, length)
+
+            if start >= stop:
+                reader.close()
+                return self._error(start_response, '416 Range Not Satisfiable',
+                                   [('Content-Range', 'bytes */{}'.format(length))])
+
+            status = '206 Partial Content'
+            headers.append(('Content-Range', 'bytes {}-{}/{}'.format(start, stop - 1, length)))
+
+        headers.append(('Content-Length', str(stop - start)))
+        start_response(status, headers)
+
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            reader.close()
+            return []
+
+        reader.seek(start)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+
+        # The server sends no more than Content-Length bytes of the wrapped
+        # file, from its current position (gunicorn with sendfile)
+        if file_wrapper is not None:
+            return file_wrapper(reader, BLOCK_SIZE)
+
+        return _FileRange(reader, stop - start)
+
+    @staticmethod
+    def _not_modified(environ, etag, stat):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+
+        if if_none_match:
+            return parse_etags(if_none_match).contains_weak(etag)
+
+        since = _timestamp(environ.get('HTTP_IF_MODIFIED_SINCE'))
+        return since is not None and int(stat.st_mtime) <= since
+
+    @staticmethod
+    def _if_range(environ, etag, weak, stat):
+        "Returns True if the range should be served: there is no If-Range or it matches the file."
+        if_range = environ.get('HTTP_IF_RANGE')
+
+        if not if_range:
+            return True
+
+        if if_range.startswith(('"', 'W/')):
+            (value, value_weak) = unquote_etag(if_range)
+            return not (weak or value_weak) and value == etag
+
+        return _timestamp(if_range) == int(stat.st_mtime)
+
+    @staticmethod
+    def _error(start_response, status, headers=()):
+        body = status.encode()
+        start_response(status, [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))] + list(headers))
+        return [body]
+
+
+def get_output_server():
+    "Returns the OutputServer for the pywps `outputpath` and `outputaccelredirect` of the `[server]` section."
+    return OutputServer(configuration.get_config_value('server', 'outputpath'),
+                        accel_redirect=configuration.get_config_value('server', 'outputaccelredirect') or None)
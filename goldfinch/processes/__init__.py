@@ -1,9 +1,46 @@
-from .wps_get_weather_stations import GetWeatherStations
-from .wps_extract_uk_station_data import ExtractUKStationData
-from .wps_extract_uk_station_data_with_date_input import ExtractUKStationDataWithDateInput
-
-processes = [
-    GetWeatherStations(),
-    ExtractUKStationData(),
-    ExtractUKStationDataWithDateInput(),
+"""
+The WPS processes of goldfinch.
+
+The process modules (and the packages they use, such as the `midas_extract`
+vocabularies) are only imported, and the processes constructed, when they are
+first needed, through `get_processes()` or the `processes` attribute.
+"""
+
+import importlib
+import threading
+
+# (module, class) of each process, in the order they are offered
+PROCESSES = [
+    ('wps_get_weather_stations', 'GetWeatherStations'),
+    ('wps_extract_uk_station_data', 'ExtractUKStationData'),
+    ('wps_extract_uk_station_data_with_date_input', 'ExtractUKStationDataWithDateInput'),
 ]
+
+_processes = None
+_processes_lock = threading.Lock()
+
+
+def _get_process_class(module, name):
+    return getattr(importlib.import_module('.' + module, __name__), name)
+
+
+def get_processes():
+    "Returns the list of process instances, constructed once per process."
+    global _processes
+
+    with _processes_lock:
+        if _processes is None:
+            _processes = [_get_process_class(module, name)() for (module, name) in PROCESSES]
+
+    return _processes
+
+
+def __getattr__(name):
+    if name == 'processes':
+        return get_processes()
+
+    for (module, class_name) in PROCESSES:
+        if name == class_name:
+            return _get_process_class(module, class_name)
+
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
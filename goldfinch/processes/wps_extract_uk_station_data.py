@@ -1,16 +1,22 @@
+import json
 import os
 import os.path
 
 from pywps import Process, LiteralInput, ComplexOutput, BoundingBoxInput, FORMATS
 from pywps.app.Common import Metadata
+from pywps.inout.outputs import MetaLink4, MetaFile
 
 from midas_extract.vocabs import TABLE_NAMES, MIDAS_CATALOGUE_DICT, UK_COUNTIES
 
-from goldfinch.util import (get_station_list, validate_inputs, locate_process_dir,
-                            filter_obs_by_time_chunk, read_from_file,
-                            WEATHER_STATIONS_FILE_NAME, get_valid_date_range)
+from goldfinch.util import (get_station_list, validate_inputs, get_job_station_list,
+                            filter_obs_by_time_chunk, register_job, ChunkProgress, get_extraction_plan,
+                            scheduled_extraction, combine_time_chunks, WEATHER_STATIONS_FILE_NAME,
+                            get_valid_date_range, get_chunk_target_size, get_compression_level)
+from goldfinch.archive import archive_mtime_scope
+from goldfinch.cache import get_result_cache
 
 from goldfinch.constraints import check_request_size
+from goldfinch.output_formats import OUTPUT_FORMATS, COMPRESSIONS, PARQUET, GZIP, ZSTD, get_data_format
 
 import logging
 LOGGER = logging.getLogger("PYWPS")
@@ -56,6 +62,25 @@ class ExtractUKStationData(Process):
                          data_type='string',
                          min_occurs=0,
                          max_occurs=1),
+            LiteralInput('chunk_rule', 'Chunk Rule',
+                         abstract='How the data is split into time chunks, one file each:'
+                                  ' "none" (a single file), by "decade", "year" or "month", or "auto"'
+                                  ' (chunks of whole months of about the same size).'
+                                  ' The output always holds all of the data (see combine_chunks).',
+                         data_type='string',
+                         allowed_values=['none', 'auto', 'decade', 'year', 'month'],
+                         default='none',
+                         min_occurs=0,
+                         max_occurs=1),
+            LiteralInput('combine_chunks', 'Combine Chunks',
+                         abstract='If true, the files of the time chunks are also joined into a single'
+                                  ' output file, which takes as much disk space again as the chunks'
+                                  ' (and is compressed again if compression is set). If false, the'
+                                  ' output is the metalink file listing the time chunk files.',
+                         data_type='boolean',
+                         default=True,
+                         min_occurs=0,
+                         max_occurs=1),
             LiteralInput('delimiter', 'Delimiter',
                          abstract='The delimiter to be used in the output files.',
                          data_type='string',
@@ -63,12 +88,42 @@ class ExtractUKStationData(Process):
                          default='comma',
                          min_occurs=0,
                          max_occurs=1),
+            LiteralInput('output_format', 'Output Format',
+                         abstract='The format of the output files: delimited text (see the delimiter input)'
+                                  ' or Parquet, a columnar format with typed columns.',
+                         data_type='string',
+                         allowed_values=list(OUTPUT_FORMATS),
+                         default='text',
+                         min_occurs=0,
+                         max_occurs=1),
+            LiteralInput('compression', 'Compression',
+                         abstract='The compression applied to the output files. Text files are'
+                                  ' compressed to .gz or .zst files, Parquet files are compressed internally.',
+                         data_type='string',
+                         allowed_values=list(COMPRESSIONS),
+                         default='none',
+                         min_occurs=0,
+                         max_occurs=1),
+            LiteralInput('dry_run', 'Dry Run',
+                         abstract='If true, select the stations, then return the extraction plan (time'
+                                  ' chunks, estimated sizes, files to be read and whether the request is'
+                                  ' over the size limit) without extracting any data.',
+                         data_type='boolean',
+                         default=False,
+                         min_occurs=0,
+                         max_occurs=1),
         ]
         outputs = [
             ComplexOutput('output', 'Output',
-                          abstract='Observations file (CSV or tab-delimited).',
+                          abstract='Observations file (CSV, tab-delimited or Parquet) holding all of the'
+                                   ' data, whether or not it is split into time chunks, or the metalink'
+                                   ' file listing the time chunk files if they are not combined.',
                           as_reference=True,
-                          supported_formats=[FORMATS.TEXT]),
+                          supported_formats=[FORMATS.TEXT, PARQUET, GZIP, ZSTD, FORMATS.META4]),
+            ComplexOutput('output_files', 'Output files',
+                          abstract='Metalink file listing the observations files for each time chunk.',
+                          as_reference=True,
+                          supported_formats=[FORMATS.META4]),
             ComplexOutput('stations', 'Station list output',
                           abstract='Station list.',
                           as_reference=True,
@@ -77,6 +132,13 @@ class ExtractUKStationData(Process):
                           abstract='File containing links to metadata and documentation.',
                           as_reference=True,
                           supported_formats=[FORMATS.TEXT]),
+            ComplexOutput('dry_run_plan', 'Dry run plan',
+                          abstract='The extraction plan returned by a dry run (JSON): the number of stations,'
+                                   ' the planned time chunks with their estimated sizes in bytes, the'
+                                   ' yearly data files to be read and the size limit on requests, with'
+                                   ' whether the request is over it.',
+                          as_reference=False,
+                          supported_formats=[FORMATS.JSON]),
             ]
 
         super(ExtractUKStationData, self).__init__(
@@ -91,7 +153,7 @@ class ExtractUKStationData(Process):
                      ' You can select which stations you require using'
                      ' either a bounding box, a list of UK counties,'
                      ' a list of station IDs or an uploaded file containing station IDs.'
-                     ' Data is returned in CSV or tab-delimited text files.'
+                     ' Data is returned in CSV, tab-delimited text or Parquet files.'
                      ' Please see the disclaimer.',
             keywords=['stations', 'uk', 'extract', 'observations', 'data'],
             metadata=[
@@ -107,7 +169,11 @@ class ExtractUKStationData(Process):
         )
 
     def _handler(self, request, response):
-        # TODO: dry-run
+        # Look up the modification time of the archive once for the whole job
+        with archive_mtime_scope():
+            return self._run(request, response)
+
+    def _run(self, request, response):
         LOGGER.info("Extracting UK station data")
 
         # Set self.response so it can be modified in other methods
@@ -117,7 +183,8 @@ class ExtractUKStationData(Process):
 
         # Define defaults for arguments that might not be set
         input_defaults = {'station_ids': [], 'input_job_id': None,
-                          'chunk_rule': None, 'delimiter': 'comma'}
+                          'chunk_rule': None, 'delimiter': 'comma', 'output_format': 'text',
+                          'compression': 'none', 'combine_chunks': True, 'dry_run': False}
 
         inputs = validate_inputs(request.inputs, defaults=input_defaults,
                                  required=['obs_table', 'DateRange'])
@@ -134,13 +201,17 @@ class ExtractUKStationData(Process):
         # Estimate we are 5% of the way through
         self.response.update_status('Extracted station ID list.', 5)
 
-        # Check request size against limits
-        check_request_size(station_list, inputs)
-
         # Define data file base
         prefix = 'station_data'
         output_file_base = os.path.join(self.workdir, prefix)
 
+        # The plan of a dry run says whether the request is over the size limit
+        if inputs['dry_run']:
+            return self._dry_run(inputs, output_file_base, stations_file_path, station_list)
+
+        # Check request size against limits
+        size_estimate = check_request_size(station_list, inputs)
+
         # Need temp dir for big file extractions
         proc_tmp_dir = os.path.join(self.workdir, 'tmp')
 
@@ -150,17 +221,45 @@ class ExtractUKStationData(Process):
         # Get Obs Table Names to extract from
         obs_table = inputs['obs_table']
 
-        # Extract the observations by filtering the full dataset
-        output_paths = filter_obs_by_time_chunk(obs_table, output_file_base,
-                                                start=inputs['start'], end=inputs['end'],
-                                                src_ids=station_list, delimiter=inputs['delimiter'],
-                                                tmp_dir=proc_tmp_dir)
+        # Look for the output of an identical request in the result cache
+        result_cache = get_result_cache()
+        output_paths = None
+
+        if result_cache:
+            cache_key = result_cache.make_key(inputs, station_list,
+                                              chunk_target_size=get_chunk_target_size(),
+                                              compression_level=get_compression_level())
+            output_paths = result_cache.get(cache_key, self.workdir)
+
+        if not output_paths:
+            # Report progress (throttled) as each time chunk is extracted
+            progress = ChunkProgress(self.response.update_status, start_percent=5, end_percent=95)
+
+            # Wait for a slot for jobs of this size, then extract the observations
+            # by filtering the full dataset
+            with scheduled_extraction(self.uuid, size_estimate, self.response.update_status):
+                output_paths = filter_obs_by_time_chunk(obs_table, output_file_base,
+                                                        start=inputs['start'], end=inputs['end'],
+                                                        src_ids=station_list, delimiter=inputs['delimiter'],
+                                                        chunk_rule=inputs['chunk_rule'], tmp_dir=proc_tmp_dir,
+                                                        output_format=inputs['output_format'],
+                                                        compression=inputs['compression'],
+                                                        progress=progress)
+
+                # Add a file holding all of the time chunks, if there are several
+                if inputs['combine_chunks']:
+                    output_paths = combine_time_chunks(output_paths, output_file_base,
+                                                       delimiter=inputs['delimiter'],
+                                                       output_format=inputs['output_format'],
+                                                       compression=inputs['compression'])
+
+            if result_cache:
+                result_cache.put(cache_key, output_paths)
 
         # Register output file(s)
-# TODO: register more than one if multiple
-        output_path = output_paths[0]
-        LOGGER.info('Written output file: {}'.format(output_path))
-        self.response.outputs['output'].file = output_path
+        self._register_output_files(output_paths,
+                                    get_data_format(inputs['output_format'], inputs['compression']),
+                                    combined=inputs['combine_chunks'])
 
         # Write docs links to output file
         doc_links_file = os.path.join(self.workdir, 'doc_links.txt')
@@ -168,6 +267,23 @@ class ExtractUKStationData(Process):
 
         self.response.outputs['stations'].file = stations_file_path
 
+        # Record the job so that its stations can be reused with input_job_id
+        register_job(self.uuid, self.identifier, self.workdir, stations_file_path, station_list)
+
+        return self.response
+
+    def _dry_run(self, inputs, output_file_base, stations_file_path, station_list):
+        "Returns the extraction plan as the dry_run_plan output, without extracting any data."
+        plan = get_extraction_plan(inputs['obs_table'], output_file_base, inputs['start'], inputs['end'],
+                                   station_list, delimiter=inputs['delimiter'], chunk_rule=inputs['chunk_rule'],
+                                   output_format=inputs['output_format'], compression=inputs['compression'])
+
+        self.response.outputs['dry_run_plan'].data = json.dumps(plan, indent=2)
+        self.response.outputs['stations'].file = stations_file_path
+
+        # Record the job so that its stations can be reused with input_job_id
+        register_job(self.uuid, self.identifier, self.workdir, stations_file_path, station_list)
+
         return self.response
 
     def _resolve_station_list(self, inputs, stations_file_path):
@@ -175,31 +291,55 @@ class ExtractUKStationData(Process):
         Works out whether we need to generate a station list or use those
         sent as inputs.
         """
-        station_list = None
-
         # Use input station list if provided
         if inputs['station_ids'] != []:
             station_list = inputs['station_ids']
 
-        # Use input job ID to extract text file of stations
+        # Use input job ID to extract text file of stations (a ProcessError
+        # if the job is unknown or selected no stations)
         elif inputs['input_job_id']:
-            input_process_dir = locate_process_dir(inputs['input_job_id'])
-            input_weather_stations_file = os.path.join(input_process_dir, WEATHER_STATIONS_FILE_NAME)
-            station_list = read_from_file(input_weather_stations_file)
+            station_list = get_job_station_list(inputs['input_job_id'])
 
-        # If not dry run
-        if not station_list:
+        else:
             # Call code to get Weather Stations
             counties_list = self._get_counties(inputs)
             station_list = get_station_list(counties_list, inputs['bbox'],
                                             inputs['start'], inputs['end'],
-                                            stations_file_path)
+                                            stations_file_path, obs_table=inputs['obs_table'])
 
         # Write the file one per station id per line
         station_list.sort()
 
         return station_list
 
+    def _register_output_files(self, output_paths, data_format, combined=True):
+        """
+        Registers the output file holding all of the data and a metalink file
+        listing the file of each time chunk. If the chunks were `combined`, the
+        first of `output_paths` holds all of the data (see `combine_time_chunks`);
+        otherwise the output is the metalink file too, if there are several chunks.
+        """
+        for output_path in output_paths:
+            LOGGER.info('Written output file: {}'.format(output_path))
+
+        chunk_paths = output_paths[1:] if combined else output_paths
+        metalink = MetaLink4('output_files', 'Observations files for each time chunk.',
+                             workdir=self.workdir)
+
+        for output_path in chunk_paths or output_paths:
+            meta_file = MetaFile(os.path.basename(output_path), 'Observations file.', fmt=data_format)
+            meta_file.file = output_path
+            metalink.append(meta_file)
+
+        self.response.outputs['output_files'].data = metalink.xml
+
+        if len(chunk_paths) > 1 and not combined:
+            self.response.outputs['output'].data_format = FORMATS.META4
+            self.response.outputs['output'].data = metalink.xml
+        else:
+            self.response.outputs['output'].data_format = data_format
+            self.response.outputs['output'].file = output_paths[0]
+
     def _write_stations_file(self, stations_file_path, station_list):
         "Writes stations file (that were used in the extraction)."
         with open(stations_file_path, "w") as fout:
@@ -6,7 +6,8 @@ from pywps import FORMATS
 from pywps.app.Common import Metadata
 
 from midas_extract.vocabs import DATA_TYPES, UK_COUNTIES
-from goldfinch.util import (get_station_list, validate_inputs, 
+from goldfinch.archive import archive_mtime_scope
+from goldfinch.util import (get_station_list, validate_inputs, register_job,
     WEATHER_STATIONS_FILE_NAME, get_valid_date_range)
 
 import logging
@@ -72,6 +73,11 @@ class GetWeatherStations(Process):
         )
 
     def _handler(self, request, response):
+        # Look up the modification time of the archive once for the whole job
+        with archive_mtime_scope():
+            return self._run(request, response)
+
+    def _run(self, request, response):
         # Now set status to started
         response.update_status('Job is now running', 0)
 
@@ -81,7 +87,7 @@ class GetWeatherStations(Process):
         # Add output file
         stations_file = os.path.join(self.workdir, WEATHER_STATIONS_FILE_NAME)
 
-        get_station_list(
+        station_list = get_station_list(
             counties=inputs['counties'],
             bbox=inputs['bbox'],
             start=inputs['start'],
@@ -94,4 +100,8 @@ class GetWeatherStations(Process):
         LOGGER.info(f'Written output file: {stations_file}')
 
         response.outputs['output'].file = stations_file
+
+        # Record the job so that its stations can be used as input_job_id
+        register_job(self.uuid, self.identifier, self.workdir, stations_file, station_list)
+
         return response
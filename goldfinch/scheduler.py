@@ -0,0 +1,327 @@
+"""
+scheduler.py
+============
+
+Holds class JobScheduler, which routes the extraction of each job into a size
+class by its estimated size (see `goldfinch.constraints`) and runs at most the
+concurrency budget of each class at once, so that small extractions are not
+held up behind large ones in the single pywps queue.
+
+The scheduler also controls the admission of jobs across all classes: a job
+is deferred (not rejected) while starting it would take the estimated bytes of
+the running jobs over a budget, or leave less than a minimum of free space on
+the scratch disk once the running jobs have written their estimated output.
+A deferred job does not hold up the later jobs of its class that can be
+admitted, so that small jobs still start while large ones wait for room.
+
+Jobs wait in the pywps process of their request, so each waiting job holds one
+of the `parallelprocesses` of pywps: it should be well above the total number
+of slots, or the requests of small jobs queue in pywps behind waiting ones.
+
+These are set in the `[server]` section of the configuration:
+
+ * `sizeclasses`: a comma-separated list of `name:maximum size:slots`, in
+   increasing order of size (the maximum size of the last class is `*`), e.g.
+   `small:20mb:8, medium:200mb:3, large:*:1`. If it is not set, all the jobs
+   are in a single class with no limit on the number running.
+ * `maxbytesinflight`: the budget of estimated bytes of the running jobs.
+ * `minfreedisk`: the minimum free space on the pywps working directory.
+
+The state is kept in a SQLite database (in WAL mode, so it is shared by the
+worker processes): a row per waiting or running job, and the wait of each job
+that has started, from which the queue depth and wait time of each class are
+reported.
+"""
+
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+SCHEDULER_FILE_NAME = 'goldfinch-scheduler.sqlite'
+
+# Seconds between checks for a free slot while a job is waiting
+POLL_INTERVAL = 0.5
+
+# Seconds of job waits kept, and over which wait times are reported
+WAIT_HISTORY = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    job_id TEXT PRIMARY KEY,
+    size_class TEXT NOT NULL,
+    size REAL NOT NULL,
+    state TEXT NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    enqueued REAL NOT NULL,
+    started REAL
+);
+CREATE TABLE IF NOT EXISTS waits (
+    size_class TEXT NOT NULL,
+    wait REAL NOT NULL,
+    started REAL NOT NULL
+);
+"""
+
+
+class SizeClass:
+    "A size class: jobs of up to `max_size` bytes (None for no limit), `slots` at once (None for no limit)."
+
+    def __init__(self, name, max_size, slots):
+        self.name = name
+        self.max_size = max_size
+        self.slots = slots
+
+    def __repr__(self):
+        return 'SizeClass({!r}, {!r}, {!r})'.format(self.name, self.max_size, self.slots)
+
+
+def parse_size_classes(value):
+    """
+    Returns the list of SizeClass instances described by `value` (the format of
+    `sizeclasses` in the configuration). Raises ValueError if it is not valid.
+    """
+    size_classes = []
+
+    for item in value.split(','):
+        try:
+            (name, max_size, slots) = [part.strip() for part in item.split(':')]
+            max_size = None if max_size == '*' else int(configuration.get_size_mb(max_size) * 1024 ** 2)
+            slots = int(slots)
+        except ValueError:
+            raise ValueError('Invalid size class "{}": expected name:maximum size:slots'.format(item.strip()))
+
+        if slots < 1:
+            raise ValueError('Size class "{}" must have at least one slot'.format(name))
+
+        size_classes.append(SizeClass(name, max_size, slots))
+
+    if not size_classes or size_classes[-1].max_size is not None:
+        raise ValueError('The last size class must have no maximum size ("*")')
+
+    return size_classes
+
+
+def _get_size_option(option):
+    "Returns the size (in bytes) set by `option` in the `[server]` section, or None if it is not set."
+    value = configuration.get_config_value('server', option)
+    return int(configuration.get_size_mb(value) * 1024 ** 2) if value else None
+
+
+def get_scheduler():
+    """
+    Returns the JobScheduler for the size classes and admission limits set by
+    `sizeclasses`, `maxbytesinflight` and `minfreedisk` in the `[server]` section
+    of the configuration, or None if none of them is set. Its database is the
+    file set by `schedulerdb`, or else is in the pywps working directory.
+    """
+    value = configuration.get_config_value('server', 'sizeclasses')
+    max_bytes_in_flight = _get_size_option('maxbytesinflight')
+    min_free_disk = _get_size_option('minfreedisk')
+
+    if not (value or max_bytes_in_flight or min_free_disk):
+        return None
+
+    workdir = configuration.get_config_value('server', 'workdir') or tempfile.gettempdir()
+    path = configuration.get_config_value('server', 'schedulerdb') or os.path.join(workdir, SCHEDULER_FILE_NAME)
+    size_classes = parse_size_classes(value) if value else [SizeClass('all', None, None)]
+
+    return JobScheduler(path, size_classes, max_bytes_in_flight=max_bytes_in_flight,
+                        min_free_disk=min_free_disk, scratch_dir=workdir)
+
+
+def _is_running(pid):
+    "Returns True if a process with ID `pid` is running on this host."
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class JobScheduler:
+    """
+    Scheduler of the extractions of jobs in size classes with separate concurrency
+    budgets, within a budget of `max_bytes_in_flight` estimated bytes of running
+    jobs and keeping `min_free_disk` bytes free in `scratch_dir` (no limits if None).
+    """
+
+    def __init__(self, path, size_classes, max_bytes_in_flight=None, min_free_disk=None, scratch_dir=None,
+                 poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.size_classes = size_classes
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.min_free_disk = min_free_disk
+        self.scratch_dir = scratch_dir or tempfile.gettempdir()
+        self.poll_interval = poll_interval
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def classify(self, size):
+        "Returns the SizeClass of a job of `size` bytes."
+        return next(size_class for size_class in self.size_classes
+                    if size_class.max_size is None or size <= size_class.max_size)
+
+    @contextmanager
+    def slot(self, job_id, size, on_wait=None):
+        """
+        Context manager that waits for a slot in the size class of a job of `size`
+        bytes, and for the job to be admitted within the limits on bytes in flight
+        and free disk space, holding the slot until the end of the block. Jobs in
+        each class start in the order they arrived, except that a job waiting to
+        be admitted is passed by later jobs that can be. While the job waits,
+        `on_wait(size_class, ahead)` is called each time the number of jobs `ahead`
+        of it changes (0 if it is only waiting to be admitted).
+        """
+        size_class = self.classify(size)
+        self._enqueue(job_id, size_class, size)
+
+        try:
+            self._wait(job_id, size_class, on_wait)
+            yield size_class
+        finally:
+            self._conn.execute('DELETE FROM slots WHERE job_id = ?', (str(job_id),))
+
+    def _enqueue(self, job_id, size_class, size):
+        self._conn.execute('INSERT OR REPLACE INTO slots VALUES (?, ?, ?, ?, ?, ?, ?, NULL)',
+                           (str(job_id), size_class.name, size, 'waiting', socket.gethostname(),
+                            os.getpid(), time.time()))
+
+    def _wait(self, job_id, size_class, on_wait):
+        """
+        Waits until the class of `job_id` has a free slot, `job_id` is admitted and
+        no job that arrived before it in the class is ready to start.
+        """
+        last_ahead = None
+
+        while True:
+            self._conn.execute('BEGIN IMMEDIATE')
+
+            try:
+                self._remove_dead_jobs()
+
+                (running,) = self._conn.execute(
+                    'SELECT COUNT(*) FROM slots WHERE size_class = ? AND state = ?',
+                    (size_class.name, 'running')).fetchone()
+                # Jobs ahead that are only waiting to be admitted do not hold up the
+                # jobs behind them that can be
+                ahead = sum(1 for (other_id,) in self._conn.execute(
+                    'SELECT job_id FROM slots WHERE size_class = ? AND state = ? AND enqueued < '
+                    '(SELECT enqueued FROM slots WHERE job_id = ?)',
+                    (size_class.name, 'waiting', str(job_id))).fetchall() if self._admit(other_id))
+
+                if ahead == 0 and (size_class.slots is None or running < size_class.slots) \
+                        and self._admit(job_id):
+                    now = time.time()
+                    (enqueued,) = self._conn.execute('SELECT enqueued FROM slots WHERE job_id = ?',
+                                                     (str(job_id),)).fetchone()
+
+                    self._conn.execute('UPDATE slots SET state = ?, started = ? WHERE job_id = ?',
+                                       ('running', now, str(job_id)))
+                    self._conn.execute('INSERT INTO waits VALUES (?, ?, ?)', (size_class.name, now - enqueued, now))
+                    self._conn.execute('DELETE FROM waits WHERE started < ?', (now - WAIT_HISTORY,))
+                    self._conn.execute('COMMIT')
+
+                    LOGGER.info('Job {} started in size class {} after waiting {:.1f} s'.format(
+                        job_id, size_class.name, now - enqueued))
+                    return
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+            self._conn.execute('COMMIT')
+
+            # Count the running jobs as ahead when the class is full
+            if size_class.slots is not None and running >= size_class.slots:
+                ahead += running - size_class.slots + 1
+
+            if on_wait and ahead != last_ahead:
+                on_wait(size_class, ahead)
+                last_ahead = ahead
+
+            time.sleep(self.poll_interval)
+
+    def _admit(self, job_id):
+        """
+        Returns True if starting `job_id` keeps the estimated bytes of the running
+        jobs within the budget and leaves the minimum free disk space once they
+        have all written their output. A job is always admitted when no other job
+        is running, as waiting would not free anything.
+        """
+        (n_running, in_flight) = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM slots WHERE state = ?', ('running',)).fetchone()
+        (size,) = self._conn.execute('SELECT size FROM slots WHERE job_id = ?', (str(job_id),)).fetchone()
+
+        if n_running == 0:
+            return True
+
+        if self.max_bytes_in_flight is not None and in_flight + size > self.max_bytes_in_flight:
+            return False
+
+        if self.min_free_disk is not None:
+            free = shutil.disk_usage(self.scratch_dir).free
+
+            if free - in_flight - size < self.min_free_disk:
+                return False
+
+        return True
+
+    def _remove_dead_jobs(self):
+        "Removes the jobs of processes on this host that ended without leaving their queue."
+        rows = self._conn.execute('SELECT job_id, pid FROM slots WHERE host = ?', (socket.gethostname(),))
+
+        for (job_id, pid) in rows.fetchall():
+            if not _is_running(pid):
+                LOGGER.warning('Removing job {} of ended process {} from the scheduler'.format(job_id, pid))
+                self._conn.execute('DELETE FROM slots WHERE job_id = ?', (job_id,))
+
+    def stats(self):
+        """
+        Returns a list of dictionaries, one per size class, of its name, maximum
+        size, slots, the number of jobs running and waiting (queue depth) and
+        their estimated bytes, the longest current wait, and the number, mean
+        and maximum of the waits of the jobs started in the last `WAIT_HISTORY`
+        seconds (in seconds).
+        """
+        now = time.time()
+        stats = []
+
+        for size_class in self.size_classes:
+            (running, running_bytes) = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM slots WHERE size_class = ? AND state = ?',
+                (size_class.name, 'running')).fetchone()
+            (waiting, waiting_bytes, oldest) = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(enqueued) FROM slots WHERE size_class = ? AND state = ?',
+                (size_class.name, 'waiting')).fetchone()
+            (started, mean_wait, max_wait) = self._conn.execute(
+                'SELECT COUNT(*), AVG(wait), MAX(wait) FROM waits WHERE size_class = ? AND started >= ?',
+                (size_class.name, now - WAIT_HISTORY)).fetchone()
+
+            stats.append({'size_class': size_class.name, 'max_size': size_class.max_size,
+                          'slots': size_class.slots, 'running': running, 'waiting': waiting,
+                          'running_bytes': running_bytes, 'waiting_bytes': waiting_bytes,
+                          'current_wait': now - oldest if oldest else 0.0, 'started': started,
+                          'mean_wait': mean_wait or 0.0, 'max_wait': max_wait or 0.0})
+
+        return stats
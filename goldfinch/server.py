@@ -0,0 +1,93 @@
+"""
+server.py
+=========
+
+Runs the goldfinch WSGI application in a pre-forking gunicorn server, for
+production use (`goldfinch start --workers N`).
+
+The application is created, and its heavy state (the station index, the
+vocabularies and the archive indexes) is loaded, once in the parent process
+before the workers are forked, so the workers share it copy-on-write rather
+than each building their own. The WPS outputs are served by the workers too
+(see `goldfinch.output_server`).
+
+gunicorn is an optional dependency (`pip install goldfinch[server]`).
+"""
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def _import_gunicorn():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError('The multi-worker server is not available: the gunicorn package is not installed '
+                           '(pip install goldfinch[server]).')
+
+    return BaseApplication
+
+
+def preload_state():
+    """
+    Loads the state that every worker would otherwise build on its first
+    request: the station index and the availability indexes and size catalogues
+    of the tables in the archive. The vocabularies are loaded with the processes.
+    """
+    from goldfinch.archive import TABLE_LAYOUTS
+    from goldfinch.availability import get_availability_index
+    from goldfinch.size_catalogue import get_size_catalogue
+    from goldfinch.station_index import get_station_index
+
+    get_station_index()
+
+    for table in sorted(TABLE_LAYOUTS):
+        get_availability_index(table)
+        get_size_catalogue(table)
+
+
+def serve_outputs(application):
+    "Returns `application` wrapped to serve the files in the pywps `outputpath` under /outputs."
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+    from goldfinch.output_server import get_output_server
+
+    return DispatcherMiddleware(application, {'/outputs': get_output_server()})
+
+
+def run_gunicorn(application, bind, workers, worker_class='sync', threads=1, timeout=300, graceful_timeout=30,
+                 max_requests=1000, max_requests_jitter=50, pidfile=None, daemon=False):
+    """
+    Serves `application` on `bind` ("host:port") with `workers` gunicorn worker
+    processes of `worker_class`. Each worker is restarted after `max_requests`
+    requests (plus up to `max_requests_jitter`, so they do not all restart at
+    once; 0 for never), or if it is silent for more than `timeout` seconds.
+    """
+    BaseApplication = _import_gunicorn()
+
+    class GoldfinchApplication(BaseApplication):
+        "gunicorn application preloading goldfinch in the parent process."
+
+        def load_config(self):
+            options = {
+                'bind': bind,
+                'workers': workers,
+                'worker_class': worker_class,
+                'threads': threads,
+                'timeout': timeout,
+                'graceful_timeout': graceful_timeout,
+                'max_requests': max_requests,
+                'max_requests_jitter': max_requests_jitter,
+                'preload_app': True,
+                'pidfile': pidfile,
+                'daemon': daemon,
+            }
+
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            preload_state()
+            return serve_outputs(application)
+
+    LOGGER.info('Starting {} {} worker(s) on {}'.format(workers, worker_class, bind))
+    GoldfinchApplication().run()
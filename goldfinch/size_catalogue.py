@@ -0,0 +1,107 @@
+"""
+size_catalogue.py
+=================
+
+Holds class SizeCatalogue, the number of bytes of observations of each station
+in each year of a MIDAS table, so that the size of a request can be estimated
+from the stations and years actually selected rather than from a model of an
+average station.
+
+The catalogues are built by `goldfinch index build` and saved, one file per
+table, in the directory set by `indexdir` in the `[server]` section of the
+configuration.
+"""
+
+import os
+
+import numpy as np
+
+from goldfinch.archive import get_index_dir, parse_src_ids, to_days
+from goldfinch.year_index import YearStationIndex, load_year_index
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+SIZE_CATALOGUE_FILE_NAME = '{}.sizes.npz'
+
+
+def get_size_catalogue_path(table, index_dir=None):
+    "Returns the path of the size catalogue file for `table`."
+    return os.path.join(index_dir or get_index_dir(), SIZE_CATALOGUE_FILE_NAME.format(table))
+
+
+class SizeCatalogue(YearStationIndex):
+    """
+    Catalogue of the number of bytes of the rows of each (year, src_id) pair
+    with observations in `table`, held in the `sizes` array (see
+    `goldfinch.year_index.YearStationIndex`).
+    """
+
+    DESCRIPTION = 'size catalogue'
+    VALUE_FIELDS = {'sizes': np.int64}
+
+    def __init__(self, table, years, src_ids, sizes, archive_mtime=0):
+        super().__init__(table, years, src_ids, archive_mtime=archive_mtime, sizes=sizes)
+
+    @classmethod
+    def from_year_sizes(cls, table, year_sizes, archive_mtime=0):
+        "Returns the catalogue for a dictionary of year: {src_id: number of bytes}."
+        years, src_ids, sizes = [], [], []
+
+        for year, station_sizes in sorted(year_sizes.items()):
+            LOGGER.info('Found {} bytes from {} stations in {} for {}'.format(
+                sum(station_sizes.values()), len(station_sizes), table, year))
+
+            years.extend([year] * len(station_sizes))
+            src_ids.extend(int(src_id) for src_id in station_sizes)
+            sizes.extend(station_sizes.values())
+
+        return cls(table, years, src_ids, sizes, archive_mtime=archive_mtime)
+
+    def year_sizes(self, src_ids=None):
+        """
+        Returns (years, sizes) arrays of the total number of bytes of `src_ids` in
+        each year with data. If `src_ids` is empty (all stations), the totals are
+        for all the stations. IDs that are not integers are ignored.
+        """
+        sizes = self.sizes
+
+        if src_ids:
+            sizes = np.where(np.isin(self.src_ids, parse_src_ids(src_ids)), sizes, 0)
+
+        (years, first) = np.unique(self.years, return_index=True)
+        return years, np.add.reduceat(sizes, first) if len(first) else sizes[:0]
+
+    def estimate(self, src_ids, starts, ends):
+        """
+        Returns an array of the estimated number of bytes of the rows of `src_ids`
+        (all stations if empty) between each pair of `starts` and `ends` times
+        (strings starting YYYYMMDD or YYYY-MM-DD). The size of each year is spread
+        evenly over its days, so partial years count in proportion to the days
+        requested.
+        """
+        (years, sizes) = self.year_sizes(src_ids)
+        year_starts = np.array(['%04d-01-01' % year for year in years], dtype='datetime64[D]')
+        year_ends = np.array(['%04d-01-01' % (year + 1) for year in years], dtype='datetime64[D]')
+
+        # Days of each year (columns) inside each window (rows)
+        window_starts = to_days(starts)[:, None]
+        window_ends = to_days(ends)[:, None] + 1
+        overlap = (np.minimum(window_ends, year_ends) - np.maximum(window_starts, year_starts)).astype(np.int64)
+
+        fractions = np.clip(overlap, 0, None) / (year_ends - year_starts).astype(np.int64)
+        return fractions @ sizes.astype(float)
+
+
+def get_size_catalogue(table):
+    """
+    Returns the SizeCatalogue of `table`, loaded once per process from the index
+    directory (and again whenever the file changes). Returns None if no index
+    directory is configured, there is no catalogue for the table, or the archive
+    has changed since the catalogue was built.
+    """
+    if not get_index_dir():
+        return None
+
+    return load_year_index(SizeCatalogue, table, get_size_catalogue_path(table))
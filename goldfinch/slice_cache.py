@@ -0,0 +1,483 @@
+"""
+slice_cache.py
+==============
+
+Holds class SliceCache, a cache of the observation rows already extracted for
+each (table, year, station), so that overlapping requests only read the archive
+for the rows they have not seen before.
+
+Each slice holds the rows of a station in the part of a year requested so far,
+with the position of each row in the data files, so that the rows of several
+stations are written in the same order as they are in the archive (as the
+rows extracted without the cache are). Missing rows are read from the data
+files of the year for the requested time window only (and only from the byte
+ranges of the requested stations if the files are indexed, see
+`goldfinch.offset_index`).
+
+The slices are held zlib-compressed in a SQLite database (in WAL mode, so it
+can be shared by the worker processes of several jobs).
+"""
+
+import os
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+from pywps import configuration
+
+from goldfinch.archive import find_year_files, get_archive_mtime, get_layout
+from goldfinch.engines import find_matching_lines
+from goldfinch.offset_index import READ_BLOCK_SIZE, get_offset_index, get_table_header
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+SLICE_CACHE_FILE_NAME = 'slices.sqlite'
+
+# Version of the database layout: the slices of other versions are dropped
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slices (
+    obs_table TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    src_id TEXT NOT NULL,
+    window_start TEXT NOT NULL,
+    window_end TEXT NOT NULL,
+    rows BLOB NOT NULL,
+    positions BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (obs_table, year, src_id)
+);
+CREATE INDEX IF NOT EXISTS slices_last_used ON slices (last_used);
+CREATE TABLE IF NOT EXISTS tables (
+    obs_table TEXT PRIMARY KEY,
+    header BLOB,
+    archive_mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0);
+"""
+
+# The position of a row is its offset in its data file plus the index of the
+# file among the files of the year times this (more than the size of any file)
+FILE_POSITION_STRIDE = 2 ** 40
+
+# zlib level of the slices: fast, as a cold request compresses all it reads
+COMPRESSION_LEVEL = 1
+
+
+def get_slice_cache():
+    """
+    Returns a SliceCache in the directory set by `slicecachedir` in the `[server]`
+    section of the configuration, limited to `slicecachesize` (e.g. "5gb").
+    Returns None if no cache directory is set.
+    """
+    cache_dir = configuration.get_config_value('server', 'slicecachedir')
+
+    if not cache_dir:
+        return None
+
+    max_size = configuration.get_config_value('server', 'slicecachesize') or '5gb'
+    max_stations = configuration.get_config_value('server', 'slicecachemaxstations') or 100
+
+    return SliceCache(cache_dir, int(configuration.get_size_mb(max_size) * 1024 ** 2),
+                      max_stations=int(max_stations))
+
+
+class _Slice:
+    """
+    The rows of a station between the `start` and `end` times (YYYYMMDDHHMM) of
+    a year, in archive order, with the position and time (integer YYYYMMDDHHMM)
+    of each row as arrays.
+    """
+
+    def __init__(self, start, end, rows=(), positions=(), times=()):
+        self.start = start
+        self.end = end
+        self.rows = list(rows)
+        self.positions = np.asarray(positions, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.int64)
+
+    @classmethod
+    def decode(cls, start, end, rows, positions):
+        "Returns the slice stored as the compressed `rows` and `positions` blobs."
+        data = zlib.decompress(rows)
+        (positions, times, lengths) = np.frombuffer(zlib.decompress(positions), dtype=np.int64).reshape(3, -1)
+        ends = np.cumsum(lengths)
+
+        return cls(start, end, [data[row_start:row_end] for (row_start, row_end)
+                                in zip((ends - lengths).tolist(), ends.tolist())], positions, times)
+
+    def encode(self):
+        "Returns the compressed (rows, positions) blobs of the slice."
+        lengths = [len(row) for row in self.rows]
+        index = np.array([self.positions, self.times, lengths], dtype=np.int64).reshape(3, -1)
+
+        return (zlib.compress(b''.join(self.rows), COMPRESSION_LEVEL),
+                zlib.compress(index.tobytes(), COMPRESSION_LEVEL))
+
+    def covers(self, start, end):
+        return self.start <= start and end <= self.end
+
+    def merge(self, other):
+        "Returns a slice of the rows of both slices (which may overlap), covering both."
+        positions = np.concatenate((self.positions, other.positions))
+        (positions, first) = np.unique(positions, return_index=True)
+        rows = self.rows + other.rows
+
+        return _Slice(min(self.start, other.start), max(self.end, other.end), [rows[i] for i in first.tolist()],
+                      positions, np.concatenate((self.times, other.times))[first])
+
+
+def _read_range(reader, range_start, range_end):
+    "Yields (offset, data) for blocks of whole lines in a byte range of a data file."
+    reader.seek(range_start)
+    remaining = range_end - range_start
+    offset = range_start
+    partial = b''
+
+    while remaining > 0:
+        block = reader.read(min(READ_BLOCK_SIZE, remaining))
+
+        if not block:
+            break
+
+        remaining -= len(block)
+        data = partial + block
+        cut = data.rfind(b'\n') + 1 if remaining > 0 else len(data)
+
+        if cut:
+            yield offset, data[:cut]
+
+        offset += cut
+        partial = data[cut:]
+
+    if partial:
+        yield offset, partial
+
+
+def _read_ranges(reader, ranges):
+    """
+    Yields (data, starts, offsets) for blocks of whole lines read from the byte
+    `ranges` of a data file, joining small ranges (e.g. of a few stations on each
+    day) so that they are parsed at once: `data` is made of pieces beginning at
+    `starts` in `data`, read from `offsets` in the file (arrays).
+    """
+    (pieces, starts, offsets, size) = ([], [], [], 0)
+
+    for (range_start, range_end) in ranges:
+        for (offset, piece) in _read_range(reader, range_start, range_end):
+            pieces.append(piece)
+            starts.append(size)
+            offsets.append(offset)
+            size += len(piece)
+
+            # A last line with no line ending is not joined to the next one
+            if size >= READ_BLOCK_SIZE or not piece.endswith(b'\n'):
+                yield b''.join(pieces), np.array(starts, dtype=np.int64), np.array(offsets, dtype=np.int64)
+                (pieces, starts, offsets, size) = ([], [], [], 0)
+
+    if pieces:
+        yield b''.join(pieces), np.array(starts, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+class SliceCache:
+    """
+    Cache of the rows of each (table, year, station) slice of the archive.
+
+    Slices are evicted least recently used first once their total compressed
+    size exceeds `max_size` bytes. All slices of a table are dropped when the
+    modification time of the table in the archive changes. Requests for more
+    than `max_stations` stations are not served from the cache.
+
+    `hits` and `misses` count the slices found and not found by this instance;
+    `stats()` returns the totals over all instances sharing the database.
+    """
+
+    def __init__(self, cache_dir, max_size, max_stations=100):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_stations = max_stations
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(os.path.join(cache_dir, SLICE_CACHE_FILE_NAME), timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+
+        (version,) = self._conn.execute('PRAGMA user_version').fetchone()
+
+        if version != SCHEMA_VERSION:
+            self._conn.executescript('DROP TABLE IF EXISTS slices; DROP TABLE IF EXISTS tables; '
+                                     'PRAGMA user_version = %d;' % SCHEMA_VERSION)
+
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def can_extract(self, src_ids, delimiter="comma", columns="all", conditions=None, region=None):
+        "Returns True if a request with these arguments can be served by `extract()`."
+        return (bool(src_ids) and len(src_ids) <= self.max_stations and delimiter == "comma"
+                and columns == "all" and not conditions and not region)
+
+    def extract(self, table, output_path, start, end, src_ids, scan):
+        """
+        Writes the rows of `table` for `src_ids` between the `start` and `end`
+        times (YYYYMMDDHHMM) to `output_path` as comma-delimited text with a header
+        line. Rows are in the order they are in the data files.
+
+        The rows missing from the cache are read from the data files of each year,
+        for the part of the requested window (or of the gap between it and the
+        rows already cached) not covered by the slices of each station.
+
+        Until the header line written for the table by the MIDAS subsetter is
+        known (see `goldfinch.offset_index.capture_table_header`), the request is
+        extracted by calling `scan(path, start, end, src_ids)` (as
+        `filter_observations()`), without the cache, and the header is kept.
+
+        Returns False, without writing anything, if the data files of the table
+        cannot be read (their layout is not known).
+        """
+        src_ids = [str(src_id).strip() for src_id in src_ids]
+        self._check_archive(table)
+
+        header = self._get_header(table) or get_table_header(table)
+
+        if header is None:
+            scan(output_path, start, end, src_ids)
+            self._set_header(table, output_path)
+            return True
+
+        year_slices = []
+        hits = misses = 0
+
+        try:
+            for year in range(int(start[:4]), int(end[:4]) + 1):
+                window = (max(start, '%d01010000' % year), min(end, '%d12312359' % year))
+                (slices, missing) = self._get_year_slices(table, year, window, src_ids)
+
+                hits += len(src_ids) - len(missing)
+                misses += len(missing)
+
+                if missing:
+                    slices.update(self._read_slices(table, year, window, missing, slices))
+
+                year_slices.append(slices)
+        except KeyError:
+            LOGGER.warning('Unknown layout of the data files of {}: not using the slice cache'.format(table))
+            return False
+
+        self.hits += hits
+        self.misses += misses
+        self._conn.execute("UPDATE counters SET value = value + ? WHERE name = 'hits'", (hits,))
+        self._conn.execute("UPDATE counters SET value = value + ? WHERE name = 'misses'", (misses,))
+        self._conn.commit()
+        self.evict()
+
+        with open(output_path, 'wb') as writer:
+            writer.write(header)
+
+            for slices in year_slices:
+                self._write_rows(writer, [slices[src_id] for src_id in src_ids if src_id in slices],
+                                 int(start), int(end))
+
+        LOGGER.info('Slice cache: {} hits, {} misses for {}'.format(hits, misses, output_path))
+        return True
+
+    def stats(self):
+        "Returns a dictionary of the total hits, misses, slices and size of the cache."
+        counters = dict(self._conn.execute('SELECT name, value FROM counters'))
+        (slices, size) = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM slices').fetchone()
+
+        return {'hits': counters['hits'], 'misses': counters['misses'], 'slices': slices, 'size': size}
+
+    def evict(self):
+        "Removes the least recently used slices until the cache fits in `max_size`."
+        (total,) = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM slices').fetchone()
+
+        if total <= self.max_size:
+            return
+
+        to_delete = []
+
+        for (rowid, size) in self._conn.execute('SELECT rowid, size FROM slices ORDER BY last_used'):
+            if total <= self.max_size:
+                break
+
+            to_delete.append((rowid,))
+            total -= size
+
+        self._conn.executemany('DELETE FROM slices WHERE rowid = ?', to_delete)
+        self._conn.commit()
+
+    def _check_archive(self, table):
+        "Drops all slices of `table` if the archive has changed since they were stored."
+        archive_mtime = get_archive_mtime(table)
+        row = self._conn.execute('SELECT archive_mtime FROM tables WHERE obs_table = ?', (table,)).fetchone()
+
+        if row is not None and row[0] == archive_mtime:
+            return
+
+        # The header line of the table is kept
+        self._conn.execute('DELETE FROM slices WHERE obs_table = ?', (table,))
+        self._conn.execute('UPDATE tables SET archive_mtime = ? WHERE obs_table = ?', (archive_mtime, table))
+        self._conn.execute('INSERT OR IGNORE INTO tables VALUES (?, NULL, ?)', (table, archive_mtime))
+        self._conn.commit()
+
+    def _get_header(self, table):
+        row = self._conn.execute('SELECT header FROM tables WHERE obs_table = ?', (table,)).fetchone()
+        return row[0] if row else None
+
+    def _set_header(self, table, output_path):
+        "Keeps the header line of the output file at `output_path` as the header of `table`."
+        if not os.path.exists(output_path):
+            return
+
+        with open(output_path, 'rb') as reader:
+            header = reader.readline()
+
+        if header:
+            self._conn.execute('UPDATE tables SET header = ? WHERE obs_table = ?', (header, table))
+            self._conn.commit()
+
+    def _get_year_slices(self, table, year, window, src_ids):
+        """
+        Returns a dictionary of src_id: _Slice of the cached slices of `year`, and
+        the list of `src_ids` whose slice is missing or does not cover the
+        (start, end) `window`.
+        """
+        slices = {}
+
+        # Stay well below the SQLite limit on the number of parameters
+        for i in range(0, len(src_ids), 500):
+            batch = src_ids[i:i + 500]
+            query = ('SELECT src_id, window_start, window_end, rows, positions FROM slices'
+                     ' WHERE obs_table = ? AND year = ? AND src_id IN (%s)' % ','.join('?' * len(batch)))
+
+            for (src_id, slice_start, slice_end, rows, positions) in self._conn.execute(query, [table, year] + batch):
+                slices[src_id] = _Slice.decode(slice_start, slice_end, rows, positions)
+
+        self._conn.executemany('UPDATE slices SET last_used = ? WHERE obs_table = ? AND year = ? AND src_id = ?',
+                               [(time.time(), table, year, src_id) for src_id in slices])
+
+        missing = [src_id for src_id in src_ids if src_id not in slices or not slices[src_id].covers(*window)]
+        return slices, missing
+
+    def _read_slices(self, table, year, window, src_ids, slices):
+        """
+        Reads the rows of `src_ids` missing from their `slices` (the cached slices
+        of `year`, by src_id) to cover `window`, from the data files, stores the
+        extended slices and returns a dictionary of src_id: _Slice.
+        """
+        groups = {}
+
+        # Stations whose slices cover the same window are read together
+        for src_id in src_ids:
+            cached = slices.get(src_id)
+            coverage = (cached.start, cached.end) if cached else None
+            groups.setdefault(coverage, []).append(src_id)
+
+        new_slices = {}
+
+        for (coverage, group) in groups.items():
+            if coverage is None:
+                windows = [window]
+            else:
+                # The parts of the window before and after the cached rows, with
+                # any gap between them (rows on the boundaries are read twice)
+                windows = [(window[0], coverage[0])] if window[0] < coverage[0] else []
+                windows += [(coverage[1], window[1])] if window[1] > coverage[1] else []
+
+            for (src_id, read) in self._read_rows(table, year, windows, group).items():
+                new_slices[src_id] = slices[src_id].merge(read) if src_id in slices else read
+
+        now = time.time()
+        records = []
+
+        for (src_id, year_slice) in new_slices.items():
+            (rows, positions) = year_slice.encode()
+            records.append((table, year, src_id, year_slice.start, year_slice.end, rows, positions,
+                            len(rows) + len(positions), now))
+
+        # Committed with the counters, once all years are read
+        self._conn.executemany('INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+        return new_slices
+
+    def _read_rows(self, table, year, windows, src_ids):
+        """
+        Returns a dictionary of src_id: _Slice of the rows of `src_ids` in each of
+        the (start, end) `windows` of `year`, read from the data files (only the
+        byte ranges of those stations and windows, if the files are indexed). IDs
+        that are not numbers have no rows.
+        """
+        numbers = {}
+
+        for src_id in src_ids:
+            try:
+                numbers[int(src_id)] = src_id
+            except ValueError:
+                pass
+
+        found = {src_id: ([], [], []) for src_id in src_ids}
+        wanted = np.array(sorted(numbers), dtype=np.int64)
+
+        for (file_number, path) in enumerate(find_year_files(table).get(year, []) if numbers else []):
+            (time_index, src_id_index, header_lines) = get_layout(table, path)
+            index = get_offset_index(table, path)
+
+            with open(path, 'rb') as reader:
+                for _ in range(header_lines):
+                    reader.readline()
+
+                whole_file = [(reader.tell(), os.fstat(reader.fileno()).st_size)]
+
+                for (start, end) in windows:
+                    ranges = index.window_ranges(wanted, year, start, end) if index else whole_file
+
+                    for (data, starts, offsets) in _read_ranges(reader, ranges):
+                        (row_starts, row_ends, times, row_numbers) = find_matching_lines(
+                            np.frombuffer(data, dtype=np.uint8), time_index, src_id_index, int(start), int(end),
+                            wanted, fields=True)
+
+                        pieces = np.searchsorted(starts, row_starts, side='right') - 1
+                        row_positions = (file_number * FILE_POSITION_STRIDE + offsets[pieces]
+                                         + row_starts - starts[pieces])
+
+                        for number in np.unique(row_numbers).tolist():
+                            mask = row_numbers == number
+                            (rows, positions, row_times) = found[numbers[number]]
+
+                            rows.extend(data[row_start:row_end] for (row_start, row_end)
+                                        in zip(row_starts[mask].tolist(), row_ends[mask].tolist()))
+                            positions.extend(row_positions[mask].tolist())
+                            row_times.extend(times[mask].tolist())
+
+        (start, end) = (windows[0][0], windows[-1][1])
+
+        # Merging puts the rows in archive order, without the rows read twice
+        return {src_id: _Slice(start, end).merge(_Slice(start, end, *read)) for (src_id, read) in found.items()}
+
+    @staticmethod
+    def _write_rows(writer, slices, start, end):
+        "Writes the rows of `slices` (of one year) between the `start` and `end` times, in archive order."
+        if not slices:
+            return
+
+        positions = np.concatenate([year_slice.positions for year_slice in slices])
+        times = np.concatenate([year_slice.times for year_slice in slices])
+        rows = [row for year_slice in slices for row in year_slice.rows]
+
+        order = np.argsort(positions, kind='stable')
+        order = order[(times[order] >= start) & (times[order] <= end)]
+
+        writer.writelines(rows[i] for i in order.tolist())
@@ -0,0 +1,107 @@
+"""
+startup.py
+==========
+
+Measures the startup latency of goldfinch (`goldfinch bench startup`): the time
+taken to import each of its entry-point modules and to create the WSGI
+application, each in a fresh Python interpreter so that nothing is already
+imported. The import times of the modules they pull in are read from the
+output of `python -X importtime`.
+"""
+
+import subprocess
+import sys
+import time
+
+# Modules imported by the entry points: the package, the WSGI module, the
+# processes (as imported by the async job subprocesses) and the command line
+STARTUP_MODULES = ['goldfinch', 'goldfinch.wsgi', 'goldfinch.processes',
+                   'goldfinch.processes.wps_extract_uk_station_data', 'goldfinch.cli']
+
+CREATE_APP_CODE = """
+import time
+start = time.perf_counter()
+from goldfinch.wsgi import create_app
+create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def parse_importtime(output):
+    """
+    Returns a list of (module, self, cumulative) import times (in seconds) of
+    the modules listed in `output`, the standard error of `python -X importtime`,
+    in the order they finished importing.
+    """
+    imports = []
+
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = [field.strip() for field in line[len('import time:'):].split('|')]
+
+        try:
+            (self_us, cumulative_us) = (int(fields[0]), int(fields[1]))
+        except (IndexError, ValueError):
+            # The header line
+            continue
+
+        imports.append((fields[2], self_us / 1e6, cumulative_us / 1e6))
+
+    return imports
+
+
+def _run_python(args, python=None):
+    "Runs a fresh interpreter with `args`, returning (wall time, stdout, stderr)."
+    start = time.perf_counter()
+    result = subprocess.run([python or sys.executable] + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError('Python {} failed: {}'.format(' '.join(args), result.stderr.strip()[-2000:]))
+
+    return wall, result.stdout, result.stderr
+
+
+def measure_import(module, python=None):
+    """
+    Imports `module` in a fresh interpreter and returns a dictionary of its
+    cumulative import time, the wall time of the interpreter and the list of
+    (module, self, cumulative) import times of every module imported (in
+    seconds).
+    """
+    (wall, _, stderr) = _run_python(['-X', 'importtime', '-c', 'import {}'.format(module)], python=python)
+    imports = parse_importtime(stderr)
+    cumulative = next((total for (name, _, total) in imports if name == module), 0.0)
+
+    return {'module': module, 'import_time': cumulative, 'wall_time': wall, 'imports': imports}
+
+
+def measure_create_app(python=None):
+    "Returns the time (in seconds) to import goldfinch.wsgi and create the application in a fresh interpreter."
+    (_, stdout, _) = _run_python(['-c', CREATE_APP_CODE], python=python)
+    return float(stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(imports, top=10, exclude=None):
+    "Returns the `top` (module, self, cumulative) entries of `imports` by cumulative time, without `exclude`."
+    ranked = [entry for entry in imports if entry[0] != exclude]
+    return sorted(ranked, key=lambda entry: entry[2], reverse=True)[:top]
+
+
+def measure_startup(modules=None, repeat=3, create_app=True, python=None):
+    """
+    Returns a list of the measurements (see `measure_import`) of each of
+    `modules` (default `STARTUP_MODULES`), the fastest of `repeat` runs, and the
+    fastest time to create the application (None unless `create_app`).
+    """
+    results = []
+
+    for module in modules or STARTUP_MODULES:
+        runs = [measure_import(module, python=python) for _ in range(max(repeat, 1))]
+        results.append(min(runs, key=lambda run: run['import_time']))
+
+    app_time = min(measure_create_app(python=python) for _ in range(max(repeat, 1))) if create_app else None
+    return results, app_time
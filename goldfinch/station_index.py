@@ -0,0 +1,367 @@
+"""
+station_index.py
+================
+
+Holds class StationIndex, an in-memory index of the MIDAS stations built once
+per worker process from the station (SRCE) and station capability (SRCC)
+metadata tables, so that station selections do not re-read those files.
+
+The stations are held in NumPy arrays and selected with vectorised tests. A
+grid over latitude and longitude (class SpatialGrid) narrows bounding box,
+radius and nearest-neighbour queries down to the cells they touch.
+"""
+
+import csv
+import glob
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from goldfinch.archive import get_metadata_dir
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Column order of the metadata tables, used when the files have no header line
+SOURCE_COLUMNS = ['src_id', 'src_name', 'high_prcn_lat', 'high_prcn_lon', 'loc_geog_area_id',
+                  'rec_st_ind', 'src_bgn_date', 'src_type', 'grid_ref_type', 'east_grid_ref',
+                  'north_grid_ref', 'hydr_area_id', 'post_code', 'src_end_date', 'elevation',
+                  'wmo_region_code', 'parent_src_id', 'zone_time', 'drainage_stream_id',
+                  'src_upd_date']
+SOURCE_CAPABILITY_COLUMNS = ['id', 'id_type', 'met_domain_name', 'src_cap_bgn_date',
+                             'src_cap_end_date', 'prime_capability_flag', 'rcpt_method_name',
+                             'db_segment_name', 'data_retention_period', 'src_id']
+
+# Metadata file names, in order of preference
+SOURCE_FILE_NAMES = ['SRCE.DATA.COMMAS_REMOVED', 'SRCE.DATA']
+SOURCE_CAPABILITY_FILE_NAMES = ['SRCC.DATA.COMMAS_REMOVED', 'SRCC.DATA']
+
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d-%b-%Y', '%d-%b-%y']
+
+# Date used for stations with no (or an unreadable) end date
+OPEN_END_DATE = 39991231
+
+# Size (in degrees) of the cells of the spatial grid
+GRID_CELL_SIZE = 0.25
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+def _find_metadata_file(metadata_dir, file_names):
+    "Returns the path of the first of `file_names` found below `metadata_dir`."
+    for file_name in file_names:
+        paths = sorted(glob.glob(os.path.join(metadata_dir, '**', file_name), recursive=True))
+
+        if paths:
+            return paths[0]
+
+    raise FileNotFoundError('No {} file found in: {}'.format(' or '.join(file_names), metadata_dir))
+
+
+def _read_table(path, columns):
+    """
+    Yields each row of a metadata table as a dictionary. The column names are
+    taken from the header line if there is one, otherwise from `columns`.
+    """
+    with open(path, newline='', encoding='latin-1') as reader:
+        rows = csv.reader(reader, skipinitialspace=True)
+        names = columns
+
+        for row in rows:
+            if not row:
+                continue
+
+            row = [value.strip() for value in row]
+
+            if names is columns and 'src_id' in [value.lower() for value in row]:
+                names = [value.lower() for value in row]
+                continue
+
+            yield dict(zip(names, row))
+
+
+def _to_date_int(value, default):
+    "Converts a metadata date string to an integer YYYYMMDD."
+    for date_format in DATE_FORMATS:
+        try:
+            dt = datetime.strptime(value, date_format)
+            return dt.year * 10000 + dt.month * 100 + dt.day
+        except ValueError:
+            continue
+
+    return default
+
+
+def haversine_km(lat, lon, lats, lons):
+    "Returns the great-circle distances (in km) from (lat, lon) to each of (lats, lons)."
+    lat, lon, lats, lons = [np.radians(value) for value in (lat, lon, lats, lons)]
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class SpatialGrid:
+    """
+    Regular latitude/longitude grid over a set of points. The points are sorted
+    by cell (row-major), so the points of a row of cells form one contiguous
+    run of `order` that is found by binary search.
+
+    Longitudes are not wrapped at the antimeridian.
+    """
+
+    def __init__(self, lats, lons, cell_size=GRID_CELL_SIZE):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.cell_size = cell_size
+
+        if len(self.lats):
+            self.lat0, self.lon0 = self.lats.min(), self.lons.min()
+            self.n_rows = int((self.lats.max() - self.lat0) // cell_size) + 1
+            self.n_cols = int((self.lons.max() - self.lon0) // cell_size) + 1
+        else:
+            self.lat0 = self.lon0 = 0.0
+            self.n_rows = self.n_cols = 0
+
+        cells = self._rows(self.lats) * self.n_cols + self._cols(self.lons)
+        self.order = np.argsort(cells, kind='stable')
+        self.cells = cells[self.order]
+
+    def _rows(self, lats):
+        rows = (np.asarray(lats) - self.lat0) // self.cell_size
+        return np.clip(rows, 0, max(self.n_rows - 1, 0)).astype(np.int64)
+
+    def _cols(self, lons):
+        cols = (np.asarray(lons) - self.lon0) // self.cell_size
+        return np.clip(cols, 0, max(self.n_cols - 1, 0)).astype(np.int64)
+
+    def _cell(self, value, origin, n_cells):
+        "Returns the row or column of the cell holding `value`, clipped to the grid."
+        return min(max(int((value - origin) // self.cell_size), 0), max(n_cells - 1, 0))
+
+    def _candidates(self, w, s, e, n):
+        "Returns the indices of the points in the cells overlapping the box."
+        if not len(self.order) or w > e or s > n:
+            return np.empty(0, dtype=np.int64)
+
+        (row0, row1) = (self._cell(s, self.lat0, self.n_rows), self._cell(n, self.lat0, self.n_rows))
+        (col0, col1) = (self._cell(w, self.lon0, self.n_cols), self._cell(e, self.lon0, self.n_cols))
+
+        # One binary search for the start and end of the run of each row
+        row_starts = np.arange(row0, row1 + 1) * self.n_cols
+        bounds = np.searchsorted(self.cells, np.concatenate([row_starts + col0, row_starts + col1 + 1]))
+        n_rows = len(row_starts)
+
+        if n_rows == 1:
+            return self.order[bounds[0]:bounds[1]]
+
+        return np.concatenate([self.order[i:j] for i, j in zip(bounds[:n_rows], bounds[n_rows:])])
+
+    def within_bbox(self, w, s, e, n):
+        "Returns the indices of the points inside the box (edges included)."
+        idx = self._candidates(w, s, e, n)
+        lats, lons = self.lats[idx], self.lons[idx]
+        return idx[(lats >= s) & (lats <= n) & (lons >= w) & (lons <= e)]
+
+    def within_radius(self, lat, lon, radius_km):
+        "Returns (indices, distances in km) of the points within `radius_km` of (lat, lon)."
+        d_lat = radius_km / KM_PER_DEGREE
+        d_lon = radius_km / (KM_PER_DEGREE * max(np.cos(np.radians(min(abs(lat) + d_lat, 90))), 1e-6))
+
+        idx = self._candidates(lon - d_lon, lat - d_lat, lon + d_lon, lat + d_lat)
+        distances = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        inside = distances <= radius_km
+
+        return idx[inside], distances[inside]
+
+    def nearest(self, lat, lon, k):
+        """
+        Returns (indices, distances in km) of the `k` points nearest to (lat, lon),
+        nearest first. The search radius is doubled until it holds `k` points.
+        """
+        k = min(k, len(self.order))
+
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        radius_km = self.cell_size * KM_PER_DEGREE
+
+        while True:
+            idx, distances = self.within_radius(lat, lon, radius_km)
+
+            if len(idx) >= k or radius_km > np.pi * EARTH_RADIUS_KM:
+                break
+
+            radius_km *= 2
+
+        nearest = np.argsort(distances, kind='stable')[:k]
+        return idx[nearest], distances[nearest]
+
+
+class StationIndex:
+    """
+    In-memory index of MIDAS stations.
+
+    Each station has an entry in the arrays `src_ids`, `lats`, `lons`,
+    `counties` (code into `county_names`), `start_dates` and `end_dates`
+    (integer YYYYMMDD) and `data_types` (bit mask of codes into `data_type_names`).
+    """
+
+    def __init__(self, src_ids, lats, lons, counties, start_dates, end_dates, data_types):
+        self.county_names = sorted(set(counties))
+        self.data_type_names = sorted(set(data_type for types in data_types for data_type in types))
+
+        if len(self.data_type_names) > 63:
+            raise ValueError('Too many data types to index: {}'.format(len(self.data_type_names)))
+
+        county_codes = {county: code for code, county in enumerate(self.county_names)}
+        data_type_bits = {data_type: 1 << bit for bit, data_type in enumerate(self.data_type_names)}
+
+        order = np.argsort(np.asarray(src_ids, dtype=np.int64), kind='stable')
+
+        self.src_ids = np.asarray(src_ids, dtype=np.int64)[order]
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+        self.lons = np.asarray(lons, dtype=np.float64)[order]
+        self.counties = np.asarray([county_codes[county] for county in counties], dtype=np.int32)[order]
+        self.start_dates = np.asarray(start_dates, dtype=np.int32)[order]
+        self.end_dates = np.asarray(end_dates, dtype=np.int32)[order]
+        self.data_types = np.asarray([sum(data_type_bits[data_type] for data_type in types)
+                                      for types in data_types], dtype=np.int64)[order]
+
+        self.grid = SpatialGrid(self.lats, self.lons)
+
+        # Indices of the stations in each county, as runs of `county_order`
+        self._county_order = np.argsort(self.counties, kind='stable')
+        self._county_bounds = np.searchsorted(self.counties[self._county_order],
+                                              np.arange(len(self.county_names) + 1))
+
+    def __len__(self):
+        return len(self.src_ids)
+
+    @classmethod
+    def from_metadata(cls, metadata_dir=None):
+        "Builds the index from the SRCE and SRCC tables in the MIDAS metadata directory."
+        metadata_dir = metadata_dir or get_metadata_dir()
+
+        stations = {}
+
+        for row in _read_table(_find_metadata_file(metadata_dir, SOURCE_FILE_NAMES), SOURCE_COLUMNS):
+            try:
+                src_id = int(row['src_id'])
+                lat, lon = float(row['high_prcn_lat']), float(row['high_prcn_lon'])
+            except (KeyError, ValueError):
+                continue
+
+            stations[src_id] = [lat, lon, row.get('loc_geog_area_id', '').upper(),
+                                _to_date_int(row.get('src_bgn_date', ''), 0),
+                                _to_date_int(row.get('src_end_date', ''), OPEN_END_DATE),
+                                set()]
+
+        capabilities = _read_table(_find_metadata_file(metadata_dir, SOURCE_CAPABILITY_FILE_NAMES),
+                                   SOURCE_CAPABILITY_COLUMNS)
+
+        for row in capabilities:
+            try:
+                src_id = int(row['src_id'])
+            except (KeyError, ValueError):
+                continue
+
+            if src_id in stations and row.get('id_type'):
+                stations[src_id][5].add(row['id_type'].upper())
+
+        src_ids = list(stations)
+        columns = list(zip(*stations.values())) or [[]] * 6
+
+        return cls(src_ids, *columns)
+
+    def select(self, counties=None, bbox=None, start=None, end=None, data_types=None):
+        """
+        Returns a sorted list of the IDs (as strings) of the stations operating at
+        some time between `start` and `end` (date/time strings starting YYYYMMDD)
+        that are in one of `counties` or, if no counties are given, inside `bbox`
+        (w, s, e, n). If `data_types` are given, stations must have at least one of them.
+        """
+        if counties:
+            idx = np.concatenate([self._county_members(county) for county in set(counties)] or
+                                 [np.empty(0, dtype=np.int64)])
+        elif bbox is not None:
+            idx = self.grid.within_bbox(*[float(value) for value in bbox])
+        else:
+            idx = np.arange(len(self))
+
+        return self._to_ids(self._filter(idx, start=start, end=end, data_types=data_types))
+
+    def within_radius(self, lat, lon, radius_km, start=None, end=None, data_types=None):
+        """
+        Returns a list of (ID, distance in km) of the stations within `radius_km`
+        of (lat, lon), nearest first, filtered as in `select()`.
+        """
+        idx, distances = self.grid.within_radius(lat, lon, radius_km)
+        keep = np.isin(idx, self._filter(idx, start=start, end=end, data_types=data_types))
+        idx, distances = idx[keep], distances[keep]
+        nearest = np.argsort(distances, kind='stable')
+
+        return list(zip(self._to_ids(idx[nearest], sort=False), distances[nearest].tolist()))
+
+    def nearest(self, lat, lon, k):
+        "Returns a list of (ID, distance in km) of the `k` stations nearest to (lat, lon)."
+        idx, distances = self.grid.nearest(lat, lon, k)
+        return list(zip(self._to_ids(idx, sort=False), distances.tolist()))
+
+    def _county_members(self, county):
+        county = county.upper()
+
+        if county not in self.county_names:
+            return np.empty(0, dtype=np.int64)
+
+        code = self.county_names.index(county)
+        return self._county_order[self._county_bounds[code]:self._county_bounds[code + 1]]
+
+    def _filter(self, idx, start=None, end=None, data_types=None):
+        "Returns the indices in `idx` of the stations matching the time and data type filters."
+        if start:
+            idx = idx[self.end_dates[idx] >= int(str(start)[:8])]
+
+        if end:
+            idx = idx[self.start_dates[idx] <= int(str(end)[:8])]
+
+        if data_types:
+            bits = sum(1 << self.data_type_names.index(data_type.upper())
+                       for data_type in data_types if data_type.upper() in self.data_type_names)
+            idx = idx[(self.data_types[idx] & bits) != 0]
+
+        return idx
+
+    def _to_ids(self, idx, sort=True):
+        "Returns the station IDs (as strings) at the indices `idx`, in ID order if `sort`."
+        if sort:
+            idx = np.sort(idx)
+
+        return [str(src_id) for src_id in self.src_ids[idx].tolist()]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_station_index():
+    """
+    Returns the StationIndex for the current MIDAS metadata directory, building
+    it on first use in each process. Returns None if the index cannot be built.
+    """
+    global _index
+
+    metadata_dir = get_metadata_dir()
+
+    with _index_lock:
+        if _index is None or _index[0] != metadata_dir:
+            try:
+                _index = (metadata_dir, StationIndex.from_metadata(metadata_dir))
+                LOGGER.info('Built station index of {} stations from: {}'.format(len(_index[1]), metadata_dir))
+            except (OSError, ValueError) as exc:
+                LOGGER.warning('Cannot build station index, using station getter: {}'.format(exc))
+                _index = (metadata_dir, None)
+
+        return _index[1]
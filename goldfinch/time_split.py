@@ -1,177 +1,238 @@
-"""
-time_split.py
-=============
-
-Holds class DurationSplitter used to chop up time series into chunks of
-decades, years or months.
-"""
-
-import re
-
-
-class SimpleDate:
-
-    def __init__(self, y, m, d):
-        self.y = int(y)
-        self.m = int(m)
-        self.d = int(d)
-        self.date = "%4d%02d%02d" % (self.y, self.m, self.d)
-
-    def __repr__(self):
-        return self.date
-
-    def __lt__(self, d):
-        if self.date < d.date:
-            return True
-
-        return False
-
-    def __eq__(self, d):
-        if self.date == d.date:
-            return True
-
-        return False
-
-
-class DurationSplitter:
-    """
-    Splits into sensible time chunks based on inputs.
-    """
-    known_chunk_units = [None, "decade", "year", "month"]
-
-    def __init__(self, chunk_unit=None):
-        """
-        Allows the setting of a persistent chunk_unit.
-        """
-        self._checkChunkUnit(chunk_unit)
-        self.chunk_unit = chunk_unit
-
-    def _convertDate(self, date):
-        """
-        Converts and returns date to a SimpleDate instance. If format is bad it raises an exception.
-        """
-        if isinstance(date, str):
-            if len(date) != 8 or not re.match(r"^\d{8}$", date):
-                raise Exception("Invalid date: %s" % str(date))
-
-            return SimpleDate(date[:4], date[4:6], date[6:8])
-
-        elif type(date) in (type((1, 2)), type([1, 2])):
-            if len(date) != 3:
-                raise Exception("Invalid date: %s" % str(date))
-
-            for i in date:
-                if isinstance(i, int):
-                    raise Exception("Invalid date: %s" % str(date))
-
-            return SimpleDate(date[0], date[1], date[2])
-
-        else:
-            raise Exception("Invalid date: %s" % str(date))
-
-    def _checkChunkUnit(self, chunk_unit):
-        if chunk_unit not in self.known_chunk_units:
-            raise Exception("Invalid chunk unit '%s' not in list of %s." % (chunk_unit, str(self.known_chunk_units)))
-
-    def splitDuration(self, start_date, end_date, chunk_unit=None):
-        """
-        Splits duration into  a list of n lists of [start, end] where each is represented as a SimpleDate
-        instance with attributes of t.year, t.month, t.day. The list is returned.
-
-        All time splits are done in logical places, e.g.:
-         * decade -> at start of each year ending in 0
-         * year -> 1st of jan each year to 31st dec
-         * month -> first to last day of month
-
-        All input dates times are represented as one of the following:
-         * string: "YYYYMMDD"
-         * tuple: (y, m, d)
-        """
-        start = self._convertDate(start_date)
-        end = self._convertDate(end_date)
-
-        if chunk_unit is not None:
-            self._checkChunkUnit(chunk_unit)
-        else:
-            chunk_unit = self.chunk_unit
-
-        # Assign a variable to record chunks in
-        chunks = []
-        ct_appended = False
-        ct = start
-
-        this_chunk = [ct]
-
-        while ct < end:
-            ct = self._addDay(ct)
-
-            if (self._isLastDayOfMonth(ct) and chunk_unit == "month") or \
-               (self._isLastDayOfYear(ct) and chunk_unit == "year") or \
-               (self._isLastDayOfDecade(ct) and chunk_unit == "decade"):
-
-                this_chunk.append(ct)
-                chunks.append(this_chunk[:])
-
-                next_day = self._addDay(ct)
-                this_chunk = [next_day]
-                ct_appended = True
-
-            else:
-                # Always the case for: chunk_unit=None
-                ct_appended = False
-
-        # Now add end onto last one if it does not match end exactly
-        if ct_appended is False:
-            this_chunk.append(ct)
-            chunks.append(this_chunk[:])
-
-        return chunks
-
-    def _isLastDayOfMonth(self, date):
-        "Returns True or False."
-        ndays = self._daysInMonth(date.y, date.m)
-        if date.d == ndays:
-            return True
-
-        return False
-
-    def _isLastDayOfYear(self, date):
-        "Returns True or False."
-        if date.m == 12 and date.d == 31:
-            return True
-
-        return False
-
-    def _isLastDayOfDecade(self, date):
-        """
-        Returns True or False.
-        We define decades as 200001010000 - 200912312359
-        """
-        if self._isLastDayOfYear(date) and date.y % 10 == 9:
-            return True
-
-        return False
-
-    def _addDay(self, date):
-        """
-        Returns one day added to this date.
-        """
-        (y, m, d) = (date.y, date.m, date.d)
-
-        if self._isLastDayOfYear(date):
-            y += 1
-            m = 1
-            d = 1
-        elif self._isLastDayOfMonth(date):
-            m += 1
-            d = 1
-        else:
-            d += 1
-
-        return SimpleDate(y, m, d)
-
-    def _daysInMonth(self, y, m):
-        if y % 4 == 0 and m == 2:
-            return 29
-        else:
-            return int("dummy 31 28 31 30 31 30 31 31 30 31 30 31".split()[m])
+"""
+time_split.py
+=============
+
+Holds class DurationSplitter used to chop up time series into chunks of
+decades, years or months, or into chunks of a target data size.
+"""
+
+import calendar
+import re
+
+
+class SimpleDate:
+
+    def __init__(self, y, m, d):
+        self.y = int(y)
+        self.m = int(m)
+        self.d = int(d)
+        self.date = "%4d%02d%02d" % (self.y, self.m, self.d)
+
+    def __repr__(self):
+        return self.date
+
+    def __lt__(self, d):
+        if self.date < d.date:
+            return True
+
+        return False
+
+    def __eq__(self, d):
+        if self.date == d.date:
+            return True
+
+        return False
+
+
+class DurationSplitter:
+    """
+    Splits into sensible time chunks based on inputs.
+    """
+    known_chunk_units = [None, "decade", "year", "month", "auto"]
+
+    def __init__(self, chunk_unit=None, target_size=None, sizes_estimator=None):
+        """
+        Allows the setting of a persistent chunk_unit.
+
+        The "auto" chunk unit also needs a `sizes_estimator`, a callable taking
+        lists of start and end SimpleDate instances and returning a sequence of
+        the estimated sizes (in bytes) of the data between each pair, so that the
+        sizes of all the months are estimated at once, and the `target_size` (in
+        bytes) of each chunk.
+        """
+        self._checkChunkUnit(chunk_unit)
+        self.chunk_unit = chunk_unit
+        self.sizes_estimator = sizes_estimator
+        self.target_size = target_size
+
+    def _convertDate(self, date):
+        """
+        Converts and returns date to a SimpleDate instance. If format is bad it raises an exception.
+        """
+        if isinstance(date, str):
+            if len(date) != 8 or not re.match(r"^\d{8}$", date):
+                raise Exception("Invalid date: %s" % str(date))
+
+            return SimpleDate(date[:4], date[4:6], date[6:8])
+
+        elif type(date) in (type((1, 2)), type([1, 2])):
+            if len(date) != 3:
+                raise Exception("Invalid date: %s" % str(date))
+
+            for i in date:
+                if isinstance(i, int):
+                    raise Exception("Invalid date: %s" % str(date))
+
+            return SimpleDate(date[0], date[1], date[2])
+
+        else:
+            raise Exception("Invalid date: %s" % str(date))
+
+    def _checkChunkUnit(self, chunk_unit):
+        if chunk_unit not in self.known_chunk_units:
+            raise Exception("Invalid chunk unit '%s' not in list of %s." % (chunk_unit, str(self.known_chunk_units)))
+
+    def splitDuration(self, start_date, end_date, chunk_unit=None):
+        """
+        Splits duration into  a list of n lists of [start, end] where each is represented as a SimpleDate
+        instance with attributes of t.year, t.month, t.day. The list is returned.
+
+        All time splits are done in logical places, e.g.:
+         * decade -> at start of each year ending in 0
+         * year -> 1st of jan each year to 31st dec
+         * month -> first to last day of month
+         * auto -> whole months, grouped so that each chunk is close to (and,
+                   unless a single month is larger, no bigger than) `target_size`
+
+        All input dates times are represented as one of the following:
+         * string: "YYYYMMDD"
+         * tuple: (y, m, d)
+        """
+        start = self._convertDate(start_date)
+        end = self._convertDate(end_date)
+
+        if chunk_unit is not None:
+            self._checkChunkUnit(chunk_unit)
+        else:
+            chunk_unit = self.chunk_unit
+
+        # A start on or after the end gives a single chunk of the start date
+        if not start < end:
+            return [[start, start]]
+
+        if chunk_unit == "auto":
+            return self._splitBySize(start, end)
+
+        # Jump from one chunk boundary to the next, so that the cost scales
+        # with the number of chunks rather than the number of days. The first
+        # boundary is always looked for after the start date.
+        chunks = []
+        chunk_start = start
+        boundary = self._nextBoundary(start, chunk_unit)
+
+        while boundary is not None and boundary < end:
+            chunks.append([chunk_start, boundary])
+            chunk_start = self._addDay(boundary)
+            boundary = self._nextBoundary(chunk_start, chunk_unit)
+
+        # Now add end onto the last chunk
+        chunks.append([chunk_start, end])
+
+        return chunks
+
+    def _splitBySize(self, start, end):
+        """
+        Groups consecutive months of the duration into chunks whose estimated
+        size, from `self.sizes_estimator`, does not exceed `self.target_size`.
+        """
+        if self.sizes_estimator is None or not self.target_size:
+            raise Exception("Chunk unit 'auto' requires a sizes estimator and a target size.")
+
+        months = self.splitDuration(start.date, end.date, "month")
+        month_sizes = self.sizes_estimator([month[0] for month in months], [month[1] for month in months])
+
+        chunks = []
+        size = 0
+
+        for ((month_start, month_end), month_size) in zip(months, month_sizes):
+
+            if chunks and size + month_size <= self.target_size:
+                chunks[-1][1] = month_end
+                size += month_size
+            else:
+                chunks.append([month_start, month_end])
+                size = month_size
+
+        return chunks
+
+    def _nextBoundary(self, date, chunk_unit):
+        """
+        Returns the last day of the first chunk ending after `date` as a SimpleDate,
+        or None if `chunk_unit` is None.
+        """
+        (y, m, d) = (date.y, date.m, date.d)
+
+        if chunk_unit == "month":
+            if d < self._daysInMonth(y, m):
+                return SimpleDate(y, m, self._daysInMonth(y, m))
+
+            if m == 12:
+                (y, m) = (y + 1, 1)
+            else:
+                m += 1
+
+            return SimpleDate(y, m, self._daysInMonth(y, m))
+
+        elif chunk_unit == "year":
+            if self._isLastDayOfYear(date):
+                y += 1
+
+            return SimpleDate(y, 12, 31)
+
+        elif chunk_unit == "decade":
+            y += 9 - y % 10
+            if date.y == y and self._isLastDayOfYear(date):
+                y += 10
+
+            return SimpleDate(y, 12, 31)
+
+        return None
+
+    def _isLastDayOfMonth(self, date):
+        "Returns True or False."
+        ndays = self._daysInMonth(date.y, date.m)
+        if date.d == ndays:
+            return True
+
+        return False
+
+    def _isLastDayOfYear(self, date):
+        "Returns True or False."
+        if date.m == 12 and date.d == 31:
+            return True
+
+        return False
+
+    def _isLastDayOfDecade(self, date):
+        """
+        Returns True or False.
+        We define decades as 200001010000 - 200912312359
+        """
+        if self._isLastDayOfYear(date) and date.y % 10 == 9:
+            return True
+
+        return False
+
+    def _addDay(self, date):
+        """
+        Returns one day added to this date.
+        """
+        (y, m, d) = (date.y, date.m, date.d)
+
+        if self._isLastDayOfYear(date):
+            y += 1
+            m = 1
+            d = 1
+        elif self._isLastDayOfMonth(date):
+            m += 1
+            d = 1
+        else:
+            d += 1
+
+        return SimpleDate(y, m, d)
+
+    def _daysInMonth(self, y, m):
+        if m == 2 and calendar.isleap(y):
+            return 29
+        else:
+            return int("dummy 31 28 31 30 31 30 31 31 30 31 30 31".split()[m])
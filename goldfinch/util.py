@@ -1,18 +1,29 @@
 import copy
+import hashlib
 import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import calendar
 
+from pywps import configuration
 from pywps.app.exceptions import ProcessError
 
 from goldfinch.time_split import DurationSplitter
 
-from midas_extract.stations import StationIDGetter
-from midas_extract.subsetter import MIDASSubsetter
-from midas_extract.vocabs import UK_COUNTIES
+# The indexes, engines, caches and output modules are imported by the functions
+# using them, so that importing the processes (and this module) stays quick
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
 
 
 WEATHER_STATIONS_FILE_NAME = 'weather_stations.txt'
+
+# Size of each block read when counting the rows of an output file
+COUNT_BLOCK_SIZE = 1024 ** 2
 START_DATE = "1850-01-01"
 
 
@@ -28,6 +39,36 @@ def get_valid_date_range():
 
     return f"{START_DATE}/{end_date}"
 
+
+def get_station_index():
+    "Returns the station index of this process (see `goldfinch.station_index`)."
+    from goldfinch.station_index import get_station_index
+    return get_station_index()
+
+
+def get_availability_index(table):
+    "Returns the availability index of `table` (see `goldfinch.availability`)."
+    from goldfinch.availability import get_availability_index
+    return get_availability_index(table)
+
+
+def get_slice_cache():
+    "Returns the slice cache, or None if it is not configured (see `goldfinch.slice_cache`)."
+    from goldfinch.slice_cache import get_slice_cache
+    return get_slice_cache()
+
+
+def get_job_registry():
+    "Returns the job registry (see `goldfinch.job_registry`)."
+    from goldfinch.job_registry import get_job_registry
+    return get_job_registry()
+
+
+def get_scheduler():
+    "Returns the job scheduler, or None if it is not configured (see `goldfinch.scheduler`)."
+    from goldfinch.scheduler import get_scheduler
+    return get_scheduler()
+
             
 def translate_bbox(wps_bbox):
     """
@@ -41,24 +82,52 @@ def translate_bbox(wps_bbox):
     return (n, w, s, e)
 
 
-def get_station_list(counties, bbox, start, end, output_file, data_type=None):
+def get_station_list(counties, bbox, start, end, output_file, data_type=None, obs_table=None):
     """
-    Wrapper to call of midas station getter code.
+    Returns the list of station IDs selected by the arguments and writes them
+    to `output_file`.
+
+    The stations are selected from the in-memory station index, built once per
+    process. If the index cannot be built, the midas station getter is called.
+
+    If `obs_table` is given and there is an availability index for it, stations
+    with no observations in that table between `start` and `end` are left out.
     """
-    # Translate bbox if it is used
-    if bbox is not None:
-        bbox = translate_bbox(bbox)
+    station_index = get_station_index()
+    availability = get_availability_index(obs_table) if obs_table else None
+
+    if station_index is not None:
+        st_list = station_index.select(counties=counties, bbox=bbox, start=start, end=end,
+                                       data_types=data_type)
+    else:
+        # Translate bbox if it is used
+        if bbox is not None:
+            bbox = translate_bbox(bbox)
+
+        # Imported here: the station search of midas_extract is only needed
+        # when the station index cannot answer the query
+        from midas_extract.stations import StationIDGetter
 
-    station_getter = StationIDGetter(
-        counties,
-        bbox=bbox,
-        data_type=data_type,
-        start_time=revert_datetime_to_long_string(start),
-        end_time=revert_datetime_to_long_string(end),
-        output_file=output_file,
-        quiet=True)
+        station_getter = StationIDGetter(
+            counties,
+            bbox=bbox,
+            data_type=data_type,
+            start_time=revert_datetime_to_long_string(start),
+            end_time=revert_datetime_to_long_string(end),
+            output_file=output_file,
+            quiet=True)
 
-    return station_getter.st_list
+        st_list = station_getter.st_list
+
+    if availability is not None:
+        st_list = availability.filter_stations(st_list, int(revert_datetime_to_long_string(start)[:4]),
+                                               int(revert_datetime_to_long_string(end)[:4]))
+
+    if output_file and (station_index is not None or availability is not None):
+        with open(output_file, 'w') as writer:
+            writer.write("\r\n".join(st_list))
+
+    return st_list
 
 
 def filter_observations(table_name, output_path, start=None, end=None, columns="all",
@@ -79,43 +148,243 @@ def filter_observations(table_name, output_path, start=None, end=None, columns="
         delimiter (str, optional): [description]. Defaults to "default".
         tmp_dir ([type], optional): [description]. Defaults to None.
         verbose (int, optional): [description]. Defaults to 1.
+
+    Comma-delimited requests for all columns are read directly from the byte
+    ranges of the requested stations and time window if the archive has been
+    indexed with `goldfinch index build` (see `goldfinch.offset_index`). Other requests are
+    passed to the subsetting engine set in the configuration (see `goldfinch.engines`),
+    or to the MIDAS subsetter if that engine does not support them.
     """
+    from goldfinch.engines import MIDASSubsetterEngine, get_engine
+    from goldfinch.offset_index import read_indexed
+
+    has_window = start is not None and end is not None
+    start = revert_datetime_to_long_string(start)
+    end = revert_datetime_to_long_string(end)
 
-    return MIDASSubsetter(table_name, output_path, startTime=revert_datetime_to_long_string(start),
-                          endTime=revert_datetime_to_long_string(end), columns=columns,
+    if has_window and delimiter == "comma" and columns == "all" and not conditions and not region:
+        if read_indexed(table_name, output_path, start, end, src_ids):
+            return None
+
+    engine = get_engine()
+
+    if not has_window or not engine.can_extract(table_name, columns=columns, conditions=conditions,
+                                                region=region, delimiter=delimiter):
+        engine = MIDASSubsetterEngine()
+
+    return engine.extract(table_name, output_path, start, end, columns=columns,
                           conditions=conditions, src_ids=src_ids, region=region, delimiter=delimiter,
                           tmp_dir=tmp_dir, verbose=verbose)
 
 
-def filter_obs_by_time_chunk(table_name, output_path, start=None, end=None, columns="all",
-                             conditions=None, src_ids=None, region=None, delimiter="default",
-                             chunk_rule=None, tmp_dir=None, verbose=False):
+def get_chunk_processes():
     """
-    Loops through time chunks extracting data to files in required time chunks.
+    Returns the number of processes used to extract time chunks concurrently,
+    as set by `chunkprocesses` in the `[server]` section of the configuration.
 
-    If `chunk_rule` is None, then do not split, just forward to
-    `filter_observations()`.
+    The value is bounded by the number of CPUs on the host and is never less
+    than 1 (i.e. extract the chunks in sequence).
+    """
+    processes = int(configuration.get_config_value('server', 'chunkprocesses') or 1)
+    return max(1, min(processes, os.cpu_count() or 1))
 
-    Returns a list of output file paths produced.
+
+def get_chunk_target_size():
+    """
+    Returns the target size (in bytes) of each output file when the "auto" chunk
+    rule is used, as set by `chunktargetsize` in the `[server]` section of the
+    configuration (e.g. "200mb").
+    """
+    target_size = configuration.get_config_value('server', 'chunktargetsize') or '200mb'
+    return int(configuration.get_size_mb(target_size) * 1024 ** 2)
+
+
+def get_progress_interval():
+    """
+    Returns the minimum number of seconds between progress updates of a job, set
+    by `progressinterval` in the `[server]` section of the configuration (default 5).
+    """
+    return float(configuration.get_config_value('server', 'progressinterval') or 5)
+
+
+def get_compression_level():
+    """
+    Returns the compression level set by `compressionlevel` in the `[server]`
+    section of the configuration, or None to use the default for each compression.
+    """
+    level = configuration.get_config_value('server', 'compressionlevel')
+    return int(level) if level else None
+
+
+def _count_rows(path, digest=None):
+    """
+    Returns the number of rows (lines after the header line) in a text file.
+    If `digest` (a hashlib object) is given, it is updated with the contents.
+    """
+    lines = 0
+    last = b'\n'
+
+    with open(path, 'rb') as reader:
+        for block in iter(lambda: reader.read(COUNT_BLOCK_SIZE), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+
+            if digest is not None:
+                digest.update(block)
+
+    if last != b'\n':
+        lines += 1
+
+    return max(lines - 1, 0)
+
+
+def _extract_chunk(table_name, output_path, output_format="text", compression="none",
+                   compression_level=None, **kwargs):
+    """
+    Runs `filter_observations_with_cache()` for a single time chunk, converts the result to
+    `output_format` and compresses it, and records the ETag of the output file
+    (see `goldfinch.output_server.record_etag`). Returns a tuple of the output
+    path, the number of rows and the size of the output file (in bytes). Defined
+    at module level so that it can be sent to a worker process.
     """
+    from goldfinch.output_formats import compress_file, text_to_parquet
+    from goldfinch.output_server import record_etag
+
+    if output_format == "parquet":
+        # Extract to a CSV file alongside the output, then convert it
+        text_path = "%s.csv" % os.path.splitext(output_path)[0]
+        kwargs['delimiter'] = "comma"
+    elif compression != "none":
+        # Extract to the output path without the compression extension
+        text_path = os.path.splitext(output_path)[0]
+    else:
+        text_path = output_path
+
+    filter_observations_with_cache(table_name, text_path, **kwargs)
+
+    # The SHA-1 of the output file (its ETag when served) is computed in the
+    # same pass as the row count when the text file is the output
+    digest = hashlib.sha1() if text_path == output_path else None
+    rows = _count_rows(text_path, digest) if os.path.exists(text_path) else 0
+
+    if text_path != output_path:
+        try:
+            if output_format == "parquet":
+                text_to_parquet(text_path, output_path, compression=compression, level=compression_level)
+            else:
+                compress_file(text_path, output_path, compression, level=compression_level)
+        finally:
+            os.remove(text_path)
+
+    if not os.path.exists(output_path):
+        return output_path, rows, 0
+
+    record_etag(output_path, digest.hexdigest() if digest is not None else None)
+    return output_path, rows, os.path.getsize(output_path)
+
+
+class ChunkProgress:
+    """
+    Reports the progress of an extraction after each time chunk through
+    `update_status(message, percent)` (e.g. `response.update_status`), scaling
+    it from `start_percent` to `end_percent`. Updates are sent at most once every
+    `interval` seconds (see `get_progress_interval()`), except for the last chunk.
+    """
+
+    def __init__(self, update_status, start_percent=5, end_percent=95, interval=None):
+        self.update_status = update_status
+        self.start_percent = start_percent
+        self.end_percent = end_percent
+        self.interval = get_progress_interval() if interval is None else interval
+
+        self.rows = 0
+        self.size = 0
+        self.started = time.monotonic()
+        self.last_update = None
+
+    def __call__(self, n_done, n_chunks, rows, size):
+        "Records that `n_done` of `n_chunks` are done, the last one with `rows` rows and `size` bytes."
+        self.rows += rows
+        self.size += size
+
+        now = time.monotonic()
+
+        if (n_done < n_chunks and self.last_update is not None
+                and now - self.last_update < self.interval):
+            return
+
+        self.last_update = now
+        elapsed = max(now - self.started, 1e-6)
+        mb = self.size / 1024 ** 2
+
+        percent = self.start_percent + (self.end_percent - self.start_percent) * n_done // n_chunks
+        message = (f'Extracted {n_done} of {n_chunks} time chunks: {self.rows} rows, '
+                   f'{mb:.1f} MB written ({mb / elapsed:.1f} MB/s).')
+
+        LOGGER.info(message)
+        self.update_status(message, int(percent))
+
+
+def filter_observations_with_cache(table_name, output_path, start=None, end=None, columns="all",
+                                   conditions=None, src_ids=None, region=None, delimiter="default",
+                                   tmp_dir=None, verbose=False):
+    """
+    Extracts the observations from the slice cache, if it is configured and can
+    serve the request, scanning the archive only for the missing slices.
+    Otherwise, forwards to `filter_observations()`.
+    """
+    slice_cache = get_slice_cache()
+
+    if slice_cache and slice_cache.can_extract(src_ids, delimiter=delimiter, columns=columns,
+                                               conditions=conditions, region=region):
+
+        def scan(path, scan_start, scan_end, scan_src_ids):
+            filter_observations(table_name, path, start=scan_start, end=scan_end, src_ids=scan_src_ids,
+                                delimiter="comma", tmp_dir=tmp_dir, verbose=verbose)
+
+        try:
+            if slice_cache.extract(table_name, output_path, start, end, src_ids, scan):
+                return
+        finally:
+            slice_cache.close()
+
+    filter_observations(table_name, output_path, start=start, end=end, columns=columns,
+                        conditions=conditions, src_ids=src_ids, region=region, delimiter=delimiter,
+                        tmp_dir=tmp_dir, verbose=verbose)
+
+
+def plan_time_chunks(table_name, output_path, start, end, src_ids=None, delimiter="default",
+                     chunk_rule=None, output_format="text", compression="none"):
+    """
+    Returns a list of (output file path, start, end) for each time chunk that
+    `filter_obs_by_time_chunk()` extracts with these arguments.
+    """
+    from goldfinch.constraints import estimate_request_sizes
+    from goldfinch.output_formats import get_file_extension
+
     start_hr_min = start[8:12]
     end_hr_min = end[8:12]
 
     # Split the time chunks appropriately
-    ds = DurationSplitter()
+    if chunk_rule == "auto":
+        n_stations = len(src_ids) if src_ids else float('inf')
+        ds = DurationSplitter(
+            sizes_estimator=lambda starts, ends: estimate_request_sizes(
+                table_name, n_stations, [s.date for s in starts], [e.date for e in ends], src_ids=src_ids or []),
+            target_size=get_chunk_target_size())
+    else:
+        ds = DurationSplitter()
+
     time_splits = ds.splitDuration(start[:8], end[:8], chunk_rule)
     first_date = True
 
     # Set the extension
-    if delimiter == "comma":
-        ext = "csv"
-    else:
-        ext = "txt"
+    ext = get_file_extension(output_format, compression, delimiter)
 
-    # Create list to return
-    output_file_paths = []
+    # Create list of (output file path, start, end) for each chunk
+    chunks = []
 
-    for count, (start_date, end_date) in enumerate(time_splits):
+    for start_date, end_date in time_splits:
 
         # Add appropriate hours and minutes to date strings to make 12 character times
         if first_date:
@@ -131,16 +400,176 @@ def filter_obs_by_time_chunk(table_name, output_path, start=None, end=None, colu
 
         # Decide the output file path
         output_file_path = "%s-%s-%s.%s" % (output_path, start, end, ext)
-        output_file_paths.append(output_file_path)
+        chunks.append((output_file_path, start, end))
+
+    return _skip_empty_chunks(table_name, chunks, src_ids)
+
+
+def get_extraction_plan(table_name, output_path, start, end, src_ids, delimiter="default",
+                        chunk_rule=None, output_format="text", compression="none"):
+    """
+    Returns a dictionary describing the extraction of `table_name` for `src_ids`
+    between `start` and `end` without running it: the number of stations, the
+    planned time chunks with the estimated size (in bytes, see
+    `goldfinch.constraints`) of each one, the yearly data files to be read, and
+    the size limit on requests with whether the request is over it (and so
+    would be refused by `check_request_size()`).
+    """
+    from goldfinch.archive import find_year_files
+    from goldfinch.constraints import estimate_request_size, estimate_request_sizes, get_request_size_limit
+
+    chunks = plan_time_chunks(table_name, output_path, start, end, src_ids=src_ids, delimiter=delimiter,
+                              chunk_rule=chunk_rule, output_format=output_format, compression=compression)
+    year_files = find_year_files(table_name)
+
+    planned_chunks = []
+    files = []
+
+    estimated_sizes = estimate_request_sizes(table_name, len(src_ids), [chunk[1] for chunk in chunks],
+                                             [chunk[2] for chunk in chunks], src_ids=src_ids)
+
+    for ((output_file_path, chunk_start, chunk_end), estimated_size) in zip(chunks, estimated_sizes):
+        planned_chunks.append({'start': chunk_start, 'end': chunk_end,
+                               'output_file': os.path.basename(output_file_path),
+                               'estimated_size': int(estimated_size)})
+
+        for year in range(int(chunk_start[:4]), int(chunk_end[:4]) + 1):
+            files.extend(path for path in year_files.get(year, []) if path not in files)
+
+    # The same estimate as the size check of the request
+    size_limit = get_request_size_limit()
+    exceeds_size_limit = estimate_request_size(table_name, len(src_ids), start, end, src_ids=src_ids) > size_limit
+
+    return {
+        'obs_table': table_name,
+        'start': start,
+        'end': end,
+        'station_count': len(src_ids),
+        'estimated_size': sum(chunk['estimated_size'] for chunk in planned_chunks),
+        'size_limit': size_limit,
+        'exceeds_size_limit': bool(exceeds_size_limit),
+        'chunks': planned_chunks,
+        'files': files,
+    }
+
+
+def filter_obs_by_time_chunk(table_name, output_path, start=None, end=None, columns="all",
+                             conditions=None, src_ids=None, region=None, delimiter="default",
+                             chunk_rule=None, tmp_dir=None, verbose=False, processes=None,
+                             output_format="text", compression="none", progress=None):
+    """
+    Loops through time chunks extracting data to files in required time chunks.
+
+    If `chunk_rule` is None, then do not split, just forward to
+    `filter_observations()`.
+
+    If `chunk_rule` is "auto", the chunks are whole months grouped so that the
+    estimated size of each output file is close to `get_chunk_target_size()`,
+    based on the size model for `table_name` and the number of `src_ids`.
+
+    If `processes` is greater than 1, the time chunks are extracted concurrently
+    in a pool of that many worker processes. If it is None, the value is taken
+    from the configuration (see `get_chunk_processes()`). The output file names
+    and their order do not depend on the number of processes.
+
+    `output_format` is one of `goldfinch.output_formats.OUTPUT_FORMATS`: "text"
+    writes files delimited by `delimiter`, "parquet" writes Parquet files.
+    Each file is compressed with `compression` (see `goldfinch.output_formats.COMPRESSIONS`)
+    as soon as its chunk has been extracted, at the level given by `get_compression_level()`.
+
+    If `progress` is given, it is called as `progress(n_done, n_chunks, rows, size)`
+    each time a chunk has been extracted, with the number of rows and bytes written
+    for that chunk (see `ChunkProgress`).
+
+    If there is an availability index for `table_name`, chunks in which none of
+    `src_ids` has any data are skipped (but at least one chunk is always extracted).
+
+    Returns a list of output file paths produced.
+    """
+    chunks = plan_time_chunks(table_name, output_path, start, end, src_ids=src_ids, delimiter=delimiter,
+                              chunk_rule=chunk_rule, output_format=output_format, compression=compression)
+
+    common_kwargs = dict(columns=columns, conditions=conditions, src_ids=src_ids,
+                         region=region, delimiter=delimiter, tmp_dir=tmp_dir,
+                         verbose=verbose, output_format=output_format, compression=compression,
+                         compression_level=get_compression_level())
+
+    if processes is None:
+        processes = get_chunk_processes()
+
+    processes = min(processes, len(chunks))
+
+    if processes <= 1:
+        # Call subsetter to extract and write the data, one chunk at a time
+        for count, (output_file_path, start, end) in enumerate(chunks):
+            (_, rows, size) = _extract_chunk(table_name, output_file_path, start=start, end=end,
+                                             **common_kwargs)
+
+            if progress:
+                progress(count + 1, len(chunks), rows, size)
+
+        return [output_file_path for output_file_path, _, _ in chunks]
+
+    # Submit all chunks to the pool and report progress as they complete, then
+    # collect the results in submission order so that the returned list is
+    # identical to the sequential case
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_extract_chunk, table_name, output_file_path,
+                                   start=start, end=end, **common_kwargs)
+                   for output_file_path, start, end in chunks]
+
+        for count, future in enumerate(as_completed(futures)):
+            (_, rows, size) = future.result()
+
+            if progress:
+                progress(count + 1, len(chunks), rows, size)
+
+        return [future.result()[0] for future in futures]
+
+
+def combine_time_chunks(output_paths, output_path, delimiter="default", output_format="text",
+                        compression="none"):
+    """
+    Returns `output_paths`, the files of the time chunks written by
+    `filter_obs_by_time_chunk()`, preceded by a file holding all of them in
+    order (named from `output_path` like the chunks, but without dates), so
+    that the first file is always the complete output. A single chunk is the
+    complete output already, so it is returned on its own.
+    """
+    from goldfinch.output_formats import concatenate_files, get_file_extension
+    from goldfinch.output_server import record_etag
+
+    if len(output_paths) <= 1:
+        return output_paths
+
+    ext = get_file_extension(output_format, compression, delimiter)
+    combined_path = concatenate_files(output_paths, "%s.%s" % (output_path, ext), output_format=output_format,
+                                      compression=compression, level=get_compression_level())
+    record_etag(combined_path)
+
+    return [combined_path] + output_paths
+
+
+def _skip_empty_chunks(table_name, chunks, src_ids):
+    """
+    Returns the (output file path, start, end) `chunks` that may contain data for
+    `src_ids`, according to the availability index of `table_name`. Returns the
+    first chunk only if none of them can.
+    """
+    availability = get_availability_index(table_name)
+
+    if availability is None:
+        return chunks
+
+    years = set(availability.years_with_data(src_ids, int(chunks[0][1][:4]), int(chunks[-1][2][:4])))
+    kept = [chunk for chunk in chunks
+            if years.intersection(range(int(chunk[1][:4]), int(chunk[2][:4]) + 1))]
 
-        # Call subsetter to extract and write the data
-        filter_observations(table_name, output_file_path, start=start, end=end,
-                            columns=columns, conditions=conditions,
-                            src_ids=src_ids, region=region, delimiter=delimiter,
-                            tmp_dir=tmp_dir, verbose=verbose)
-        # progress = int(float(count) / len(time_splits) * 100)
+    if len(kept) < len(chunks):
+        LOGGER.info('Skipping {} of {} time chunks with no data in {}'.format(
+            len(chunks) - len(kept), len(chunks), table_name))
 
-    return output_file_paths
+    return kept or chunks[:1]
 
 
 def revert_datetime_to_long_string(dt):
@@ -159,6 +588,8 @@ def validate_inputs(inputs, defaults=None, required=None):
 
     You can set `required` as a sequence of keys that must exist.
     """
+    from midas_extract.vocabs import UK_COUNTIES
+
     if not defaults:
         defaults = {}
 
@@ -203,12 +634,28 @@ def validate_inputs(inputs, defaults=None, required=None):
     else:
         resp['datatypes'] = None
 
+    if 'dry_run' in inputs:
+        resp['dry_run'] = bool(inputs['dry_run'][0].data)
+
+    if 'combine_chunks' in inputs:
+        resp['combine_chunks'] = bool(inputs['combine_chunks'][0].data)
+
+    if 'input_job_id' in inputs:
+        resp['input_job_id'] = inputs['input_job_id'][0].data.strip()
+
     if 'chunk_rule' in inputs:
-        resp['chunk_rule'] = inputs['chunk_rule'][0].data
+        chunk_rule = inputs['chunk_rule'][0].data
+        resp['chunk_rule'] = None if chunk_rule == 'none' else chunk_rule
 
     if 'delimiter' in inputs:
         resp['delimiter'] = inputs['delimiter'][0].data
 
+    if 'output_format' in inputs:
+        resp['output_format'] = inputs['output_format'][0].data
+
+    if 'compression' in inputs:
+        resp['compression'] = inputs['compression'][0].data
+
     # Fix datetimes
     # Determine key first, either "DateRange" or "TemporalRange"
     if 'DateRange' in inputs:
@@ -243,8 +690,87 @@ def validate_inputs(inputs, defaults=None, required=None):
     return resp
 
 
+def _lookup_job(job_id):
+    "Returns the registry entry of job `job_id`, raising a ProcessError if there is none."
+    registry = get_job_registry()
+
+    try:
+        job = registry.lookup(job_id)
+    finally:
+        registry.close()
+
+    if job is None:
+        raise ProcessError(f'Unknown input job ID: {job_id}. It must be the ID of a finished job '
+                           f'that selected weather stations.')
+
+    return job
+
+
 def locate_process_dir(job_id):
-    raise NotImplementedError()
+    "Returns the working directory of the finished job `job_id`."
+    return _lookup_job(job_id)['workdir']
+
+
+def get_job_station_list(job_id):
+    """
+    Returns the list of station IDs selected by the finished job `job_id`,
+    raising a ProcessError if it selected none.
+    """
+    station_list = _lookup_job(job_id)['station_ids']
+
+    if not station_list:
+        raise ProcessError(f'Input job {job_id} selected no weather stations.')
+
+    return station_list
+
+
+def register_job(job_id, process, workdir, stations_file, station_list):
+    """
+    Records a finished job and its station list in the job registry, so that
+    it can be used as the `input_job_id` of later requests. Failures are logged
+    and do not fail the job.
+    """
+    try:
+        registry = get_job_registry()
+
+        try:
+            registry.register(job_id, process, workdir, stations_file, station_list)
+        finally:
+            registry.close()
+
+    except (OSError, sqlite3.Error) as exc:
+        LOGGER.warning(f'Could not register job {job_id}: {exc}')
+
+
+@contextmanager
+def scheduled_extraction(job_id, size, update_status=None):
+    """
+    Context manager that holds the extraction of job `job_id`, estimated at
+    `size` bytes, until the scheduler has a free slot in its size class and
+    admits it within the limits on bytes in flight and free disk space (see
+    `goldfinch.scheduler`). Does nothing if none of these are configured.
+    While the job waits, its status is updated with `update_status`.
+    """
+    scheduler = get_scheduler()
+
+    if scheduler is None:
+        yield
+        return
+
+    def on_wait(size_class, ahead):
+        if not update_status:
+            return
+
+        if ahead:
+            update_status('Waiting for a slot for {} jobs ({} job(s) ahead).'.format(size_class.name, ahead), 5)
+        else:
+            update_status('Waiting for running jobs to free up memory and disk space.', 5)
+
+    try:
+        with scheduler.slot(job_id, size, on_wait=on_wait):
+            yield
+    finally:
+        scheduler.close()
 
 
 def read_from_file(fpath, converter=str):
@@ -1,17 +1,25 @@
 import os
 from pywps.app.Service import Service
 
-from .processes import processes
-
 
 def create_app(cfgfiles=None):
+    from .capabilities_cache import CapabilitiesCache
+    from .processes import get_processes
+
     config_files = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
     if cfgfiles:
         config_files.extend(cfgfiles)
     if 'PYWPS_CFG' in os.environ:
         config_files.append(os.environ['PYWPS_CFG'])
-    service = Service(processes=processes, cfgfiles=config_files)
-    return service
+    service = Service(processes=get_processes(), cfgfiles=config_files)
+    return CapabilitiesCache(service)
+
 
+def __getattr__(name):
+    # `application` is created on first use (e.g. by the WSGI server) rather
+    # than when the module is imported
+    if name == 'application':
+        application = globals()['application'] = create_app()
+        return application
 
-application = create_app()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,158 @@
+"""
+year_index.py
+=============
+
+Holds class YearStationIndex, the base of the indexes of a MIDAS table by
+(year, src_id) built by `goldfinch index build` (the availability index and
+the size catalogue), with the scan of the data files they are built from and
+the loading of their files, once per process.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from goldfinch.archive import find_year_files, get_archive_mtime, get_layout
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def scan_station_sizes(path, src_id_index, header_lines=0):
+    "Returns a dictionary of (integer) src_id: number of bytes of its rows in a data file."
+    sizes = {}
+
+    with open(path, 'rb') as reader:
+        for _ in range(header_lines):
+            reader.readline()
+
+        for line in reader:
+            fields = line.split(b',', src_id_index + 1)
+
+            if len(fields) > src_id_index:
+                try:
+                    src_id = int(fields[src_id_index])
+                except ValueError:
+                    continue
+
+                sizes[src_id] = sizes.get(src_id, 0) + len(line)
+
+    return sizes
+
+
+def scan_year_sizes(table):
+    """
+    Returns a dictionary of year: {src_id: number of bytes} of the rows of each
+    station in each year of `table`, scanning each of its data files once.
+    """
+    year_sizes = {}
+
+    for year, paths in sorted(find_year_files(table).items()):
+        year_sizes[year] = {}
+
+        for path in paths:
+            (_, src_id_index, header_lines) = get_layout(table, path)
+
+            for src_id, size in scan_station_sizes(path, src_id_index, header_lines).items():
+                year_sizes[year][src_id] = year_sizes[year].get(src_id, 0) + size
+
+    return year_sizes
+
+
+class YearStationIndex:
+    """
+    Index of the (year, src_id) pairs with at least one observation in `table`,
+    held as two NumPy arrays sorted by year then src_id, with the arrays named in
+    `VALUE_FIELDS` (name: dtype) holding a value for each pair. The modification
+    time of the table in the archive when the index was built is kept so that
+    out-of-date indexes can be detected.
+
+    Subclasses define `DESCRIPTION` (for messages), `VALUE_FIELDS` and
+    `from_year_sizes()`.
+    """
+
+    DESCRIPTION = 'index'
+    VALUE_FIELDS = {}
+
+    def __init__(self, table, years, src_ids, archive_mtime=0, **values):
+        years = np.asarray(years, dtype=np.int16)
+        src_ids = np.asarray(src_ids, dtype=np.int32)
+        order = np.lexsort((src_ids, years))
+
+        self.table = table
+        self.years = years[order]
+        self.src_ids = src_ids[order]
+        self.archive_mtime = archive_mtime
+
+        for (name, dtype) in self.VALUE_FIELDS.items():
+            setattr(self, name, np.asarray(values[name], dtype=dtype)[order])
+
+    @classmethod
+    def build(cls, table):
+        "Builds the index of `table` by scanning each of its data files once."
+        archive_mtime = get_archive_mtime(table)
+        return cls.from_year_sizes(table, scan_year_sizes(table), archive_mtime=archive_mtime)
+
+    @classmethod
+    def from_year_sizes(cls, table, year_sizes, archive_mtime=0):
+        "Returns the index for a dictionary of year: {src_id: number of bytes}."
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data['table']), data['years'], data['src_ids'],
+                       archive_mtime=float(data['archive_mtime']),
+                       **{name: data[name] for name in cls.VALUE_FIELDS})
+
+    def save(self, path):
+        "Writes the index to `path`, replacing any existing file in one step."
+        tmp_path = '%s.tmp.npz' % path
+
+        np.savez(tmp_path, table=self.table, years=self.years, src_ids=self.src_ids,
+                 archive_mtime=self.archive_mtime, **{name: getattr(self, name) for name in self.VALUE_FIELDS})
+        os.replace(tmp_path, path)
+
+    def _year_range(self, start_year, end_year):
+        "Returns the slice of the pairs from `start_year` to `end_year`."
+        return slice(np.searchsorted(self.years, start_year, side='left'),
+                     np.searchsorted(self.years, end_year, side='right'))
+
+
+_loaded_indexes = {}
+_loaded_indexes_lock = threading.Lock()
+
+
+def load_year_index(cls, table, path):
+    """
+    Returns the index of class `cls` (a YearStationIndex) of `table` saved at
+    `path`, loaded once per process (and again whenever the file changes).
+    Returns None if there is no such file, it cannot be read, or the archive
+    has changed since the index was built.
+    """
+    try:
+        file_mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    with _loaded_indexes_lock:
+        cached = _loaded_indexes.get(path)
+
+        if cached is None or cached[0] != file_mtime:
+            try:
+                cached = (file_mtime, cls.load(path))
+            except (OSError, ValueError, KeyError) as exc:
+                LOGGER.warning('Could not load {} {}: {}'.format(cls.DESCRIPTION, path, exc))
+                return None
+
+            _loaded_indexes[path] = cached
+
+    index = cached[1]
+
+    if index.archive_mtime != get_archive_mtime(table):
+        LOGGER.warning('{} for {} is out of date, ignoring it: run "goldfinch index build"'.format(
+            cls.DESCRIPTION.capitalize(), table))
+        return None
+
+    return index
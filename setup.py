@@ -10,7 +10,7 @@ from setuptools import setup, find_packages
 here = os.path.abspath(os.path.dirname(__file__))
 README = open(os.path.join(here, 'README.rst')).read()
 CHANGES = open(os.path.join(here, 'CHANGES.rst')).read()
-REQUIRES_PYTHON = ">=3.5.0"
+REQUIRES_PYTHON = ">=3.7.0"
 
 about = {}
 with open(os.path.join(here, 'goldfinch', '__version__.py'), 'r') as f:
@@ -28,8 +28,6 @@ classifiers = [
     'Programming Language :: Python',
     'Natural Language :: English',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.5',
-    'Programming Language :: Python :: 3.6',
     'Programming Language :: Python :: 3.7',
     'Topic :: Scientific/Engineering :: Atmospheric Science',
     'License :: OSI Approved :: BSD License',
@@ -54,6 +52,9 @@ setup(name='goldfinch',
           ],
       extras_require={
           "dev": dev_reqs,              # pip install ".[dev]"
+          "parquet": ["pyarrow"],       # pip install ".[parquet]"
+          "zstd": ["zstandard"],        # pip install ".[zstd]"
+          "server": ["gunicorn"],       # pip install ".[server]"
       },
       entry_points={
           'console_scripts': [
@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from goldfinch import availability as availability_module
+from goldfinch.archive import archive_mtime_scope, find_year_files, get_archive_mtime, get_layout
+from goldfinch.availability import AvailabilityIndex, get_availability_index, get_availability_path
+
+# (year, src_ids with observations) for the TD table of the test archive
+TD_STATIONS = {
+    2016: [1039],
+    2017: [1039, 57199],
+    2019: [1144],
+}
+
+
+def _write_year_file(table_dir, year, src_ids, header=None):
+    path = os.path.join(table_dir, 'yearly_files', f'midas_tempdrnl_{year}01-{year}12.txt')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'w') as writer:
+        if header:
+            writer.write(header)
+
+        for src_id in src_ids:
+            for month in (1, 6):
+                writer.write(f"{year}-{month:02d}-01 09:00, DCNN, 1, 24, 1, DLY3208, {src_id}, 1001, 10.5\n")
+
+    return path
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'archive'
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(data_dir))
+
+    for year, src_ids in TD_STATIONS.items():
+        _write_year_file(str(data_dir / 'TD'), year, src_ids)
+
+    return data_dir
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    monkeypatch.setattr(availability_module, 'get_index_dir', lambda: str(index_dir))
+    return index_dir
+
+
+def test_find_year_files(archive):
+    year_files = find_year_files('TD')
+
+    assert sorted(year_files) == [2016, 2017, 2019]
+    assert os.path.basename(year_files[2017][0]) == 'midas_tempdrnl_201701-201712.txt'
+    assert find_year_files('RD') == {}
+
+
+def test_archive_mtime_scope(archive):
+    path = find_year_files('TD')[2017][0]
+    archive_mtime = get_archive_mtime('TD')
+
+    with archive_mtime_scope():
+        assert get_archive_mtime('TD') == archive_mtime
+        os.utime(path, (archive_mtime + 10, archive_mtime + 10))
+
+        # The archive is only looked at once in the scope
+        assert get_archive_mtime('TD') == archive_mtime
+
+    assert get_archive_mtime('TD') == archive_mtime + 10
+
+
+def test_get_layout_uses_header(tmp_path):
+    path = _write_year_file(str(tmp_path / 'TD'), 2017, [1039],
+                            header="ob_end_time, id_type, id, src_id, max_air_temp\n")
+
+    assert get_layout('TD') == (0, 6, 0)
+    assert get_layout('TD', path) == (0, 3, 1)
+
+
+def test_availability_index_build(archive):
+    index = AvailabilityIndex.build('TD')
+
+    assert list(zip(index.years.tolist(), index.src_ids.tolist())) == [
+        (2016, 1039), (2017, 1039), (2017, 57199), (2019, 1144)]
+
+    assert index.stations(2016, 2017).tolist() == [1039, 57199]
+    assert index.stations(2018, 2018).tolist() == []
+    assert index.filter_stations(['57199', '1144', '1039'], 2017, 2018) == ['57199', '1039']
+
+    assert index.years_with_data(['1144'], 2010, 2020) == [2019]
+    assert index.years_with_data(['1039', '1144'], 2017, 2019) == [2017, 2019]
+    assert index.years_with_data([], 2010, 2020) == [2016, 2017, 2019]
+
+
+def test_availability_index_save_and_load(archive, tmp_path):
+    index = AvailabilityIndex.build('TD')
+    path = str(tmp_path / 'TD.availability.npz')
+    index.save(path)
+
+    loaded = AvailabilityIndex.load(path)
+
+    assert loaded.table == 'TD'
+    assert loaded.archive_mtime == index.archive_mtime
+    assert loaded.years.tolist() == index.years.tolist()
+    assert loaded.src_ids.tolist() == index.src_ids.tolist()
+
+
+def test_get_availability_index_ignores_out_of_date_index(archive, index_dir):
+    assert get_availability_index('TD') is None
+
+    AvailabilityIndex.build('TD').save(get_availability_path('TD'))
+    assert get_availability_index('TD').stations(2019, 2019).tolist() == [1144]
+
+    # A new file in the archive makes the index out of date
+    path = _write_year_file(str(archive / 'TD'), 2020, [1144])
+    later = os.stat(path).st_mtime + 10
+    os.utime(path, (later, later))
+
+    assert get_availability_index('TD') is None
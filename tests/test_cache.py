@@ -0,0 +1,100 @@
+import os
+import time
+
+from goldfinch.cache import ResultCache
+
+INPUTS = {'obs_table': 'TD', 'start': '20170101', 'end': '20181231', 'delimiter': 'comma',
+          'chunk_rule': 'auto', 'output_format': 'text', 'compression': 'none'}
+
+
+def _write_outputs(workdir, content, names=('station_data-a.csv', 'station_data-b.csv')):
+    os.makedirs(workdir, exist_ok=True)
+    paths = []
+
+    for name in names:
+        path = os.path.join(workdir, name)
+        with open(path, 'w') as writer:
+            writer.write(content)
+        paths.append(path)
+
+    return paths
+
+
+def test_result_cache_key_is_normalised(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 1000)
+    key = cache.make_key(INPUTS, ['1039', '57199'])
+
+    assert key == cache.make_key(dict(INPUTS, DateRange='ignored'), ['57199', '1039'])
+    assert key != cache.make_key(INPUTS, ['1039'])
+    assert key != cache.make_key(dict(INPUTS, end='20191231'), ['1039', '57199'])
+    assert key != cache.make_key(INPUTS, ['1039', '57199'], chunk_target_size=1)
+    assert key != cache.make_key(dict(INPUTS, combine_chunks=False), ['1039', '57199'])
+
+
+def test_result_cache_key_changes_with_archive(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'data'
+    (data_dir / 'TD' / 'yearly_files').mkdir(parents=True)
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(data_dir))
+
+    cache = ResultCache(str(tmp_path / 'cache'), 1000)
+    key = cache.make_key(INPUTS, ['1039'])
+
+    year_file = data_dir / 'TD' / 'yearly_files' / 'midas_tempdrnl_201701-201712.txt'
+    year_file.write_text('data')
+    os.utime(year_file, (time.time() + 10, time.time() + 10))
+
+    assert cache.make_key(INPUTS, ['1039']) != key
+
+
+def test_result_cache_get_put(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 1000)
+    key = cache.make_key(INPUTS, ['1039'])
+
+    assert cache.get(key, str(tmp_path)) is None
+
+    cache.put(key, _write_outputs(str(tmp_path / 'job1'), 'rows'))
+
+    workdir = str(tmp_path / 'job2')
+    os.makedirs(workdir)
+    output_paths = cache.get(key, workdir)
+
+    assert [os.path.basename(path) for path in output_paths] == ['station_data-a.csv', 'station_data-b.csv']
+    assert all(open(path).read() == 'rows' for path in output_paths)
+    assert cache.size() == 8
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    # Each entry holds two files of 5 bytes, so three entries fit
+    cache = ResultCache(str(tmp_path / 'cache'), 30)
+
+    for i, name in enumerate(['first', 'second', 'third']):
+        cache.put(name, _write_outputs(str(tmp_path / name), '12345'))
+        os.utime(os.path.join(cache.cache_dir, name), (i, i))
+
+    # Use the first entry so that the second is now the least recently used
+    workdir = str(tmp_path / 'job')
+    os.makedirs(workdir)
+    assert cache.get('first', workdir) is not None
+
+    cache.put('fourth', _write_outputs(str(tmp_path / 'fourth'), '12345'))
+
+    assert sorted(os.listdir(cache.cache_dir)) == ['first', 'fourth', 'third']
+    assert cache.size() == 30
+
+
+def test_result_cache_get_removes_partial_links(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 1000)
+    cache.put('key', _write_outputs(str(tmp_path / 'job1'), 'rows'))
+
+    # The second file of the entry has gone, e.g. removed by another worker
+    os.remove(os.path.join(cache.cache_dir, 'key', 'station_data-b.csv'))
+
+    workdir = str(tmp_path / 'job2')
+    os.makedirs(workdir)
+
+    assert cache.get('key', workdir) is None
+    assert os.listdir(workdir) == []
+
+    # The job then writes its own files without changing the cached one
+    _write_outputs(workdir, 'other')
+    assert open(os.path.join(cache.cache_dir, 'key', 'station_data-a.csv')).read() == 'rows'
@@ -0,0 +1,99 @@
+import pytest
+from pywps import Service, configuration
+from werkzeug.test import Client
+
+from goldfinch import util
+from goldfinch.capabilities_cache import CapabilitiesCache
+from goldfinch.processes import wps_get_weather_stations
+from goldfinch.processes.wps_get_weather_stations import GetWeatherStations
+
+CAPABILITIES = '/wps?service=WPS&request=GetCapabilities&version=1.0.0'
+DESCRIBE = '/wps?service=wps&request=describeprocess&version=1.0.0&identifier=GetWeatherStations'
+
+
+@pytest.fixture
+def service():
+    service = Service(processes=[GetWeatherStations()])
+    service.renders = 0
+    call = service.call
+
+    def counting_call(http_request):
+        service.renders += 1
+        return call(http_request)
+
+    service.call = counting_call
+    return service
+
+
+def test_capabilities_cache_etag(service):
+    client = Client(CapabilitiesCache(service))
+
+    first = client.get(CAPABILITIES)
+    second = client.get('/wps?request=getcapabilities&version=1.0.0&service=wps')
+
+    assert first.status_code == second.status_code == 200
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert b'GetWeatherStations' in first.get_data()
+    assert service.renders == 1
+
+    not_modified = client.get(CAPABILITIES, headers={'If-None-Match': first.headers['ETag']})
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b''
+
+    assert client.get(CAPABILITIES, headers={'If-None-Match': '"other"'}).status_code == 200
+    assert service.renders == 1
+
+    describe = client.get(DESCRIBE)
+    assert describe.status_code == 200
+    assert describe.headers['ETag'] != first.headers['ETag']
+    assert service.renders == 2
+
+
+def test_capabilities_cache_not_used_for_errors(service):
+    client = Client(CapabilitiesCache(service))
+    url = '/wps?service=wps&request=describeprocess&version=1.0.0&identifier=Nonsense'
+
+    assert client.get(url).status_code == 400
+    assert client.get(url).status_code == 400
+    assert 'ETag' not in client.get(url).headers
+    assert service.renders == 3
+
+
+def test_capabilities_cache_cleared_on_config_change(service):
+    client = Client(CapabilitiesCache(service))
+    old_url = configuration.get_config_value('server', 'url')
+
+    first = client.get(CAPABILITIES)
+    configuration.CONFIG.set('server', 'url', 'http://wps.example.org/wps')
+
+    try:
+        second = client.get(CAPABILITIES)
+    finally:
+        configuration.CONFIG.set('server', 'url', old_url)
+
+    assert service.renders == 2
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert b'http://wps.example.org/wps' in second.get_data()
+
+
+def test_capabilities_cache_updates_date_range(service, monkeypatch):
+    client = Client(CapabilitiesCache(service))
+
+    client.get(DESCRIBE)
+    process = service.processes['GetWeatherStations']
+    default = process.inputs[0].data
+
+    # Execute requests do not check the date range
+    for module in (util, wps_get_weather_stations):
+        monkeypatch.setattr(module, 'get_valid_date_range', lambda: '1850-01-01/2099-12-31')
+
+    client.get('/wps?service=wps&request=execute&version=1.0.0')
+    assert service.processes['GetWeatherStations'] is process
+
+    describe = client.get(DESCRIBE)
+
+    assert service.renders == 3
+    assert b'1850-01-01/2099-12-31' in describe.get_data()
+    assert service.processes['GetWeatherStations'].inputs[0].data == '1850-01-01/2099-12-31'
+    assert process.inputs[0].data == default
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+import pytest
+
+from goldfinch.constraints import TABLE_MODELS, estimate_request_size, estimate_request_sizes
+
+
+def _numerical_estimate(table, n_stations, start_year, end_year, steps=100000):
+    "Integrates the size model of `table` with the midpoint rule, for whole years."
+    (slope, intercept) = TABLE_MODELS[table]
+    (x0, x1) = (max(start_year - 1957, 0), end_year - 1957)
+
+    def model(x):
+        return slope * min(x, 2020 - 1957) + intercept
+
+    width = (x1 - x0) / steps
+    return min(n_stations / 10000, 1) * sum(model(x0 + (i + 0.5) * width) for i in range(steps)) * width
+
+
+@pytest.mark.parametrize('table', sorted(TABLE_MODELS))
+@pytest.mark.parametrize('start_year,end_year', [(1957, 1958), (1900, 1990), (2000, 2020), (2010, 2030),
+                                                 (2022, 2025)])
+def test_estimate_request_size(table, start_year, end_year):
+    estimate = estimate_request_size(table, 100, f'{start_year}0101', f'{end_year}0101')
+    assert estimate == pytest.approx(_numerical_estimate(table, 100, start_year, end_year), rel=1e-6)
+
+
+def test_estimate_request_size_edge_cases():
+    assert estimate_request_size('XX', 100, '20170101', '20171231') == 0
+    assert estimate_request_size('TD', 100, '19000101', '19561231') == 0
+
+    # Long date/time strings, as passed to the MIDAS code, and ISO dates
+    assert estimate_request_size('TD', 100, '201701010000', '201712312359') == \
+        estimate_request_size('TD', 100, '2017-01-01', '2017-12-31')
+
+    # All the stations
+    assert estimate_request_size('TD', 20000, '20170101', '20171231') == \
+        estimate_request_size('TD', 10000, '20170101', '20171231')
+
+
+def test_estimate_request_sizes():
+    starts = ['19500101', '20170101', '20170201', '20220101']
+    ends = ['19551231', '20170131', '20170228', '20221231']
+
+    sizes = estimate_request_sizes('RD', 50, starts, ends)
+    assert sizes.tolist() == [estimate_request_size('RD', 50, start, end) for start, end in zip(starts, ends)]
+
+    sizes = estimate_request_sizes('RD', [50, 100, 200, 400], starts, ends)
+    assert sizes.tolist() == [estimate_request_size('RD', n, start, end)
+                              for n, start, end in zip([50, 100, 200, 400], starts, ends)]
+
+
+def test_constraints_does_not_import_scipy():
+    code = 'import sys, goldfinch.constraints; assert "scipy" not in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True)
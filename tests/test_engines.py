@@ -0,0 +1,137 @@
+import pytest
+
+from goldfinch import offset_index as offset_index_module
+from goldfinch.archive import find_year_files
+from goldfinch.engines import MIDASSubsetterEngine, MmapEngine, get_engine
+from goldfinch.offset_index import OffsetIndex, capture_table_header, get_header_path, get_offsets_path
+
+HEADER = b"ob_end_time, id_type, id, ob_hour_count, version_num, met_domain_name, src_id, max_air_temp\r\n"
+
+SRC_IDS = (1039, 57199, 1144)
+
+
+def _rows(year):
+    return [f"{year}-{month:02d}-{day:02d} {hour:02d}:00, DCNN, 1, 24, 1, DLY3208, {src_id}, {day}.5\r\n".encode()
+            for month in range(1, 13)
+            for day in (1, 10, 20)
+            for hour in (0, 9)
+            for src_id in SRC_IDS]
+
+
+def _expected(start, end, src_ids):
+    rows = [row for year in (2017, 2018) for row in _rows(year)
+            if start <= row[:16].decode().replace('-', '').replace(' ', '').replace(':', '') <= end
+            and (not src_ids or row.split(b',')[6].strip().decode() in src_ids)]
+    return HEADER + b''.join(rows)
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(tmp_path / 'archive'))
+    table_dir = tmp_path / 'archive' / 'TD' / 'yearly_files'
+    table_dir.mkdir(parents=True)
+
+    for year in (2017, 2018):
+        # Leave the last row of the 2018 file without a line break
+        data = b''.join(_rows(year))
+        (table_dir / f'midas_tempdrnl_{year}01-{year}12.txt').write_bytes(data if year == 2017 else data[:-2])
+
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    monkeypatch.setattr(offset_index_module, 'get_index_dir', lambda: str(index_dir))
+
+    return tmp_path / 'archive'
+
+
+REQUESTS = [
+    ('201703050000', '201802152359', ['1039']),
+    ('201701010000', '201812312359', ['1039', '1144']),
+    ('201711100900', '201711100900', ['57199']),
+    ('201711100000', '201711100859', ['57199']),
+    ('201706010000', '201806302359', []),
+    ('201801010000', '201812312359', ['99999']),
+]
+
+
+@pytest.mark.parametrize('block_size,time_index', [(64 * 1024, False), (500, False), (500, True)])
+def test_mmap_engine(archive, tmp_path, monkeypatch, block_size, time_index):
+    if time_index:
+        # Only parse the byte range of the time window
+        monkeypatch.setattr(offset_index_module, 'TIME_SAMPLE_INTERVAL', 300)
+        (tmp_path / 'index' / 'TD').mkdir()
+
+        for paths in find_year_files('TD').values():
+            OffsetIndex.build('TD', paths[0]).save(get_offsets_path('TD', paths[0]))
+
+    engine = MmapEngine(block_size=block_size)
+    assert not engine.can_extract('TD', delimiter='comma')
+
+    with open(get_header_path('TD'), 'wb') as writer:
+        writer.write(HEADER)
+
+    assert engine.can_extract('TD', delimiter='comma')
+    assert not engine.can_extract('TD', delimiter='tab')
+    assert not engine.can_extract('TD', delimiter='comma', columns='max_air_temp')
+
+    output_path = str(tmp_path / 'output.csv')
+
+    for (start, end, src_ids) in REQUESTS:
+        engine.extract('TD', output_path, start, end, src_ids=src_ids, delimiter='comma')
+        expected = _expected(start, end, src_ids)
+
+        if expected.endswith(_rows(2018)[-1]):
+            # The last row has no line break in the file
+            expected = expected[:-2]
+
+        assert open(output_path, 'rb').read() == expected
+
+
+def test_mmap_engine_ignores_ids_that_are_not_numbers(archive, tmp_path):
+    with open(get_header_path('TD'), 'wb') as writer:
+        writer.write(HEADER)
+
+    output_path = str(tmp_path / 'output.csv')
+    MmapEngine().extract('TD', output_path, '201701010000', '201712312359', src_ids=['abc', '01039'],
+                         delimiter='comma')
+    assert open(output_path, 'rb').read() == _expected('201701010000', '201712312359', ['1039'])
+
+    MmapEngine().extract('TD', output_path, '201701010000', '201712312359', src_ids=['abc'], delimiter='comma')
+    assert open(output_path, 'rb').read() == HEADER
+
+
+def test_get_engine(monkeypatch):
+    monkeypatch.delenv('GOLDFINCH_ENGINE', raising=False)
+    assert isinstance(get_engine(), MIDASSubsetterEngine)
+    assert isinstance(get_engine('mmap'), MmapEngine)
+
+    monkeypatch.setenv('GOLDFINCH_ENGINE', 'mmap')
+    assert isinstance(get_engine(), MmapEngine)
+
+    with pytest.raises(ValueError):
+        get_engine('grep')
+
+
+@pytest.mark.parametrize('start,end,src_ids', [
+    ('201703050000', '201811152359', ['1039', '57199']),
+    ('201701010900', '201701010900', ['1039']),
+    ('201812010000', '201903312359', ['1144', '1039', '57199']),
+    ('201707010000', '201707312359', []),
+])
+def test_mmap_engine_matches_midas_engine(load_test_data, tmp_path, monkeypatch, start, end, src_ids):
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    monkeypatch.setattr(offset_index_module, 'get_index_dir', lambda: str(index_dir))
+
+    midas_engine = MIDASSubsetterEngine()
+    kwargs = dict(src_ids=src_ids, delimiter='comma', tmp_dir=str(tmp_path))
+
+    def scan(output_path, scan_start, scan_end, scan_src_ids):
+        midas_engine.extract('TD', output_path, scan_start, scan_end, src_ids=scan_src_ids,
+                             delimiter='comma', tmp_dir=str(tmp_path))
+
+    assert capture_table_header('TD', find_year_files('TD')[2017][0], scan, str(tmp_path / 'scan.csv'))
+
+    midas_engine.extract('TD', str(tmp_path / 'midas.csv'), start, end, **kwargs)
+    MmapEngine().extract('TD', str(tmp_path / 'mmap.csv'), start, end, **kwargs)
+
+    assert open(tmp_path / 'mmap.csv', 'rb').read() == open(tmp_path / 'midas.csv', 'rb').read()
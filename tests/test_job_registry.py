@@ -0,0 +1,28 @@
+from goldfinch.job_registry import JobRegistry
+
+JOB_ID = '6fa7a9a4-3a8e-11ee-9b1f-0242ac120002'
+
+
+def test_job_registry(tmp_path):
+    registry = JobRegistry(str(tmp_path / 'registry' / 'jobs.sqlite'))
+
+    assert registry.lookup(JOB_ID) is None
+
+    registry.register(JOB_ID, 'GetWeatherStations', '/tmp/pywps_process_abc',
+                      '/tmp/pywps_process_abc/weather_stations.txt', ['1039', 57199])
+    job = registry.lookup(JOB_ID)
+
+    assert job['process'] == 'GetWeatherStations'
+    assert job['workdir'] == '/tmp/pywps_process_abc'
+    assert job['stations_file'] == '/tmp/pywps_process_abc/weather_stations.txt'
+    assert job['station_ids'] == ['1039', '57199']
+
+    # Shared with other connections, e.g. in other worker processes
+    other = JobRegistry(registry.path)
+    assert other.lookup(' %s ' % JOB_ID)['station_ids'] == ['1039', '57199']
+
+    other.register(JOB_ID, 'GetWeatherStations', '/tmp/other', '/tmp/other/weather_stations.txt', [])
+    assert registry.lookup(JOB_ID)['station_ids'] == []
+
+    registry.close()
+    other.close()
@@ -0,0 +1,213 @@
+import os
+
+import pytest
+
+from goldfinch import offset_index as offset_index_module
+from goldfinch import util
+from goldfinch.archive import find_year_files
+from goldfinch.engines import MIDASSubsetterEngine
+from goldfinch.offset_index import (OffsetIndex, capture_table_header, get_header_path,
+                                    get_offset_index, get_offsets_path, read_indexed)
+
+HEADER = b"ob_end_time, id_type, id, ob_hour_count, version_num, met_domain_name, src_id, max_air_temp\r\n"
+
+SRC_IDS = (1039, 57199, 1144)
+
+
+def _rows(year):
+    return [f"{year}-{month:02d}-{day:02d} 09:00, DCNN, 1, 24, 1, DLY3208, {src_id}, {day}.5\r\n".encode()
+            for month in range(1, 13)
+            for day in (1, 10, 20)
+            for src_id in SRC_IDS]
+
+
+def _expected(start, end, src_ids):
+    rows = [row for year in (2017, 2018) for row in _rows(year)
+            if start <= row[:16].decode().replace('-', '').replace(' ', '').replace(':', '') <= end
+            and row.split(b',')[6].strip().decode() in src_ids]
+    return HEADER + b''.join(rows)
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(tmp_path / 'archive'))
+    table_dir = tmp_path / 'archive' / 'TD' / 'yearly_files'
+    table_dir.mkdir(parents=True)
+
+    for year in (2017, 2018):
+        (table_dir / f'midas_tempdrnl_{year}01-{year}12.txt').write_bytes(b''.join(_rows(year)))
+
+    return tmp_path / 'archive'
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    index_dir = tmp_path / 'index'
+    (index_dir / 'TD').mkdir(parents=True)
+    monkeypatch.setattr(offset_index_module, 'get_index_dir', lambda: str(index_dir))
+    return index_dir
+
+
+def _build_indexes(table):
+    for paths in find_year_files(table).values():
+        for path in paths:
+            OffsetIndex.build(table, path).save(get_offsets_path(table, path))
+
+
+def test_offset_index_ranges(archive):
+    path = find_year_files('TD')[2017][0]
+    index = OffsetIndex.build('TD', path)
+
+    # One run per row, as the rows of each station are interleaved
+    assert len(index.src_ids) == 12 * 3 * 3
+    assert index.stations().tolist() == [1039, 1144, 57199]
+
+    with open(path, 'rb') as reader:
+        data = reader.read()
+
+    ranges = index.ranges(['57199'], months=[2])
+    assert [data[start:end] for start, end in ranges] == [
+        row for row in _rows(2017) if b'-02-' in row[:8] and b' 57199,' in row]
+
+    # Adjacent runs are merged
+    assert index.ranges(SRC_IDS) == [(0, len(data))]
+    assert index.ranges(['1']) == []
+
+    # Padded IDs are numbers, other IDs have no rows
+    assert index.ranges(['01039', ' 57199 ']) == index.ranges(['1039', '57199'])
+    assert index.ranges(['abc', '']) == []
+    assert index.ranges(['abc', '1144']) == index.ranges(['1144'])
+
+
+def test_read_indexed(archive, index_dir, tmp_path):
+    output_path = str(tmp_path / 'output.csv')
+
+    # No header or indexes yet
+    assert not read_indexed('TD', output_path, '201703050000', '201802152359', ['1039'])
+    assert not os.path.exists(output_path)
+
+    with open(get_header_path('TD'), 'wb') as writer:
+        writer.write(HEADER)
+
+    assert not read_indexed('TD', output_path, '201703050000', '201802152359', ['1039'])
+
+    _build_indexes('TD')
+
+    for (start, end, src_ids) in [('201703050000', '201802152359', ['1039']),
+                                  ('201701010000', '201812312359', ['1039', '1144']),
+                                  ('201711100900', '201711100900', ['57199']),
+                                  ('201801010000', '201812312359', ['99999'])]:
+        assert read_indexed('TD', output_path, start, end, src_ids)
+        assert open(output_path, 'rb').read() == _expected(start, end, src_ids)
+
+
+def test_out_of_date_offset_index_is_ignored(archive, index_dir):
+    _build_indexes('TD')
+    path = find_year_files('TD')[2018][0]
+    assert get_offset_index('TD', path) is not None
+
+    with open(path, 'ab') as writer:
+        writer.write(_rows(2018)[0])
+
+    assert get_offset_index('TD', path) is None
+
+
+def test_capture_table_header(archive, index_dir, tmp_path):
+    path = find_year_files('TD')[2017][0]
+    scans = []
+
+    def scan(output_path, start, end, src_ids):
+        scans.append((start, end, src_ids))
+        with open(output_path, 'wb') as writer:
+            writer.write(HEADER)
+
+    header = capture_table_header('TD', path, scan, str(tmp_path / 'scan.csv'))
+
+    assert header == HEADER
+    assert scans == [('201701010000', '201701012359', ['1039'])]
+    assert open(get_header_path('TD'), 'rb').read() == HEADER
+    assert not os.path.exists(tmp_path / 'scan.csv')
+
+
+def test_capture_table_header_removes_temporary_file(archive, index_dir, tmp_path):
+    path = archive / 'TD' / 'yearly_files' / 'midas_tempdrnl_201901-201912.txt'
+    path.write_bytes(b'')
+    tmp_file = tmp_path / 'scan.csv'
+    tmp_file.write_bytes(b'')
+
+    # No rows: nothing is scanned
+    assert capture_table_header('TD', str(path), None, str(tmp_file)) is None
+    assert not os.path.exists(tmp_file)
+
+
+def test_read_indexed_matches_subsetter(load_test_data, tmp_path, monkeypatch):
+    index_dir = tmp_path / 'index'
+    (index_dir / 'TD').mkdir(parents=True)
+    monkeypatch.setattr(offset_index_module, 'get_index_dir', lambda: str(index_dir))
+
+    _build_indexes('TD')
+
+    def scan(output_path, start, end, src_ids):
+        MIDASSubsetterEngine().extract('TD', output_path, start, end, src_ids=src_ids,
+                                       delimiter='comma', tmp_dir=str(tmp_path))
+
+    path = find_year_files('TD')[2017][0]
+    assert capture_table_header('TD', path, scan, str(tmp_path / 'scan.csv'))
+
+    start, end, src_ids = '201703050000', '201811152359', ['1039', '57199']
+    scan(str(tmp_path / 'expected.csv'), start, end, src_ids)
+
+    util.filter_observations('TD', str(tmp_path / 'indexed.csv'), start=start, end=end, src_ids=src_ids,
+                             delimiter='comma', tmp_dir=str(tmp_path))
+
+    assert open(tmp_path / 'indexed.csv', 'rb').read() == open(tmp_path / 'expected.csv', 'rb').read()
+
+
+def test_time_window(archive, monkeypatch):
+    monkeypatch.setattr(offset_index_module, 'TIME_SAMPLE_INTERVAL', 500)
+    path = find_year_files('TD')[2017][0]
+    index = OffsetIndex.build('TD', path)
+
+    assert index.time_sorted
+    assert index.sample_offsets[0] == 0
+    assert len(index.sample_offsets) > 10
+
+    with open(path, 'rb') as reader:
+        data = reader.read()
+
+    (start, end) = index.time_window('201711100000', '201711102359')
+    window_rows = [row for row in _rows(2017) if row.startswith(b'2017-11-10')]
+
+    assert b''.join(window_rows) in data[start:end]
+    assert end - start < 3 * 500
+    assert index.time_window('201601010000', '201612312359') == (0, 0)
+    assert index.time_window('201801010000', '201812312359') == (index.sample_offsets[-1], len(data))
+
+
+def test_read_indexed_time_window_for_all_stations(archive, index_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(offset_index_module, 'TIME_SAMPLE_INTERVAL', 500)
+    monkeypatch.setattr(offset_index_module, 'READ_BLOCK_SIZE', 100)
+
+    with open(get_header_path('TD'), 'wb') as writer:
+        writer.write(HEADER)
+
+    _build_indexes('TD')
+    output_path = str(tmp_path / 'output.csv')
+
+    for (start, end) in [('201711100000', '201711102359'), ('201712200900', '201801010900'),
+                         ('201701010000', '201812312359')]:
+        assert read_indexed('TD', output_path, start, end)
+        assert open(output_path, 'rb').read() == _expected(start, end, [str(src_id) for src_id in SRC_IDS])
+
+        assert read_indexed('TD', output_path, start, end, ['1144'])
+        assert open(output_path, 'rb').read() == _expected(start, end, ['1144'])
+
+    # Rows out of time order: the window cannot be found
+    path = find_year_files('TD')[2018][0]
+    with open(path, 'wb') as writer:
+        writer.write(b''.join(reversed(_rows(2018))))
+
+    _build_indexes('TD')
+    assert not get_offset_index('TD', path).time_sorted
+    assert not read_indexed('TD', output_path, '201801010000', '201801312359')
+    assert read_indexed('TD', output_path, '201801010000', '201801312359', ['1144'])
@@ -0,0 +1,158 @@
+import gzip
+
+import pytest
+
+from goldfinch import output_formats
+from goldfinch.output_formats import (compress_file, concatenate_files, get_data_format, get_file_extension,
+                                      text_to_parquet, GZIP, PARQUET, ZSTD)
+
+TEXT = ("ob_end_time, id_type, id, src_id, max_air_temp, min_air_temp, q_flag\n"
+        "2017-01-01 09:00, DCNN, 1234, 1039, 10.5, , \n"
+        "2017-01-02 09:00, DCNN, 1234, 1039, 11, -2.25, \n"
+        "2017-01-03 09:00, DCNN, 1234, 57199, , 1, A\n")
+
+
+def test_text_to_parquet_typed_columns(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    text_path = tmp_path / 'station_data.csv'
+    text_path.write_text(TEXT)
+
+    parquet_path = text_to_parquet(str(text_path), str(tmp_path / 'station_data.parquet'))
+    table = pq.read_table(parquet_path)
+
+    assert table.column_names == ['ob_end_time', 'id_type', 'id', 'src_id',
+                                  'max_air_temp', 'min_air_temp', 'q_flag']
+    # Parquet has no timestamp unit of seconds, so they are read back as milliseconds
+    assert [str(field.type) for field in table.schema] == [
+        'timestamp[ms]', 'string', 'int64', 'int64', 'double', 'double', 'string']
+
+    data = table.to_pydict()
+    assert data['src_id'] == [1039, 1039, 57199]
+    assert data['max_air_temp'] == [10.5, 11.0, None]
+    assert data['q_flag'] == [None, None, 'A']
+
+
+def test_text_to_parquet_header_only(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    text_path = tmp_path / 'station_data.csv'
+    text_path.write_text("ob_end_time, src_id\n")
+
+    table = pq.read_table(text_to_parquet(str(text_path), str(tmp_path / 'station_data.parquet')))
+
+    assert table.column_names == ['ob_end_time', 'src_id']
+    assert table.num_rows == 0
+
+
+def test_text_to_parquet_compressed(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    text_path = tmp_path / 'station_data.csv'
+    text_path.write_text(TEXT)
+
+    parquet_path = text_to_parquet(str(text_path), str(tmp_path / 'station_data.parquet'),
+                                   compression='zstd', level=5)
+
+    assert pq.ParquetFile(parquet_path).metadata.row_group(0).column(0).compression == 'ZSTD'
+    assert pq.read_table(parquet_path).num_rows == 3
+
+
+def test_compress_file_gzip(tmp_path):
+    text_path = tmp_path / 'station_data.csv'
+    text_path.write_text(TEXT)
+
+    output_path = compress_file(str(text_path), str(tmp_path / 'station_data.csv.gz'), 'gzip', level=1)
+
+    with gzip.open(output_path, 'rt') as reader:
+        assert reader.read() == TEXT
+
+
+def test_compress_file_zstd(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    text_path = tmp_path / 'station_data.csv'
+    text_path.write_text(TEXT)
+
+    output_path = compress_file(str(text_path), str(tmp_path / 'station_data.csv.zst'), 'zstd')
+
+    with open(output_path, 'rb') as reader:
+        assert zstandard.ZstdDecompressor().stream_reader(reader).read().decode() == TEXT
+
+
+@pytest.mark.parametrize('compression,ext', [('none', 'csv'), ('gzip', 'csv.gz'), ('zstd', 'csv.zst')])
+def test_concatenate_text_files(tmp_path, compression, ext):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+
+    lines = TEXT.splitlines(keepends=True)
+    input_paths = []
+
+    # The second file has no rows and the third does not end with a new line
+    for (i, rows) in enumerate([lines[1:3], [], [lines[3].rstrip('\n')]]):
+        text_path = tmp_path / 'chunk{}.csv'.format(i)
+        text_path.write_text(lines[0] + ''.join(rows))
+        input_path = str(text_path)
+
+        if compression != 'none':
+            input_path = compress_file(input_path, '{}.{}'.format(input_path, ext.split('.')[-1]), compression)
+
+        input_paths.append(input_path)
+
+    output_path = concatenate_files(input_paths + [str(tmp_path / 'missing.csv')], str(tmp_path / ('all.' + ext)),
+                                    compression=compression)
+
+    if compression == 'none':
+        content = open(output_path).read()
+    elif compression == 'gzip':
+        content = gzip.open(output_path, 'rt').read()
+    else:
+        import zstandard
+        content = zstandard.open(output_path, 'rt').read()
+
+    assert content == TEXT.rstrip('\n')
+
+
+def test_concatenate_text_files_over_many_blocks(tmp_path, monkeypatch):
+    # Blocks of 10 bytes end part way through most rows
+    monkeypatch.setattr(output_formats, 'COMPRESSION_BLOCK_SIZE', 10)
+    lines = TEXT.splitlines(keepends=True)
+    input_paths = []
+
+    for i in range(2):
+        text_path = tmp_path / 'chunk{}.csv'.format(i)
+        text_path.write_text(''.join(lines))
+        input_paths.append(str(text_path))
+
+    output_path = concatenate_files(input_paths, str(tmp_path / 'all.csv'))
+
+    with open(output_path) as reader:
+        assert reader.read() == TEXT + ''.join(lines[1:])
+
+
+def test_concatenate_parquet_files(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    lines = TEXT.splitlines(keepends=True)
+    input_paths = []
+
+    # min_air_temp has no values in the first file and is an integer column in the last one
+    for (i, rows) in enumerate([lines[1:2], lines[2:3], lines[3:]]):
+        text_path = tmp_path / 'chunk{}.csv'.format(i)
+        text_path.write_text(lines[0] + ''.join(rows))
+        input_paths.append(text_to_parquet(str(text_path), str(tmp_path / 'chunk{}.parquet'.format(i))))
+
+    table = pq.read_table(concatenate_files(input_paths, str(tmp_path / 'all.parquet'), output_format='parquet'))
+
+    assert table.num_rows == 3
+    assert str(table.schema.field('min_air_temp').type) == 'double'
+    assert table.column('min_air_temp').to_pylist() == [None, -2.25, 1.0]
+    assert table.column('src_id').to_pylist() == [1039, 1039, 57199]
+
+
+@pytest.mark.parametrize('output_format,compression,delimiter,ext,data_format', [
+    ('text', 'none', 'comma', 'csv', None),
+    ('text', 'gzip', 'comma', 'csv.gz', GZIP),
+    ('text', 'zstd', 'tab', 'txt.zst', ZSTD),
+    ('parquet', 'gzip', 'tab', 'parquet', PARQUET),
+])
+def test_output_file_naming(output_format, compression, delimiter, ext, data_format):
+    assert get_file_extension(output_format, compression, delimiter) == ext
+
+    if data_format:
+        assert get_data_format(output_format, compression) == data_format
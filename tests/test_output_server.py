@@ -0,0 +1,147 @@
+import gzip
+import os
+
+import pytest
+from werkzeug.test import Client
+
+from goldfinch.output_server import OutputServer, file_digest, get_etag, record_etag
+
+CONTENT = b''.join(b'2017-01-01 09:00, %d, 10.5\n' % i for i in range(1000))
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    (tmp_path / 'job').mkdir()
+    path = tmp_path / 'job' / 'station_data.csv'
+    path.write_bytes(CONTENT)
+    return tmp_path
+
+
+def _has_xattrs(path):
+    try:
+        os.setxattr(path, 'user.goldfinch.test', b'1')
+    except (AttributeError, OSError):
+        return False
+
+    return True
+
+
+def test_output_server_full_and_conditional(outputs):
+    client = Client(OutputServer(str(outputs)))
+    resp = client.get('/job/station_data.csv')
+
+    assert resp.status_code == 200
+    assert resp.get_data() == CONTENT
+    assert resp.headers['Content-Type'].startswith('text/csv')
+    assert resp.headers['Content-Length'] == str(len(CONTENT))
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+    etag = resp.headers['ETag']
+    assert client.get('/job/station_data.csv', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/job/station_data.csv',
+                      headers={'If-Modified-Since': resp.headers['Last-Modified']}).status_code == 304
+
+    head = client.head('/job/station_data.csv')
+    assert head.status_code == 200 and head.get_data() == b''
+
+    assert client.get('/job/missing.csv').status_code == 404
+    assert client.get('/../job/station_data.csv').status_code == 404
+    assert client.get('/job').status_code == 404
+    assert client.post('/job/station_data.csv').status_code == 405
+
+
+def test_output_server_ranges(outputs):
+    client = Client(OutputServer(str(outputs)))
+
+    resp = client.get('/job/station_data.csv', headers={'Range': 'bytes=100-199'})
+    assert resp.status_code == 206
+    assert resp.get_data() == CONTENT[100:200]
+    assert resp.headers['Content-Range'] == 'bytes 100-199/{}'.format(len(CONTENT))
+
+    assert client.get('/job/station_data.csv', headers={'Range': 'bytes=-10'}).get_data() == CONTENT[-10:]
+    assert client.get('/job/station_data.csv', headers={'Range': 'bytes=500-'}).get_data() == CONTENT[500:]
+    assert client.get('/job/station_data.csv', headers={'Range': 'bytes=-100000'}).get_data() == CONTENT
+
+    unsatisfiable = client.get('/job/station_data.csv', headers={'Range': 'bytes=100000-'})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers['Content-Range'] == 'bytes */{}'.format(len(CONTENT))
+
+    # Several ranges, or a stale If-Range: the whole file
+    assert client.get('/job/station_data.csv', headers={'Range': 'bytes=0-1,5-6'}).status_code == 200
+    assert client.get('/job/station_data.csv',
+                      headers={'Range': 'bytes=0-9', 'If-Range': '"other"'}).get_data() == CONTENT
+
+    last_modified = client.get('/job/station_data.csv').headers['Last-Modified']
+    assert client.get('/job/station_data.csv',
+                      headers={'Range': 'bytes=0-9', 'If-Range': last_modified}).get_data() == CONTENT[:10]
+
+
+def test_output_server_file_wrapper(outputs):
+    wrapped = []
+
+    def file_wrapper(reader, block_size):
+        wrapped.append(reader.tell())
+        return iter(lambda: reader.read(block_size), b'')
+
+    client = Client(OutputServer(str(outputs)))
+    resp = client.get('/job/station_data.csv', headers={'Range': 'bytes=100-'},
+                      environ_overrides={'wsgi.file_wrapper': file_wrapper})
+
+    assert resp.get_data() == CONTENT[100:]
+    assert wrapped == [100]
+
+
+def test_output_server_precompressed(outputs):
+    path = outputs / 'job' / 'station_data.csv'
+    (outputs / 'job' / 'station_data.csv.gz').write_bytes(gzip.compress(CONTENT))
+    client = Client(OutputServer(str(outputs)))
+
+    resp = client.get('/job/station_data.csv', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert resp.headers['Content-Type'].startswith('text/csv')
+    assert gzip.decompress(resp.get_data()) == CONTENT
+
+    plain = client.get('/job/station_data.csv')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.get_data() == CONTENT
+    assert plain.headers['ETag'] != resp.headers['ETag']
+
+    # A sibling older than the file is not used
+    later = os.stat(path).st_mtime + 10
+    os.utime(path, (later, later))
+    assert 'Content-Encoding' not in client.get('/job/station_data.csv',
+                                                headers={'Accept-Encoding': 'gzip'}).headers
+
+    # A .gz file requested itself is sent as it is
+    assert client.get('/job/station_data.csv.gz').headers['Content-Type'] == 'application/gzip'
+
+
+def test_record_etag(outputs):
+    path = str(outputs / 'job' / 'station_data.csv')
+
+    if not _has_xattrs(path):
+        pytest.skip('extended attributes are not supported')
+
+    assert get_etag(path, os.stat(path))[1] is True
+
+    record_etag(path)
+    assert get_etag(path, os.stat(path)) == (file_digest(path), False)
+
+    resp = Client(OutputServer(str(outputs))).get('/job/station_data.csv')
+    assert resp.headers['ETag'] == '"{}"'.format(file_digest(path))
+
+    # Changing the file invalidates the recorded ETag
+    with open(path, 'ab') as writer:
+        writer.write(b'more\n')
+
+    assert get_etag(path, os.stat(path))[1] is True
+
+
+def test_output_server_accel_redirect(outputs):
+    client = Client(OutputServer(str(outputs), accel_redirect='/internal-outputs/'))
+    resp = client.get('/job/station_data.csv')
+
+    assert resp.status_code == 200
+    assert resp.headers['X-Accel-Redirect'] == '/internal-outputs/job/station_data.csv'
+    assert resp.get_data() == b''
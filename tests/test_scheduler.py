@@ -0,0 +1,234 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from pywps import configuration
+
+from goldfinch import scheduler as scheduler_module
+from goldfinch.scheduler import JobScheduler, get_scheduler, parse_size_classes
+
+MB = 1024 ** 2
+
+
+def test_parse_size_classes():
+    (small, large) = parse_size_classes('small:20mb:8, large:*:1')
+
+    assert (small.name, small.max_size, small.slots) == ('small', 20 * MB, 8)
+    assert (large.name, large.max_size, large.slots) == ('large', None, 1)
+
+    for value in ['small:20mb:8', 'small:20mb', 'small:20mb:0, large:*:1', 'small:abc:8, large:*:1']:
+        with pytest.raises(ValueError):
+            parse_size_classes(value)
+
+
+@pytest.fixture
+def size_classes():
+    return parse_size_classes('small:1mb:2, large:*:1')
+
+
+def _scheduler(path, size_classes):
+    return JobScheduler(str(path), size_classes, poll_interval=0.01)
+
+
+def test_classify(tmp_path, size_classes):
+    scheduler = _scheduler(tmp_path / 'scheduler.sqlite', size_classes)
+
+    assert scheduler.classify(0).name == 'small'
+    assert scheduler.classify(MB).name == 'small'
+    assert scheduler.classify(MB + 1).name == 'large'
+    scheduler.close()
+
+
+def test_small_jobs_are_not_held_up_by_large_jobs(tmp_path, size_classes):
+    path = tmp_path / 'scheduler.sqlite'
+    scheduler = _scheduler(path, size_classes)
+    started = []
+    waits = []
+
+    def run_job(job_id, size, release):
+        # Each job has its own connection, as in separate worker processes
+        job_scheduler = _scheduler(path, size_classes)
+
+        with job_scheduler.slot(job_id, size, on_wait=lambda size_class, ahead: waits.append((job_id, ahead))):
+            started.append(job_id)
+            release.wait(10)
+
+        job_scheduler.close()
+
+    releases = {job_id: threading.Event() for job_id in ('large-1', 'large-2', 'small-1')}
+    threads = {job_id: threading.Thread(target=run_job, args=(job_id, 400 * MB if 'large' in job_id else MB,
+                                                              releases[job_id]))
+               for job_id in releases}
+
+    threads['large-1'].start()
+    _wait_for(lambda: started == ['large-1'])
+
+    # The second large job waits for the first
+    threads['large-2'].start()
+    _wait_for(lambda: ('large-2', 1) in waits)
+
+    stats = {row['size_class']: row for row in scheduler.stats()}
+    assert (stats['large']['running'], stats['large']['waiting']) == (1, 1)
+    assert stats['large']['current_wait'] > 0
+
+    # A small job starts straight away
+    threads['small-1'].start()
+    _wait_for(lambda: 'small-1' in started)
+    assert 'large-2' not in started
+
+    releases['large-1'].set()
+    _wait_for(lambda: 'large-2' in started)
+
+    for job_id in releases:
+        releases[job_id].set()
+        threads[job_id].join()
+
+    stats = {row['size_class']: row for row in scheduler.stats()}
+    assert (stats['large']['running'], stats['large']['waiting'], stats['large']['started']) == (0, 0, 2)
+    assert stats['large']['max_wait'] > 0
+    assert stats['small']['started'] == 1
+    scheduler.close()
+
+
+def test_jobs_of_ended_processes_are_removed(tmp_path, size_classes):
+    scheduler = _scheduler(tmp_path / 'scheduler.sqlite', size_classes)
+
+    # A job left running by a process that has ended
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    scheduler._enqueue('lost', scheduler.classify(400 * MB), 400 * MB)
+    scheduler._conn.execute("UPDATE slots SET state = 'running', pid = ?", (process.pid,))
+
+    with scheduler.slot('next', 400 * MB) as size_class:
+        assert size_class.name == 'large'
+
+    scheduler.close()
+
+
+def _hold(scheduler, job_id, size):
+    "Marks `job_id` as running in `scheduler`, as if its extraction had started."
+    scheduler._enqueue(job_id, scheduler.classify(size), size)
+    scheduler._conn.execute("UPDATE slots SET state = 'running' WHERE job_id = ?", (job_id,))
+
+
+def test_jobs_are_deferred_over_bytes_in_flight(tmp_path):
+    path = tmp_path / 'scheduler.sqlite'
+    size_classes = parse_size_classes('small:200mb:10, large:*:10')
+    scheduler = JobScheduler(str(path), size_classes, max_bytes_in_flight=500 * MB, poll_interval=0.01)
+
+    # A job over the budget starts when nothing else is running
+    with scheduler.slot('huge', 800 * MB):
+        pass
+
+    _hold(scheduler, 'running', 300 * MB)
+    started = threading.Event()
+    waits = []
+
+    def run_job():
+        job_scheduler = JobScheduler(str(path), size_classes, max_bytes_in_flight=500 * MB, poll_interval=0.01)
+
+        with job_scheduler.slot('deferred', 300 * MB, on_wait=lambda size_class, ahead: waits.append(ahead)):
+            started.set()
+
+        job_scheduler.close()
+
+    thread = threading.Thread(target=run_job)
+    thread.start()
+
+    assert not started.wait(0.3)
+    assert waits == [0]
+
+    # Jobs of other classes within the budget are not held up behind it
+    with scheduler.slot('small', 100 * MB):
+        pass
+
+    scheduler._conn.execute("DELETE FROM slots WHERE job_id = 'running'")
+    assert started.wait(10)
+    thread.join()
+    scheduler.close()
+
+
+def test_small_jobs_pass_jobs_waiting_to_be_admitted(tmp_path):
+    path = tmp_path / 'scheduler.sqlite'
+    size_classes = parse_size_classes('all:*:10')
+    scheduler = JobScheduler(str(path), size_classes, max_bytes_in_flight=500 * MB, poll_interval=0.01)
+    _hold(scheduler, 'running', 300 * MB)
+    started = []
+    releases = {job_id: threading.Event() for job_id in ('large-1', 'large-2', 'small')}
+
+    def run_job(job_id, size):
+        job_scheduler = JobScheduler(str(path), size_classes, max_bytes_in_flight=500 * MB, poll_interval=0.01)
+
+        with job_scheduler.slot(job_id, size):
+            started.append(job_id)
+            releases[job_id].wait(10)
+
+        job_scheduler.close()
+
+    threads = {job_id: threading.Thread(target=run_job, args=(job_id, 100 * MB if job_id == 'small' else 400 * MB))
+               for job_id in releases}
+
+    # The large jobs wait for the running job to free up its bytes
+    threads['large-1'].start()
+    threads['large-2'].start()
+    _wait_for(lambda: {row['waiting'] for row in scheduler.stats()} == {2})
+
+    # A small job that fits in the budget starts before them
+    threads['small'].start()
+    _wait_for(lambda: 'small' in started)
+    assert started == ['small']
+
+    releases['small'].set()
+    threads['small'].join()
+    scheduler._conn.execute("DELETE FROM slots WHERE job_id = 'running'")
+    _wait_for(lambda: len(started) == 2)
+
+    for job_id in releases:
+        releases[job_id].set()
+        threads[job_id].join()
+
+    assert sorted(started[1:]) == ['large-1', 'large-2']
+    scheduler.close()
+
+
+def test_jobs_are_deferred_when_disk_is_short(tmp_path, monkeypatch):
+    usage = type('usage', (), {'free': 1000 * MB})
+    monkeypatch.setattr(scheduler_module.shutil, 'disk_usage', lambda path: usage)
+
+    scheduler = JobScheduler(str(tmp_path / 'scheduler.sqlite'), parse_size_classes('all:*:10'),
+                             min_free_disk=500 * MB, scratch_dir=str(tmp_path))
+    _hold(scheduler, 'running', 300 * MB)
+
+    scheduler._enqueue('next', scheduler.classify(300 * MB), 300 * MB)
+    assert not scheduler._admit('next')
+
+    usage.free = 1200 * MB
+    assert scheduler._admit('next')
+    scheduler.close()
+
+
+def test_get_scheduler(tmp_path, monkeypatch):
+    options = {'sizeclasses': '', 'maxbytesinflight': '', 'minfreedisk': '',
+               'schedulerdb': str(tmp_path / 'scheduler.sqlite'), 'workdir': str(tmp_path)}
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option: options.get(option, ''))
+
+    assert get_scheduler() is None
+
+    options['maxbytesinflight'] = '2gb'
+    scheduler = get_scheduler()
+
+    assert [size_class.name for size_class in scheduler.size_classes] == ['all']
+    assert scheduler.classify(10 * 1024 * MB).slots is None
+    assert scheduler.max_bytes_in_flight == 2 * 1024 * MB
+    assert scheduler.min_free_disk is None
+    scheduler.close()
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
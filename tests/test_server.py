@@ -0,0 +1,55 @@
+import pytest
+from pywps import configuration
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from goldfinch import server
+from goldfinch.server import run_gunicorn, serve_outputs
+
+
+def _application(environ, start_response):
+    return Response('WPS')(environ, start_response)
+
+
+def test_serve_outputs(tmp_path, monkeypatch):
+    (tmp_path / 'job').mkdir()
+    (tmp_path / 'job' / 'station_data.csv').write_text('ob_end_time, src_id\n')
+    monkeypatch.setattr(configuration, 'get_config_value',
+                        lambda section, option: str(tmp_path) if option == 'outputpath' else '')
+
+    client = Client(serve_outputs(_application))
+
+    assert client.get('/outputs/job/station_data.csv').get_data() == b'ob_end_time, src_id\n'
+    assert client.get('/wps').get_data() == b'WPS'
+
+
+def test_run_gunicorn(monkeypatch):
+    pytest.importorskip('gunicorn')
+    from gunicorn.app.base import BaseApplication
+
+    loaded = {}
+    monkeypatch.setattr(server, 'preload_state', lambda: loaded.setdefault('state', True))
+    monkeypatch.setattr(BaseApplication, 'run', lambda self: loaded.update(cfg=self.cfg, app=self.load()))
+
+    run_gunicorn(_application, '127.0.0.1:5000', 4, worker_class='gthread', threads=2, timeout=60,
+                 max_requests=100, max_requests_jitter=10)
+
+    cfg = loaded['cfg']
+    assert (cfg.workers, cfg.worker_class_str, cfg.threads, cfg.timeout) == (4, 'gthread', 2, 60)
+    assert (cfg.max_requests, cfg.max_requests_jitter) == (100, 10)
+    assert cfg.bind == ['127.0.0.1:5000']
+    assert cfg.preload_app
+
+    # The state is loaded with the application, once in the parent process
+    assert loaded['state']
+    assert Client(loaded['app']).get('/wps').get_data() == b'WPS'
+
+
+def test_run_gunicorn_without_gunicorn(monkeypatch):
+    def _import_gunicorn():
+        raise RuntimeError('The multi-worker server is not available')
+
+    monkeypatch.setattr(server, '_import_gunicorn', _import_gunicorn)
+
+    with pytest.raises(RuntimeError):
+        run_gunicorn(_application, '127.0.0.1:5000', 2)
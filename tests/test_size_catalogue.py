@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from goldfinch import size_catalogue as size_catalogue_module
+from goldfinch.archive import find_year_files
+from goldfinch.constraints import check_request_size, estimate_request_size
+from goldfinch.offset_index import OffsetIndex
+from goldfinch.size_catalogue import SizeCatalogue, get_size_catalogue, get_size_catalogue_path
+
+# (year, src_id: number of rows) for the TD table of the test archive
+TD_ROWS = {
+    2016: {1039: 2},
+    2017: {1039: 3, 57199: 1},
+    2019: {1144: 4},
+}
+
+
+def _row(year, src_id):
+    return f"{year}-06-01 09:00, DCNN, 1, 24, 1, DLY3208, {src_id}, 1001, 10.5\n"
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'archive'
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(data_dir))
+
+    for year, rows in TD_ROWS.items():
+        path = data_dir / 'TD' / 'yearly_files' / f'midas_tempdrnl_{year}01-{year}12.txt'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(''.join(_row(year, src_id) * n_rows for src_id, n_rows in rows.items()))
+
+    return data_dir
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    monkeypatch.setattr(size_catalogue_module, 'get_index_dir', lambda: str(index_dir))
+    return index_dir
+
+
+def _size(year, src_id):
+    return TD_ROWS[year].get(src_id, 0) * len(_row(year, src_id))
+
+
+def test_size_catalogue_build(archive):
+    catalogue = SizeCatalogue.build('TD')
+
+    assert list(zip(catalogue.years.tolist(), catalogue.src_ids.tolist(), catalogue.sizes.tolist())) == [
+        (2016, 1039, _size(2016, 1039)), (2017, 1039, _size(2017, 1039)),
+        (2017, 57199, _size(2017, 57199)), (2019, 1144, _size(2019, 1144))]
+
+    # The same sizes from the offset indexes
+    year_sizes = {year: OffsetIndex.build('TD', paths[0]).station_sizes()
+                  for year, paths in find_year_files('TD').items()}
+    from_offsets = SizeCatalogue.from_year_sizes('TD', year_sizes)
+    assert from_offsets.sizes.tolist() == catalogue.sizes.tolist()
+
+
+def test_size_catalogue_estimate(archive):
+    catalogue = SizeCatalogue.build('TD')
+
+    sizes = catalogue.estimate(['1039'], ['20160101', '20170101', '2016-01-01', '20180101'],
+                               ['20171231', '20171231', '2019-12-31', '20181231'])
+    assert sizes.tolist() == [_size(2016, 1039) + _size(2017, 1039), _size(2017, 1039),
+                              _size(2016, 1039) + _size(2017, 1039), 0]
+
+    # All stations, and IDs that are not integers
+    assert catalogue.estimate([], ['20170101'], ['20171231']).tolist() == [
+        _size(2017, 1039) + _size(2017, 57199)]
+    assert catalogue.estimate(['57199', 'abc'], ['20170101'], ['20171231']).tolist() == [_size(2017, 57199)]
+
+    # Partial years count in proportion to their days
+    (size,) = catalogue.estimate(['1144'], ['201901010000'], ['201901312359'])
+    assert size == pytest.approx(_size(2019, 1144) * 31 / 365)
+
+
+def test_estimate_request_size_uses_size_catalogue(archive, index_dir):
+    model_estimate = estimate_request_size('TD', 1, '20190101', '20191231', src_ids=['1144'])
+    assert model_estimate == estimate_request_size('TD', 1, '20190101', '20191231')
+
+    SizeCatalogue.build('TD').save(get_size_catalogue_path('TD'))
+
+    assert estimate_request_size('TD', 1, '20190101', '20191231', src_ids=['1144']) == _size(2019, 1144)
+    assert estimate_request_size('TD', 1, '20190101', '20191231', src_ids=['1039']) == 0
+    assert estimate_request_size('TD', 1, '20190101', '20191231') == model_estimate
+
+    inputs = {'obs_table': 'TD', 'start': '201601010000', 'end': '201912312359'}
+    os.environ['MIDAS_TEST_REQUEST_SIZE_LIMIT'] = str(_size(2019, 1144))
+
+    try:
+        check_request_size(['1144'], inputs)
+
+        with pytest.raises(Exception):
+            check_request_size(['1144', '1039'], inputs)
+    finally:
+        del os.environ['MIDAS_TEST_REQUEST_SIZE_LIMIT']
+
+
+def test_get_size_catalogue_ignores_out_of_date_catalogue(archive, index_dir):
+    assert get_size_catalogue('TD') is None
+
+    SizeCatalogue.build('TD').save(get_size_catalogue_path('TD'))
+    assert get_size_catalogue('TD').sizes.sum() > 0
+
+    # A new file in the archive makes the catalogue out of date
+    path = archive / 'TD' / 'yearly_files' / 'midas_tempdrnl_202001-202012.txt'
+    path.write_text(_row(2020, 1144))
+    later = os.stat(path).st_mtime + 10
+    os.utime(path, (later, later))
+
+    assert get_size_catalogue('TD') is None
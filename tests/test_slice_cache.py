@@ -0,0 +1,205 @@
+import os
+import time
+
+import pytest
+
+from goldfinch import offset_index as offset_index_module
+from goldfinch.archive import find_year_files
+from goldfinch.offset_index import OffsetIndex, get_offsets_path
+from goldfinch.slice_cache import SliceCache
+
+HEADER = "ob_end_time, id_type, id, ob_hour_count, version_num, met_domain_name, src_id, max_air_temp\n"
+
+# Rows of the archive, in file order: the rows of each time are in a different
+# order of stations from one year to the next, and each year of 2018 and 2020
+# is in two files
+STATION_ORDERS = {2017: (1039, 57199, 1144), 2018: (1144, 1039, 57199),
+                  2019: (57199, 1144, 1039), 2020: (1039, 1144, 57199)}
+
+YEAR_FILES = {2017: [range(1, 13)], 2018: [range(1, 7), range(7, 13)],
+              2019: [range(1, 13)], 2020: [range(1, 4), range(4, 13)]}
+
+
+def _row(year, month, src_id):
+    return f"{year}-{month:02d}-01 09:00, DCNN, 1, 24, 1, DLY3208, {src_id}, {month}.5\n"
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    "Writes the yearly files of the TD table."
+    table_dir = tmp_path / 'archive' / 'TD' / 'yearly_files'
+    table_dir.mkdir(parents=True)
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(tmp_path / 'archive'))
+
+    for (year, months) in YEAR_FILES.items():
+        for file_months in months:
+            name = f'midas_tempdrnl_{year}{file_months[0]:02d}-{year}{file_months[-1]:02d}.txt'
+            (table_dir / name).write_text(''.join(_row(year, month, src_id) for month in file_months
+                                                  for src_id in STATION_ORDERS[year]))
+
+    return FakeSubsetter()
+
+
+class FakeSubsetter:
+    "Extracts the matching rows of the archive without the cache, as filter_observations() does."
+
+    def __init__(self):
+        self.scans = []
+
+    def scan(self, path, start, end, src_ids):
+        self.scans.append((start, end, sorted(src_ids)))
+
+        with open(path, 'w') as writer:
+            writer.write(HEADER)
+
+            for year in range(int(start[:4]), int(end[:4]) + 1):
+                for year_file in find_year_files('TD').get(year, []):
+                    for row in open(year_file):
+                        fields = [field.strip() for field in row.split(',')]
+                        time = fields[0].replace('-', '').replace(' ', '').replace(':', '')
+
+                        if start <= time <= end and fields[6] in src_ids:
+                            writer.write(row)
+
+
+@pytest.fixture
+def slice_cache(tmp_path, archive, monkeypatch):
+    cache = SliceCache(str(tmp_path / 'cache'), 10 ** 6)
+
+    # The first request keeps the header line of the table
+    assert cache.extract('TD', str(tmp_path / 'header.csv'), '201701010000', '201701012359', ['1039'], archive.scan)
+    archive.scans = []
+
+    # Record the windows read from the archive
+    cache.reads = []
+    read_rows = cache._read_rows
+
+    def record_reads(table, year, windows, src_ids):
+        cache.reads.append((year, windows, sorted(src_ids)))
+        return read_rows(table, year, windows, src_ids)
+
+    monkeypatch.setattr(cache, '_read_rows', record_reads)
+
+    yield cache
+    cache.close()
+
+
+def test_slice_cache_keeps_header_of_first_request(tmp_path, archive):
+    cache = SliceCache(str(tmp_path / 'cache'), 10 ** 6)
+    output_path = str(tmp_path / 'first.csv')
+
+    assert cache.extract('TD', output_path, '201701010000', '201712312359', ['1039'], archive.scan)
+    assert archive.scans == [('201701010000', '201712312359', ['1039'])]
+    assert cache.stats()['slices'] == 0
+
+    assert cache.extract('TD', str(tmp_path / 'second.csv'), '201701010000', '201712312359', ['1039'],
+                         archive.scan)
+    assert len(archive.scans) == 1
+    assert open(str(tmp_path / 'second.csv')).read() == open(output_path).read()
+    cache.close()
+
+
+@pytest.mark.parametrize('requests', [
+    [('201703010000', '201906302359', ['1039']),
+     ('201801010000', '202012312359', ['57199', '1039']),
+     ('201705150000', '201802152359', ['1144', '57199', '1039']),
+     ('201701010000', '202012312359', ['1039', '57199', '1144'])],
+    [('202006010000', '202008312359', ['1144']),
+     ('202002010000', '202002292359', ['1144', '1039']),
+     ('202001010000', '202012312359', ['1039', '1144', 'abc', '99999'])],
+])
+@pytest.mark.parametrize('indexed', [False, True], ids=['unindexed', 'indexed'])
+def test_slice_cache_matches_uncached_output(slice_cache, archive, tmp_path, monkeypatch, requests, indexed):
+    if indexed:
+        monkeypatch.setattr(offset_index_module, 'get_index_dir', lambda: str(tmp_path / 'index'))
+        (tmp_path / 'index' / 'TD').mkdir(parents=True)
+
+        for paths in find_year_files('TD').values():
+            for path in paths:
+                OffsetIndex.build('TD', path).save(get_offsets_path('TD', path))
+
+    for (i, (start, end, src_ids)) in enumerate(requests):
+        cached_path = str(tmp_path / f'cached{i}.csv')
+        uncached_path = str(tmp_path / f'uncached{i}.csv')
+
+        assert slice_cache.extract('TD', cached_path, start, end, src_ids, archive.scan)
+        archive.scan(uncached_path, start, end, src_ids)
+
+        with open(cached_path, 'rb') as cached, open(uncached_path, 'rb') as uncached:
+            assert cached.read() == uncached.read()
+
+
+def test_slice_cache_reads_only_missing_windows(slice_cache, archive, tmp_path):
+    output_path = str(tmp_path / 'first.csv')
+
+    assert slice_cache.extract('TD', output_path, '201703010000', '201906302359', ['1039'], archive.scan)
+    assert slice_cache.reads == [(2017, [('201703010000', '201712312359')], ['1039']),
+                                 (2018, [('201801010000', '201812312359')], ['1039']),
+                                 (2019, [('201901010000', '201906302359')], ['1039'])]
+    assert (slice_cache.hits, slice_cache.misses) == (0, 3)
+
+    slice_cache.reads = []
+    output_path = str(tmp_path / 'second.csv')
+
+    assert slice_cache.extract('TD', output_path, '201801010000', '202012312359', ['1039', '57199'],
+                               archive.scan)
+    assert slice_cache.reads == [(2018, [('201801010000', '201812312359')], ['57199']),
+                                 (2019, [('201906302359', '201912312359')], ['1039']),
+                                 (2019, [('201901010000', '201912312359')], ['57199']),
+                                 (2020, [('202001010000', '202012312359')], ['1039', '57199'])]
+    assert (slice_cache.hits, slice_cache.misses) == (1, 8)
+
+    # Earlier in a year than the cached rows: the gap up to them is read too
+    slice_cache.reads = []
+    slice_cache.extract('TD', output_path, '201701010000', '201701312359', ['1039'], archive.scan)
+    assert slice_cache.reads == [(2017, [('201701010000', '201703010000')], ['1039'])]
+
+    slice_cache.reads = []
+    slice_cache.extract('TD', output_path, '201701010000', '201712312359', ['1039'], archive.scan)
+    assert slice_cache.reads == []
+
+    assert archive.scans == []
+    stats = slice_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['slices']) == (2, 9, 7)
+
+
+def test_slice_cache_caches_empty_slices(slice_cache, archive, tmp_path):
+    for name in ('first', 'second'):
+        assert slice_cache.extract('TD', str(tmp_path / name), '201701010000', '201712312359',
+                                   ['1039', '99999'], archive.scan)
+
+    assert slice_cache.reads == [(2017, [('201701010000', '201712312359')], ['1039', '99999'])]
+
+    archive.scan(str(tmp_path / 'uncached'), '201701010000', '201712312359', ['1039'])
+    assert open(str(tmp_path / 'second')).read() == open(str(tmp_path / 'uncached')).read()
+
+
+def test_slice_cache_is_dropped_when_archive_changes(slice_cache, archive, tmp_path):
+    slice_cache.extract('TD', str(tmp_path / 'first'), '201701010000', '201712312359', ['1039'], archive.scan)
+
+    year_file = tmp_path / 'archive' / 'TD' / 'yearly_files' / 'midas_tempdrnl_201701-201712.txt'
+    year_file.write_text(_row(2017, 1, 1039))
+    os.utime(str(year_file), (time.time() + 10, time.time() + 10))
+
+    slice_cache.extract('TD', str(tmp_path / 'second'), '201701010000', '201712312359', ['1039'], archive.scan)
+    assert len(slice_cache.reads) == 2
+    assert open(str(tmp_path / 'second')).read() == HEADER + _row(2017, 1, 1039)
+
+
+def test_slice_cache_evicts_least_recently_used(slice_cache, archive, tmp_path):
+    slice_cache.extract('TD', str(tmp_path / 'out'), '201701010000', '202012312359', ['1039'], archive.scan)
+
+    size = slice_cache.stats()['size']
+    slice_cache.max_size = size // 2
+    slice_cache.evict()
+
+    stats = slice_cache.stats()
+    assert 0 < stats['slices'] < 4
+    assert stats['size'] <= size // 2
+
+
+def test_slice_cache_can_extract(slice_cache):
+    assert slice_cache.can_extract(['1039'])
+    assert not slice_cache.can_extract([])
+    assert not slice_cache.can_extract(['1039'], delimiter='tab')
+    assert not slice_cache.can_extract([str(i) for i in range(101)])
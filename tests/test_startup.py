@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+from goldfinch.startup import measure_import, parse_importtime, slowest_imports
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   numpy.version
+import time:      3000 |       5000 | numpy
+import time:        40 |         40 | goldfinch.__version__
+import time:       500 |       5540 | goldfinch
+"""
+
+
+def _imported_modules(code):
+    "Returns the goldfinch modules imported by running `code` in a fresh interpreter."
+    output = subprocess.check_output(
+        [sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sorted(sys.modules)))'],
+        universal_newlines=True)
+    return {module for module in output.split() if module.startswith('goldfinch')}
+
+
+def test_parse_importtime():
+    imports = parse_importtime(IMPORTTIME_OUTPUT)
+
+    assert [name for (name, _, _) in imports] == ['numpy.version', 'numpy', 'goldfinch.__version__', 'goldfinch']
+    assert imports[1] == ('numpy', 0.003, 0.005)
+    assert [name for (name, _, _) in slowest_imports(imports, top=2, exclude='goldfinch')] == [
+        'numpy', 'numpy.version']
+
+
+def test_measure_import():
+    result = measure_import('goldfinch.startup')
+
+    assert result['module'] == 'goldfinch.startup'
+    assert 0 < result['import_time'] < result['wall_time']
+    assert 'goldfinch.startup' in [name for (name, _, _) in result['imports']]
+
+
+def test_import_does_not_create_app():
+    assert _imported_modules('import goldfinch') == {'goldfinch', 'goldfinch.__version__'}
+    assert 'goldfinch.processes.wps_extract_uk_station_data' not in _imported_modules('import goldfinch.wsgi')
+    assert 'goldfinch.processes.wps_get_weather_stations' not in _imported_modules(
+        'import goldfinch.processes.wps_extract_uk_station_data')
+
+
+def test_util_imports_no_indexes_or_engines():
+    assert _imported_modules('import goldfinch.util') == {'goldfinch', 'goldfinch.__version__', 'goldfinch.util',
+                                                          'goldfinch.time_split'}
+
+
+def test_processes_constructed_on_first_use():
+    import goldfinch.processes
+
+    processes = goldfinch.processes.processes
+
+    assert [process.identifier for process in processes] == [
+        'GetWeatherStations', 'ExtractUKStationData', 'ExtractUKStationDataWithDateInput']
+    assert goldfinch.processes.get_processes() is processes
+    assert isinstance(processes[0], goldfinch.processes.GetWeatherStations)
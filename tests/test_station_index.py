@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from goldfinch.station_index import SpatialGrid, StationIndex, get_station_index, haversine_km
+from goldfinch.util import translate_bbox
+
+from midas_extract.stations import StationIDGetter
+
+SRCE = """src_id, src_name, high_prcn_lat, high_prcn_lon, loc_geog_area_id, rec_st_ind, src_bgn_date, src_end_date
+1007, ALPHA, 50.700, -3.500, DEVON, 1001, 1950-01-01, 3999-12-31
+1039, BRAVO, 51.300, -0.300, SURREY, 1001, 2015-06-01, 2018-05-31
+1144, CHARLIE, 50.900, 1.100, KENT, 1001, 1990-01-01, 2016-12-31
+"""
+
+SRCC = """id, id_type, met_domain_name, src_cap_bgn_date, src_cap_end_date, src_id
+3208, DCNN, DLY3208, 1950-01-01, 3999-12-31, 1007
+1007, RAIN, DLY3208, 1950-01-01, 3999-12-31, 1007
+4411, WMO, SYNOP, 2015-06-01, 2018-05-31, 1039
+"""
+
+
+@pytest.fixture
+def station_index(tmp_path):
+    (tmp_path / 'SRCE.DATA.COMMAS_REMOVED').write_text(SRCE)
+    (tmp_path / 'SRCC.DATA').write_text(SRCC)
+    return StationIndex.from_metadata(str(tmp_path))
+
+
+@pytest.mark.parametrize('kwargs,expected', [
+    (dict(counties=['DEVON', 'KENT']), ['1007', '1144']),
+    (dict(counties=['DEVON'], bbox=(-1, 51, 0, 52)), ['1007']),
+    (dict(bbox=(-1, 51, 0, 52)), ['1039']),
+    (dict(bbox=(-4, 50, 2, 52), start='20170101', end='20191231'), ['1007', '1039']),
+    (dict(bbox=(-4, 50, 2, 52), start='19800101', end='19891231'), ['1007']),
+    (dict(bbox=(-4, 50, 2, 52), data_types=['rain', 'WMO']), ['1007', '1039']),
+    (dict(counties=['ISLE OF WIGHT']), []),
+])
+def test_station_index_select(station_index, kwargs, expected):
+    assert station_index.select(**kwargs) == expected
+
+
+def test_station_index_radius_and_nearest(station_index):
+    assert [src_id for src_id, _ in station_index.within_radius(51.0, -0.5, 100)] == ['1039']
+    assert [src_id for src_id, _ in station_index.nearest(51.0, -0.5, 2)] == ['1039', '1144']
+    assert [src_id for src_id, _ in station_index.within_radius(51.0, -0.5, 300, end='19891231')] == ['1007']
+
+
+@pytest.fixture(scope='module')
+def random_points():
+    rand = np.random.default_rng(0)
+    return rand.uniform(49, 61, 5000), rand.uniform(-12, 3, 5000)
+
+
+@pytest.mark.parametrize('bbox', [(-1, 51, 0, 52), (-12, 49, 3, 61), (-3.3, 50.05, -3.2, 50.1),
+                                  (5, 40, 6, 41), (-20, 45, -11.9, 70)])
+def test_spatial_grid_bbox_matches_brute_force(random_points, bbox):
+    lats, lons = random_points
+    (w, s, e, n) = bbox
+    expected = np.flatnonzero((lats >= s) & (lats <= n) & (lons >= w) & (lons <= e))
+
+    assert sorted(SpatialGrid(lats, lons).within_bbox(*bbox)) == expected.tolist()
+
+
+@pytest.mark.parametrize('lat,lon,radius_km,k', [(51.5, -0.1, 25, 10), (55, -3, 200, 1), (49, 3, 5, 50)])
+def test_spatial_grid_radius_and_nearest_match_brute_force(random_points, lat, lon, radius_km, k):
+    lats, lons = random_points
+    grid = SpatialGrid(lats, lons)
+    distances = haversine_km(lat, lon, lats, lons)
+
+    idx, _ = grid.within_radius(lat, lon, radius_km)
+    assert sorted(idx) == np.flatnonzero(distances <= radius_km).tolist()
+
+    idx, nearest_distances = grid.nearest(lat, lon, k)
+    assert idx.tolist() == np.argsort(distances, kind='stable')[:k].tolist()
+    assert np.allclose(nearest_distances, np.sort(distances)[:k])
+
+
+queries = [
+    dict(counties=['DEVON'], bbox=None, start='20170101', end='20190131'),
+    dict(counties=['DEVON', 'KENT', 'SURREY'], bbox=None, start='20171001', end='20180131'),
+    dict(counties=[], bbox=(0, 4, 50, 55), start='20171001', end='20180131'),
+    dict(counties=[], bbox=(-5, -23, 41, 64), start='20171001', end='20180131'),
+    dict(counties=['BERKSHIRE'], bbox=None, start='20100101', end='20200101', data_type=['WMO']),
+]
+
+
+@pytest.mark.parametrize('query', queries)
+def test_station_index_matches_station_getter(load_test_data, query):
+    station_index = get_station_index()
+    assert station_index is not None
+
+    bbox = translate_bbox(query['bbox']) if query['bbox'] else None
+    getter = StationIDGetter(query['counties'], bbox=bbox, data_type=query.get('data_type'),
+                             start_time=query['start'], end_time=query['end'], quiet=True)
+
+    expected = sorted(str(station).strip() for station in getter.st_list)
+    assert station_index.select(counties=query['counties'], bbox=query['bbox'], start=query['start'],
+                                end=query['end'], data_types=query.get('data_type')) == \
+        sorted(expected, key=int)
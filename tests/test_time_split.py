@@ -0,0 +1,146 @@
+import random
+from datetime import date
+
+import pytest
+
+from goldfinch.time_split import DurationSplitter, SimpleDate
+
+CALENDAR_CHUNK_UNITS = [None, "decade", "year", "month"]
+
+
+def legacy_split_duration(start_date, end_date, chunk_unit=None):
+    """
+    Reference implementation of the original day-by-day walk used by
+    `DurationSplitter.splitDuration()`. Returns a list of [start, end] strings.
+    """
+    ds = DurationSplitter()
+    start = ds._convertDate(start_date)
+    end = ds._convertDate(end_date)
+
+    chunks = []
+    ct_appended = False
+    ct = start
+    this_chunk = [ct]
+
+    while ct < end:
+        ct = ds._addDay(ct)
+
+        if (ds._isLastDayOfMonth(ct) and chunk_unit == "month") or \
+           (ds._isLastDayOfYear(ct) and chunk_unit == "year") or \
+           (ds._isLastDayOfDecade(ct) and chunk_unit == "decade"):
+            this_chunk.append(ct)
+            chunks.append(this_chunk[:])
+            this_chunk = [ds._addDay(ct)]
+            ct_appended = True
+        else:
+            ct_appended = False
+
+    if ct_appended is False:
+        this_chunk.append(ct)
+        chunks.append(this_chunk[:])
+
+    return [[s.date, e.date] for (s, e) in chunks]
+
+
+def _split_with(ds, start, end, chunk_unit):
+    return [[s.date, e.date] for (s, e) in ds.splitDuration(start, end, chunk_unit)]
+
+
+def _split(start, end, chunk_unit):
+    return _split_with(DurationSplitter(), start, end, chunk_unit)
+
+
+def _random_dates(n, seed=0):
+    rand = random.Random(seed)
+    for _ in range(n):
+        dates = []
+        for _ in range(2):
+            y = rand.randint(1850, 2030)
+            m = rand.randint(1, 12)
+            d = rand.randint(1, DurationSplitter()._daysInMonth(y, m))
+            dates.append("%4d%02d%02d" % (y, m, d))
+        yield sorted(dates)
+
+
+edge_ranges = [('20170101', '20171231'), ('20171231', '20181231'), ('20170131', '20170228'),
+               ('19991231', '20100101'), ('20091231', '20091231'), ('20180101', '20170101'),
+               ('18500101', '20251231'), ('19000201', '19000331'), ('20000201', '20000331')]
+
+
+@pytest.mark.parametrize('chunk_unit', CALENDAR_CHUNK_UNITS)
+@pytest.mark.parametrize('start,end', edge_ranges)
+def test_split_duration_matches_legacy_edge_cases(chunk_unit, start, end):
+    assert _split(start, end, chunk_unit) == legacy_split_duration(start, end, chunk_unit)
+
+
+@pytest.mark.parametrize('chunk_unit', CALENDAR_CHUNK_UNITS)
+def test_split_duration_matches_legacy_random(chunk_unit):
+    for start, end in _random_dates(40):
+        assert _split(start, end, chunk_unit) == legacy_split_duration(start, end, chunk_unit)
+
+
+def test_split_duration_decades():
+    assert _split('19950605', '20171107', 'decade') == [
+        ['19950605', '19991231'], ['20000101', '20091231'], ['20100101', '20171107']]
+
+
+@pytest.mark.parametrize('y,days', [(1900, 28), (2000, 29), (2016, 29), (2017, 28), (2100, 28)])
+def test_days_in_february(y, days):
+    assert DurationSplitter()._daysInMonth(y, 2) == days
+
+
+def test_month_split_skips_invalid_leap_day():
+    chunks = _split('19000101', '19001231', 'month')
+    assert ['19000201', '19000228'] in chunks
+    assert SimpleDate(1900, 3, 1) == DurationSplitter()._addDay(SimpleDate(1900, 2, 28))
+
+
+def _days(start, end):
+    return (date(end.y, end.m, end.d) - date(start.y, start.m, start.d)).days + 1
+
+
+def _sizes(starts, ends):
+    return list(map(_days, starts, ends))
+
+
+@pytest.mark.parametrize('target_size', [1, 40, 100, 365, 10000])
+def test_split_duration_auto(target_size):
+    # One byte per day
+    ds = DurationSplitter(sizes_estimator=_sizes, target_size=target_size)
+    chunks = ds.splitDuration('20150115', '20190610', 'auto')
+
+    assert chunks[0][0].date == '20150115'
+    assert chunks[-1][1].date == '20190610'
+
+    for (_, prev_end), (next_start, _) in zip(chunks, chunks[1:]):
+        assert ds._addDay(prev_end) == next_start
+        assert ds._isLastDayOfMonth(prev_end)
+
+    for start, end in chunks:
+        months = ds.splitDuration(start.date, end.date, 'month')
+        assert len(months) == 1 or _days(start, end) <= target_size
+
+
+def test_split_duration_auto_sizes_estimator():
+    estimated = []
+
+    def sizes_estimator(starts, ends):
+        estimated.append(len(starts))
+        return _sizes(starts, ends)
+
+    ds = DurationSplitter(sizes_estimator=sizes_estimator, target_size=100)
+    chunks = _split_with(ds, '20150115', '20190610', 'auto')
+
+    # The sizes of all the months are estimated at once
+    assert estimated == [54]
+    assert chunks[:2] == [['20150115', '20150331'], ['20150401', '20150630']]
+
+
+def test_split_duration_auto_single_chunk():
+    ds = DurationSplitter(sizes_estimator=lambda starts, ends: [0] * len(starts), target_size=200)
+    assert _split_with(ds, '19500101', '20201231', 'auto') == [['19500101', '20201231']]
+
+
+def test_split_duration_auto_requires_estimator():
+    with pytest.raises(Exception):
+        DurationSplitter().splitDuration('20170101', '20181231', 'auto')
@@ -0,0 +1,229 @@
+import os
+import threading
+
+import pytest
+from pywps.app.exceptions import ProcessError
+
+from goldfinch import util
+from goldfinch.availability import AvailabilityIndex
+from goldfinch.job_registry import JobRegistry
+from goldfinch.output_server import file_digest, get_etag
+from goldfinch.scheduler import JobScheduler, parse_size_classes
+from goldfinch.util import filter_obs_by_time_chunk
+
+
+def _read_files(paths):
+    contents = []
+
+    for path in paths:
+        with open(path) as reader:
+            contents.append(reader.read())
+
+    return contents
+
+
+def test_filter_obs_by_time_chunk_parallel_matches_sequential(load_test_data, tmp_path):
+    kwargs = dict(start='201701010000', end='201903152359', src_ids=['1039', '57199', '1144'],
+                  delimiter='comma', chunk_rule='year', tmp_dir=str(tmp_path))
+    (tmp_path / 'seq').mkdir()
+    (tmp_path / 'par').mkdir()
+
+    sequential = filter_obs_by_time_chunk('TD', str(tmp_path / 'seq' / 'station_data'),
+                                          processes=1, **kwargs)
+    parallel = filter_obs_by_time_chunk('TD', str(tmp_path / 'par' / 'station_data'),
+                                        processes=3, **kwargs)
+
+    assert [os.path.basename(path) for path in sequential] == [
+        'station_data-201701010000-201712312359.csv',
+        'station_data-201801010000-201812312359.csv',
+        'station_data-201901010000-201903152359.csv',
+    ]
+    assert [os.path.basename(path) for path in parallel] == \
+        [os.path.basename(path) for path in sequential]
+    assert _read_files(parallel) == _read_files(sequential)
+
+
+def test_filter_obs_by_time_chunk_skips_chunks_without_data(tmp_path, monkeypatch):
+    availability = AvailabilityIndex('TD', [2016, 2017, 2019], [57199, 1039, 1039])
+    monkeypatch.setattr(util, 'get_availability_index', lambda table: availability)
+
+    extracted = []
+    monkeypatch.setattr(util, '_extract_chunk',
+                        lambda table, path, start, end, **kwargs: extracted.append((start, end)) or (path, 0, 0))
+
+    kwargs = dict(start='201601010000', end='201912312359', delimiter='comma',
+                  chunk_rule='year', tmp_dir=str(tmp_path), processes=1)
+
+    paths = filter_obs_by_time_chunk('TD', str(tmp_path / 'station_data'), src_ids=['1039'], **kwargs)
+
+    assert extracted == [('201701010000', '201712312359'), ('201901010000', '201912312359')]
+    assert [os.path.basename(path) for path in paths] == [
+        'station_data-201701010000-201712312359.csv',
+        'station_data-201901010000-201912312359.csv',
+    ]
+
+    # Always extract one chunk, even if no station has any data
+    extracted.clear()
+    paths = filter_obs_by_time_chunk('TD', str(tmp_path / 'station_data'), src_ids=['1144'], **kwargs)
+    assert extracted == [('201601010000', '201612312359')]
+    assert len(paths) == 1
+
+
+def test_get_extraction_plan(tmp_path, monkeypatch):
+    monkeypatch.setattr(util, 'get_availability_index', lambda table: None)
+    monkeypatch.setenv('MIDAS_DATA_DIR', str(tmp_path / 'archive'))
+    table_dir = tmp_path / 'archive' / 'TD' / 'yearly_files'
+    table_dir.mkdir(parents=True)
+
+    for year in (2016, 2017, 2018):
+        (table_dir / f'midas_tempdrnl_{year}01-{year}12.txt').write_text('')
+
+    plan = util.get_extraction_plan('TD', str(tmp_path / 'station_data'), '201703010000', '201806302359',
+                                    ['1039', '57199'], delimiter='comma', chunk_rule='year')
+
+    assert (plan['obs_table'], plan['station_count']) == ('TD', 2)
+    assert [(chunk['start'], chunk['end'], chunk['output_file']) for chunk in plan['chunks']] == [
+        ('201703010000', '201712312359', 'station_data-201703010000-201712312359.csv'),
+        ('201801010000', '201806302359', 'station_data-201801010000-201806302359.csv'),
+    ]
+    assert all(chunk['estimated_size'] > 0 for chunk in plan['chunks'])
+    assert plan['estimated_size'] == sum(chunk['estimated_size'] for chunk in plan['chunks'])
+    assert [os.path.basename(path) for path in plan['files']] == [
+        'midas_tempdrnl_201701-201712.txt', 'midas_tempdrnl_201801-201812.txt']
+    assert (plan['size_limit'], plan['exceeds_size_limit']) == (500000000, False)
+
+    # Nothing is extracted
+    assert not list(tmp_path.glob('station_data*'))
+
+    # A request over the size limit is planned, with the verdict
+    monkeypatch.setenv('MIDAS_TEST_REQUEST_SIZE_LIMIT', str(plan['estimated_size'] // 2))
+    plan = util.get_extraction_plan('TD', str(tmp_path / 'station_data'), '201703010000', '201806302359',
+                                    ['1039', '57199'], delimiter='comma', chunk_rule='year')
+    assert plan['exceeds_size_limit']
+
+
+def test_register_job_and_reuse_station_list(tmp_path, monkeypatch):
+    registry_path = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr(util, 'get_job_registry', lambda: JobRegistry(registry_path))
+
+    with pytest.raises(ProcessError):
+        util.get_job_station_list('no-such-job')
+
+    util.register_job('job-1', 'GetWeatherStations', str(tmp_path), str(tmp_path / 'weather_stations.txt'),
+                      ['1039', '1144'])
+
+    assert util.locate_process_dir('job-1') == str(tmp_path)
+    assert util.get_job_station_list('job-1') == ['1039', '1144']
+
+    util.register_job('job-2', 'GetWeatherStations', str(tmp_path), str(tmp_path / 'weather_stations.txt'), [])
+
+    with pytest.raises(ProcessError, match='selected no weather stations'):
+        util.get_job_station_list('job-2')
+
+
+def test_filter_obs_by_time_chunk_reports_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(util, 'get_availability_index', lambda table: None)
+    monkeypatch.setattr(util, '_extract_chunk',
+                        lambda table, path, start, end, **kwargs: (path, 1000, 2 * 1024 ** 2))
+
+    updates = []
+    progress = util.ChunkProgress(lambda message, percent: updates.append((percent, message)),
+                                  start_percent=5, end_percent=95, interval=0)
+
+    filter_obs_by_time_chunk('TD', str(tmp_path / 'station_data'), start='201701010000', end='202012312359',
+                             delimiter='comma', chunk_rule='year', processes=1, progress=progress)
+
+    assert [percent for percent, _ in updates] == [27, 50, 72, 95]
+    assert updates[-1][1].startswith('Extracted 4 of 4 time chunks: 4000 rows, 8.0 MB written (')
+    assert updates[-1][1].endswith(' MB/s).')
+
+
+def test_chunk_progress_is_throttled():
+    updates = []
+    progress = util.ChunkProgress(lambda message, percent: updates.append(percent), interval=3600)
+
+    for n_done in range(1, 11):
+        progress(n_done, 10, 10, 1024)
+
+    # The first and last chunks only
+    assert updates == [14, 95]
+    assert (progress.rows, progress.size) == (100, 10240)
+
+
+def test_scheduled_extraction_waits_for_a_slot(tmp_path, monkeypatch):
+    size_classes = parse_size_classes('small:1mb:1, large:*:1')
+    monkeypatch.setattr(util, 'get_scheduler',
+                        lambda: JobScheduler(str(tmp_path / 'scheduler.sqlite'), size_classes, poll_interval=0.01))
+
+    holder = util.get_scheduler()
+    updates = []
+    started = threading.Event()
+
+    def run_job():
+        with util.scheduled_extraction('large-2', 400 * 1024 ** 2, lambda message, percent: updates.append(message)):
+            started.set()
+
+    with holder.slot('large-1', 400 * 1024 ** 2):
+        thread = threading.Thread(target=run_job)
+        thread.start()
+
+        assert not started.wait(0.5)
+        assert updates == ['Waiting for a slot for large jobs (1 job(s) ahead).']
+
+    assert started.wait(10)
+    thread.join()
+    holder.close()
+
+    # No size classes configured
+    monkeypatch.setattr(util, 'get_scheduler', lambda: None)
+
+    with util.scheduled_extraction('small-1', 0):
+        pass
+
+
+def test_count_rows(tmp_path):
+    path = tmp_path / 'output.csv'
+
+    path.write_bytes(b'')
+    assert util._count_rows(str(path)) == 0
+
+    path.write_bytes(b'ob_end_time, src_id\r\n2017-01-01 09:00, 1039\r\n2017-01-02 09:00, 1039\r\n')
+    assert util._count_rows(str(path)) == 2
+
+    path.write_bytes(b'ob_end_time, src_id\r\n2017-01-01 09:00, 1039')
+    assert util._count_rows(str(path)) == 1
+
+
+@pytest.mark.parametrize('compression', ['none', 'gzip'])
+def test_extract_chunk_records_etag(tmp_path, monkeypatch, compression):
+    def extract(table_name, output_path, **kwargs):
+        with open(output_path, 'w') as writer:
+            writer.write('ob_end_time, src_id\n2017-01-01 09:00, 1039\n')
+
+    monkeypatch.setattr(util, 'filter_observations_with_cache', extract)
+    output_path = str(tmp_path / ('output.csv' if compression == 'none' else 'output.csv.gz'))
+
+    (_, rows, size) = util._extract_chunk('TD', output_path, compression=compression)
+    assert (rows, size) == (1, os.path.getsize(output_path))
+
+    (etag, weak) = get_etag(output_path, os.stat(output_path))
+
+    if not weak:
+        assert etag == file_digest(output_path)
+
+
+def test_combine_time_chunks(tmp_path):
+    chunk_paths = []
+
+    for (name, rows) in [('a', '2017-01-01 09:00, 1039\n'), ('b', ''), ('c', '2019-01-01 09:00, 57199\n')]:
+        path = tmp_path / 'station_data-{}.csv'.format(name)
+        path.write_text('ob_end_time, src_id\n' + rows)
+        chunk_paths.append(str(path))
+
+    assert util.combine_time_chunks(chunk_paths[:1], str(tmp_path / 'station_data')) == chunk_paths[:1]
+
+    output_paths = util.combine_time_chunks(chunk_paths, str(tmp_path / 'station_data'), delimiter='comma')
+
+    assert output_paths == [str(tmp_path / 'station_data.csv')] + chunk_paths
+    assert open(output_paths[0]).read() == ('ob_end_time, src_id\n2017-01-01 09:00, 1039\n'
+                                            '2019-01-01 09:00, 57199\n')
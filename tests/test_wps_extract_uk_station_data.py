@@ -1,4 +1,6 @@
 import dateutil.parser as dp
+import json
+import os
 import pandas
 import pytest
 import re
@@ -6,6 +8,8 @@ import re
 from pywps.tests import assert_response_success
 
 from .common import get_output, run_with_inputs
+from goldfinch import util
+from goldfinch.job_registry import JobRegistry
 from goldfinch.processes.wps_extract_uk_station_data import ExtractUKStationData
 
 data_inputs = ['obs_table=TD;delimiter=tab;counties=DEVON;DateRange=2017-01-01/2019-01-31',
@@ -28,6 +32,17 @@ large_inputs = ['obs_table=TD;delimiter=tab;counties=DEVON;DateRange=2017-01-01/
 station_inputs = ['56810', '17101,1007', '1039,57199,1144']
 
 
+@pytest.fixture
+def job_registry(tmp_path, monkeypatch):
+    "Registers job-1, which selected two stations, and job-2, which selected none."
+    registry_path = str(tmp_path / 'jobs.sqlite')
+    monkeypatch.setattr(util, 'get_job_registry', lambda: JobRegistry(registry_path))
+
+    util.register_job('job-1', 'GetWeatherStations', str(tmp_path), str(tmp_path / 'weather_stations.txt'),
+                      ['1039', '57199'])
+    util.register_job('job-2', 'GetWeatherStations', str(tmp_path), str(tmp_path / 'weather_stations.txt'), [])
+
+
 def _extract_filepath(url):
     parts = url.split('/')
     path = '/tmp/' + '/'.join(parts[-2:])
@@ -130,3 +145,122 @@ def test_wps_extract_uk_station_id_match_csv(load_test_data, station_ids):
     assert 'doc_links_file' in output
 
 
+def test_wps_extract_uk_station_data_parquet(load_test_data):
+    pytest.importorskip('pyarrow')
+    station_ids = '1039,57199,1144'
+    datainputs = f"obs_table=TD;station_ids={station_ids};DateRange=2017-01-01/2019-10-02;output_format=parquet"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    output_file = _extract_filepath(output['output'])
+    assert output_file.endswith('.parquet')
+
+    df = pandas.read_parquet(output_file)
+    assert set(df['src_id'].to_list()) == set(map(int, station_ids.split(',')))
+    assert str(df['ob_end_time'].dtype).startswith('datetime64')
+    assert 'output_files' in output
+
+
+def test_wps_extract_uk_station_data_gzip(load_test_data):
+    station_ids = '17101,1007'
+    datainputs = f"obs_table=TD;station_ids={station_ids};DateRange=2017-01-01/2019-10-02;compression=gzip"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    output_file = _extract_filepath(output['output'])
+    assert output_file.endswith('.csv.gz')
+
+    df = pandas.read_csv(output_file, skipinitialspace=True, compression='gzip')
+    assert set(df['src_id'].to_list()) == set(map(int, station_ids.split(',')))
+
+
+def test_wps_extract_uk_station_data_chunked(load_test_data):
+    datainputs = "obs_table=TD;station_ids=1039,57199,1144;DateRange=2017-01-01/2019-10-02;chunk_rule=year"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    # The output holds the rows of all of the yearly chunks, in order
+    df = pandas.read_csv(_extract_filepath(output['output']), skipinitialspace=True)
+
+    with open(_extract_filepath(output['output_files'])) as reader:
+        chunk_files = [_extract_filepath(url) for url in re.findall(r'<metaurl[^>]*>([^<]+)</metaurl>',
+                                                                    reader.read())]
+
+    assert len(chunk_files) == 3
+    chunks = pandas.concat([pandas.read_csv(chunk_file, skipinitialspace=True) for chunk_file in chunk_files],
+                           ignore_index=True)
+    assert df.equals(chunks)
+
+
+def test_wps_extract_uk_station_data_chunks_not_combined(load_test_data):
+    datainputs = ("obs_table=TD;station_ids=1039,57199,1144;DateRange=2017-01-01/2019-10-02;chunk_rule=year;"
+                  "combine_chunks=false")
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    # The output is the metalink file of the chunks, with no combined file written
+    with open(_extract_filepath(output['output'])) as reader:
+        chunk_files = [_extract_filepath(url) for url in re.findall(r'<metaurl[^>]*>([^<]+)</metaurl>',
+                                                                    reader.read())]
+
+    assert len(chunk_files) == 3
+    assert not os.path.exists(os.path.join(os.path.dirname(chunk_files[0]), 'station_data.csv'))
+
+
+def test_wps_extract_uk_station_data_dry_run(load_test_data):
+    datainputs = "obs_table=TD;station_ids=1039,57199;DateRange=2017-01-01/2019-10-02;dry_run=true"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    # No data is extracted
+    assert 'output' not in output
+    assert 'stations' in output
+
+    plan = json.loads(output['dry_run_plan'])
+    assert plan['station_count'] == 2
+    assert plan['chunks'][0]['start'] == '201701010000'
+    assert plan['chunks'][-1]['end'] == '201910022359'
+    assert plan['estimated_size'] == sum(chunk['estimated_size'] for chunk in plan['chunks'])
+    assert plan['files']
+    assert not plan['exceeds_size_limit']
+
+
+def test_wps_extract_uk_station_data_dry_run_over_size_limit(load_test_data, size_limits):
+    # The plan of a request over the size limit is returned, saying so
+    datainputs = "obs_table=TD;counties=DEVON;DateRange=2017-01-01/2019-01-31;dry_run=true"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    plan = json.loads(get_output(resp.xml)['dry_run_plan'])
+    assert plan['size_limit'] == 5000000
+    assert plan['exceeds_size_limit']
+
+
+def test_wps_extract_uk_station_data_input_job_id(load_test_data, job_registry):
+    datainputs = "obs_table=TD;input_job_id=job-1;DateRange=2017-01-01/2019-10-02"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    df = pandas.read_csv(_extract_filepath(output['output']), skipinitialspace=True)
+    assert set(df['src_id'].to_list()) == {1039, 57199}
+
+
+@pytest.mark.parametrize('job_id', ['no-such-job', 'job-2'])
+def test_wps_extract_uk_station_data_bad_input_job_id_fail(job_registry, job_id):
+    # An unknown job, or one that selected no stations, does not fall back to all stations
+    datainputs = f"obs_table=TD;input_job_id={job_id};DateRange=2017-01-01/2019-10-02"
+    resp = run_with_inputs(ExtractUKStationData, datainputs)
+
+    assert "ExceptionReport" in resp.response[0].decode('utf-8')
@@ -1,4 +1,5 @@
 import dateutil.parser as dp
+import json
 import pandas
 import pytest
 import re
@@ -125,3 +126,15 @@ def test_wps_extract_uk_station_id_match_csv(load_test_data, station_ids):
     assert 'doc_links_file' in output
 
 
+def test_wps_extract_uk_station_data_with_date_input_dry_run_over_size_limit(load_test_data, size_limits):
+    # The plan of a request over the size limit is returned, saying so
+    datainputs = "obs_table=TD;counties=DEVON;TemporalRange=2017-01-01/2019-01-31;dry_run=true"
+    resp = run_with_inputs(ExtractUKStationDataWithDateInput, datainputs)
+
+    assert_response_success(resp)
+    output = get_output(resp.xml)
+
+    assert 'output' not in output
+    plan = json.loads(output['dry_run_plan'])
+    assert plan['size_limit'] == 5000000
+    assert plan['exceeds_size_limit']